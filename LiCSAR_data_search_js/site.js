@@ -11,8 +11,12 @@ var site_vars = {
   'metadata_path': 'LiCSAR_data_search_metadata',
   /* path to main frames file: */
   'frames_path': 'frames.json',
+  /* path to frames summary file: */
+  'frames_summary_path': 'frames_summary.json',
   /* variable for storing list of frames: */
   'frames': null,
+  /* variable for storing frames summary: */
+  'frames_summary': null,
   /* frame inputs container: */
   'frames_inputs': document.getElementById('frame_id_inputs'),
   /* remove / add frame button: */
@@ -31,6 +35,9 @@ var site_vars = {
   'input_include_epoch_files': document.getElementsByName('input_include_epoch_files[]'),
   /* interferogram files checkboxes: */
   'input_include_ifg_files': document.getElementsByName('input_include_ifg_files[]'),
+  /* epoch and interferogram files checkbox containers: */
+  'div_select_epochs': document.getElementById('select_epochs'),
+  'div_select_ifgs': document.getElementById('select_ifgs'),
   /* search button: */
   'button_search_files': document.getElementById('button_search_files'),
   /* search results: */
@@ -46,7 +53,9 @@ var site_vars = {
   /* urls for download script templates: */
   'python_script_template': 'LiCSAR_data_search_scripts/get_licsar_files.py',
   'wget_script_template': 'LiCSAR_data_search_scripts/wget_licsar_files.sh',
-  'curl_script_template': 'LiCSAR_data_search_scripts/curl_licsar_files.sh'
+  'curl_script_template': 'LiCSAR_data_search_scripts/curl_licsar_files.sh',
+  /* maximum number of files for each curl command in the curl script: */
+  'curl_batch_size': 1000
 };
 
 /** functions: **/
@@ -92,6 +101,76 @@ function setup_inputs() {
   site_vars['button_search_files'].disabled = false;
 };
 
+/* function to replace the default epoch and interferogram files checkboxes
+   in the page with those from the product schema in the frames summary: */
+function setup_file_inputs() {
+  /* product schema: */
+  var products = site_vars['frames_summary']['products'];
+  /* loop through epoch and interferogram files: */
+  var file_types = [
+    ['epoch', 'epoch_files', site_vars['div_select_epochs']],
+    ['ifg', 'ifg_files', site_vars['div_select_ifgs']]
+  ];
+  for (var i = 0; i < file_types.length; i++) {
+    var file_type = file_types[i][0];
+    var product_type = file_types[i][1];
+    var select_div = file_types[i][2];
+    /* product files for this type. if the summary has no schema, use the
+       list of file patterns, with nothing selected: */
+    if (products) {
+      var product_files = products[product_type];
+    } else {
+      var product_files = [];
+      var file_patterns = site_vars['frames_summary'][product_type];
+      for (var j = 0; j < file_patterns.length; j++) {
+        product_files.push({
+          'pattern': file_patterns[j],
+          'label': file_patterns[j],
+          'selected': false
+        });
+      };
+    };
+    /* remove the existing checkboxes, keeping the selection of any files
+       which are also in the schema: */
+    var file_checked = {};
+    var file_divs = select_div.getElementsByClassName('select_data');
+    while (file_divs.length > 0) {
+      var file_inputs = file_divs[0].getElementsByTagName('input');
+      for (var j = 0; j < file_inputs.length; j++) {
+        file_checked[file_inputs[j].value] = file_inputs[j].checked;
+      };
+      select_div.removeChild(file_divs[0]);
+    };
+    /* loop through product files: */
+    for (var j = 0; j < product_files.length; j++) {
+      var product_file = product_files[j];
+      /* element id, from the file pattern: */
+      var file_id = file_type + '_' +
+                    product_file['pattern'].replace(/[^A-Za-z0-9]/g, '_');
+      /* create the checkbox and label: */
+      var file_div = document.createElement('div');
+      file_div.id = 'select_' + file_id;
+      file_div.className = 'select_data';
+      var file_label = document.createElement('label');
+      file_label.textContent = product_file['label'];
+      var file_input = document.createElement('input');
+      file_input.id = 'input_include_' + file_id;
+      file_input.type = 'checkbox';
+      file_input.name = 'input_include_' + file_type + '_files[]';
+      file_input.value = product_file['pattern'];
+      if (product_file['pattern'] in file_checked) {
+        file_input.checked = file_checked[product_file['pattern']];
+      } else {
+        file_input.checked = product_file['selected'];
+      };
+      /* add the elements to the page: */
+      file_div.appendChild(file_label);
+      file_div.appendChild(file_input);
+      select_div.appendChild(file_div);
+    };
+  };
+};
+
 /* function to set up the page: */
 function page_setup() {
   /* get display style for search results elements: */
@@ -127,6 +206,28 @@ function load_frames() {
   };
   /* send the request: */
   frames_req.send(null);
+  /* path to frames summary json file: */
+  var summary_url = site_vars['metadata_path'] + '/' +
+                    site_vars['frames_summary_path'];
+  /* create new request: */
+  var summary_req = new XMLHttpRequest();
+  summary_req.responseType = 'json';
+  summary_req.open('GET', summary_url, true);
+  /* on data download: */
+  summary_req.onload = function() {
+    /* if successful, store frames summary information, and create the
+       files checkboxes. else the default checkboxes in the page are
+       used: */
+    if (summary_req.status == 200) {
+      site_vars['frames_summary'] = summary_req.response;
+      setup_file_inputs();
+    } else {
+      /* log error: */
+      console.log('failed to load frames summary information');
+    };
+  };
+  /* send the request: */
+  summary_req.send(null);
 };
 
 /* function to format file size: */
@@ -145,8 +246,124 @@ function format_size(file_size) {
   return file_size_format;
 };
 
-/* function to get frame information from json file: */
-async function get_frame_info(frame_id) {
+/* function to decode compact epoch or interferogram information: */
+function decode_frame_entries(encoded, date_keys) {
+  /* init decoded information: */
+  var entries = {};
+  /* file patterns: */
+  var patterns = encoded['patterns'];
+  /* file mtimes, if recorded, are stored as the difference from the previous
+     mtime: */
+  var mtimes = null;
+  if ('mtimes' in encoded) {
+    mtimes = [];
+    var file_mtime = 0;
+    for (var i = 0; i < encoded['mtimes'].length; i++) {
+      file_mtime += encoded['mtimes'][i];
+      mtimes.push(file_mtime);
+    };
+  };
+  /* index of the next size value: */
+  var size_index = 0;
+  /* loop through entries: */
+  for (var i = 0; i < encoded['files'].length; i++) {
+    /* file and link bitmasks for this entry: */
+    var files_mask = encoded['files'][i];
+    var links_mask = encoded['links'][i];
+    /* init entry, with dates: */
+    var entry = {};
+    var entry_dates = [];
+    for (var j = 0; j < date_keys.length; j++) {
+      var entry_date = encoded[date_keys[j] + 's'][i];
+      entry[date_keys[j]] = entry_date;
+      entry_dates.push(entry_date);
+    };
+    entry['files'] = [];
+    entry['sizes'] = [];
+    entry['links'] = [];
+    if (mtimes != null) {
+      entry['mtimes'] = [];
+    };
+    /* loop through patterns, and store information for those present: */
+    for (var j = 0; j < patterns.length; j++) {
+      var pattern_bit = 1 << j;
+      if (files_mask & pattern_bit) {
+        entry['files'].push(patterns[j]);
+        entry['sizes'].push(encoded['sizes'][size_index]);
+        entry['links'].push((links_mask & pattern_bit) ? 1 : 0);
+        if (mtimes != null) {
+          entry['mtimes'].push(mtimes[size_index]);
+        };
+        size_index += 1;
+      };
+    };
+    /* entry name is the dates joined with underscores: */
+    entries[entry_dates.join('_')] = entry;
+  };
+  /* return the decoded information: */
+  return entries;
+};
+
+/* function to decode frame information from any format: */
+function decode_frame_info(frame_info) {
+  /* format version, full format if not specified: */
+  var version = frame_info['version'] || 1;
+  /* compact format: */
+  if (version == 2) {
+    frame_info = {
+      'id': frame_info['id'],
+      'path': frame_info['path'],
+      'metadata': frame_info['metadata'],
+      'epochs': decode_frame_entries(frame_info['epochs'], ['date']),
+      'ifgs': decode_frame_entries(frame_info['ifgs'], ['start', 'end'])
+    };
+  };
+  /* return the frame information: */
+  return frame_info;
+};
+
+/* function to get frame information for a sharded frame, loading only
+   the shards which overlap the start and end dates: */
+async function get_frame_shards(frame_header, frame_dir, start_date,
+                                end_date) {
+  /* init frame information: */
+  var frame_info = {
+    'id': frame_header['id'],
+    'path': frame_header['path'],
+    'metadata': frame_header['metadata'],
+    'epochs': {},
+    'ifgs': {}
+  };
+  /* loop through shards: */
+  var shards = frame_header['shards'];
+  for (var i = 0; i < shards.length; i++) {
+    /* skip shards which do not overlap the date range: */
+    if ((shards[i]['end'] < start_date) || (shards[i]['start'] > end_date)) {
+      continue;
+    };
+    /* path to shard json file: */
+    var shard_url = site_vars['metadata_path'] + '/' + frame_dir + '/' +
+                    shards[i]['file'];
+    /* get shard info using fetch: */
+    var shard_req = await fetch(shard_url);
+    /* if not successful, log error and move on: */
+    if (shard_req.status != 200) {
+      console.log('* failed to load shard ' + shards[i]['name'] +
+                  ' for frame ' + frame_header['id']);
+      continue;
+    };
+    /* add shard information to the frame information: */
+    var shard_info = decode_frame_info(await shard_req.json());
+    Object.assign(frame_info['epochs'], shard_info['epochs']);
+    Object.assign(frame_info['ifgs'], shard_info['ifgs']);
+  };
+  /* return the frame information: */
+  return frame_info;
+};
+
+/* function to get frame information from json file. for sharded frames,
+   only the shards which overlap the start and end dates are loaded: */
+async function get_frame_info(frame_id, start_date, end_date) {
   /* directory which contains json for this frame: */
   var frame_dir = frame_id.split('_')[0];
   /* path to frame json file: */
@@ -158,6 +375,13 @@ async function get_frame_info(frame_id) {
   if (frame_req.status == 200) {
     /* frame information from request: */
     var frame_info = await frame_req.json();
+    /* if the frame is sharded, load the required shards: */
+    if (frame_info['version'] == 3) {
+      frame_info = await get_frame_shards(frame_info, frame_dir, start_date,
+                                          end_date);
+    } else {
+      frame_info = decode_frame_info(frame_info);
+    };
   } else {
     /* log error: */
     console.log('* failed to load frame information for frame ' + frame_id);
@@ -226,6 +450,7 @@ function search_frames_info(frames_info) {
       var frame_metadata_files = frame_metadata['files'];
       var frame_metadata_sizes = frame_metadata['sizes'];
       var frame_metadata_links = frame_metadata['links'];
+      var frame_metadata_mtimes = frame_metadata['mtimes'] || [];
       for (var j = 0; j < frame_metadata_files.length; j++) {
         /* remote url for this file: */
         var metadata_file = frame_metadata_files[j];
@@ -245,7 +470,8 @@ function search_frames_info(frames_info) {
           'name': metadata_file,
           'path': frame_id + '/metadata',
           'url': metadata_file_url,
-          'size': metadata_size
+          'size': metadata_size,
+          'mtime': frame_metadata_mtimes[j]
         })
         /* update counts and sizes: */
         frame_results['metadata_count'] += 1;
@@ -288,6 +514,7 @@ function search_frames_info(frames_info) {
         var frame_epoch_files = frame_epoch_info['files'];
         var frame_epoch_sizes = frame_epoch_info['sizes'];
         var frame_epoch_links = frame_epoch_info['links'];
+        var frame_epoch_mtimes = frame_epoch_info['mtimes'] || [];
         for (var j = 0; j < frame_epoch_files.length; j++) {
           /* skip if this file type is not requested: */
           if (include_epoch_files.indexOf(frame_epoch_files[j]) < 0) {
@@ -311,7 +538,8 @@ function search_frames_info(frames_info) {
             'name': frame_epoch_file,
             'path': frame_id + '/epochs/' + frame_epoch,
             'url': frame_epoch_file_url,
-            'size': frame_epoch_size
+            'size': frame_epoch_size,
+            'mtime': frame_epoch_mtimes[j]
           })
           /* update counts and sizes: */
           frame_results['epochs_count'] += 1;
@@ -356,6 +584,7 @@ function search_frames_info(frames_info) {
         var ifg_pair_files = ifg_pair_info['files'];
         var ifg_pair_sizes = ifg_pair_info['sizes'];
         var ifg_pair_links = ifg_pair_info['links'];
+        var ifg_pair_mtimes = ifg_pair_info['mtimes'] || [];
         for (var j = 0; j < ifg_pair_files.length; j++) {
           /* skip if this file type is not requested: */
           if (include_ifg_files.indexOf(ifg_pair_files[j]) < 0) {
@@ -380,7 +609,8 @@ function search_frames_info(frames_info) {
             'name': ifg_pair_file,
             'path': frame_id + '/interferograms/' + ifg_pair,
             'url': ifg_pair_file_url,
-            'size': ifg_pair_size
+            'size': ifg_pair_size,
+            'mtime': ifg_pair_mtimes[j]
           })
           /* update counts and sizes: */
           frame_results['ifgs_count'] += 1;
@@ -552,6 +782,69 @@ function display_search_results() {
   results_count_el.scrollIntoView();
 };
 
+/* function to get values of checked input elements: */
+function get_checked_values(input_els) {
+  /* init list of values: */
+  var checked_values = [];
+  /* loop through input elements: */
+  for (var i = 0; i < input_els.length; i++) {
+    /* if the box is checked, store the value: */
+    if (input_els[i].checked == true) {
+      checked_values.push(input_els[i].value);
+    };
+  };
+  /* return the values: */
+  return checked_values;
+};
+
+/* function to check the frames summary for whether a search could return
+   any files for a frame. returns true if the summary is not available: */
+function summary_has_results(frame_id) {
+  /* get the summary information: */
+  var frames_summary = site_vars['frames_summary'];
+  if ((frames_summary == null) ||
+      (frames_summary['frames'][frame_id] == undefined)) {
+    return true;
+  };
+  var frame_summary = frames_summary['frames'][frame_id];
+  /* function to check if any requested file types have data: */
+  function has_files(files, sizes, include_files) {
+    for (var i = 0; i < files.length; i++) {
+      if ((include_files.indexOf(files[i]) > -1) && (sizes[i] > 0)) {
+        return true;
+      };
+    };
+    return false;
+  };
+  /* check metadata: */
+  if ((site_vars['input_include_metadata'].checked == true) &&
+      (frame_summary['metadata_sizes'].some(function(i) { return i > 0; }))) {
+    return true;
+  };
+  /* get requested start and end dates: */
+  var start_date = site_vars['input_start_date'].value;
+  start_date = parseInt(start_date.replace(/-/g, ''));
+  var end_date = site_vars['input_end_date'].value;
+  end_date = parseInt(end_date.replace(/-/g, ''));
+  /* no epochs or interferograms if dates do not overlap: */
+  if ((frame_summary['first'] == null) ||
+      (frame_summary['last'] < start_date) ||
+      (frame_summary['first'] > end_date)) {
+    return false;
+  };
+  /* check epoch and interferogram files: */
+  var include_epoch_files = get_checked_values(
+    site_vars['input_include_epoch_files']
+  );
+  var include_ifg_files = get_checked_values(
+    site_vars['input_include_ifg_files']
+  );
+  return (has_files(frames_summary['epoch_files'],
+                    frame_summary['epoch_sizes'], include_epoch_files) ||
+          has_files(frames_summary['ifg_files'],
+                    frame_summary['ifg_sizes'], include_ifg_files));
+};
+
 /* function to filter unique values from array: */
 function get_unique(value, index, array) {
   return array.indexOf(value) === index;
@@ -568,14 +861,32 @@ async function search_files() {
   };
   /* get unique frame ids: */
   input_frame_ids = input_frame_ids.filter(get_unique);
+  /* get requested start and end dates: */
+  var start_date = site_vars['input_start_date'].value;
+  start_date = parseInt(start_date.replace(/-/g, ''));
+  var end_date = site_vars['input_end_date'].value;
+  end_date = parseInt(end_date.replace(/-/g, ''));
   /* list for storing all frame info: */
   var frames_info = [];
   /* search for data for each frame id: */
   for (var i = 0; i < input_frame_ids.length; i++) {
     /* current frame id: */
     var selected_frame_id = input_frame_ids[i];
+    /* frames which can not have any results, according to the frames
+       summary, are not fetched, but are listed with no files: */
+    if (summary_has_results(selected_frame_id) == false) {
+      frames_info.push({
+        'id': selected_frame_id,
+        'path': null,
+        'metadata': {'files': []},
+        'epochs': {},
+        'ifgs': {}
+      });
+      continue;
+    };
     /* get frame info: */
-    frames_info.push(await get_frame_info(selected_frame_id));
+    frames_info.push(await get_frame_info(selected_frame_id, start_date,
+                                          end_date));
   };
   /* search using retrieved frame info: */
   var search_results = search_frames_info(frames_info);
@@ -585,67 +896,178 @@ async function search_files() {
   display_search_results();
 };
 
-/* function to return a python script to download found files: */
-async function get_script_python() {
-  /* get script template using fetch: */
-  var python_template_req = await fetch(site_vars['python_script_template']);
-  var python_template = await python_template_req.text();
-  /* init text for list of files: */
-  var file_text = '';
+/* function to return the number of leading characters which a value
+   shares with the previous value: */
+function get_shared(prev_value, value) {
+  var shared = 0;
+  while (shared < prev_value.length && shared < value.length &&
+         prev_value[shared] == value[shared]) {
+    shared += 1;
+  };
+  return shared;
+};
+
+/* function to return the found files as a list, in order: */
+function get_results_files() {
+  /* init list of files: */
+  var results_list = [];
   /* results file types: */
   var results_types = ['metadata', 'epochs', 'ifgs'];
   /* results for all frames: */
   var frames_results = site_vars['search_results']['frames'];
-  /* total file count: */
-  var total_file_count = site_vars['search_results']['total_count'];
-  /* file count: */
-  var file_count = 0;
-  /* loop throuhg frames: */
+  /* loop through frames: */
   for (var i = 0; i < frames_results.length; i++) {
     /* results for this frame: */
     var frame_results = frames_results[i];
-    /* loop through types: */
+    /* loop through types, and add the files for each: */
     for (var j = 0; j < results_types.length; j++) {
-      /* this file type: */
-      var results_type = results_types[j];
-      /* results for this file type: */
-      var results_files = frame_results[results_type];
-      /* loop through search results: */
+      var results_files = frame_results[results_types[j]];
       for (var k = 0; k < results_files.length; k++) {
-          /* increment file count: */
-          file_count += 1;
-          /* details for this file: */
-          var file_name = results_files[k]['name'];
-          var file_path = results_files[k]['path'];
-          var file_url = results_files[k]['url'];
-          var file_size = results_files[k]['size'];
-          /* commands to make output directory and python file: */
-          file_text += '    {\'name\': \'' + file_name + '\', \'path\': \'' +
-                       file_path + '\', \'url\': \'' + file_url +
-                       '\', \'size\': ' + file_size + '}';
-          if (file_count < total_file_count) {
-            file_text += ',\n';
-          };
+        results_list.push(results_files[k]);
       };
     };
   };
-  /* search and replace file list in template: */
-  var script_text = python_template.replace('{{ FILES }}', file_text);
-  /* script text header: */
-  var script_text_header = 'data:text/plain;charset=utf-8,';
-  /* encode text data: */
-  var encoded_uri = script_text_header + encodeURIComponent(script_text);
-  /* name for text file: */
-  var text_name = 'get_licsar_files.py';
+  /* return the list of files: */
+  return results_list;
+};
+
+/* function to return the manifest of found files for the python download
+   script. each line is a tab separated record. base urls are listed once,
+   and each directory record sets the base url, the url directory and the
+   output path for the files which follow it. directory and file names are
+   stored as the number of characters shared with the previous value and
+   the remaining characters, and mtimes as the difference from the
+   previous mtime: */
+function get_manifest() {
+  /* found files: */
+  var results_files = get_results_files();
+  /* known base urls, longest first: */
+  var known_urls = [site_vars['remote_base_url'] + '/',
+                    site_vars['remote_links_base_url'] + '/'];
+  known_urls.sort(function(a, b) { return b.length - a.length; });
+  /* base urls in use, and previous values: */
+  var base_urls = [];
+  var prev_dir = null;
+  var prev_url_dir = '';
+  var prev_path = '';
+  var prev_name = '';
+  var prev_mtime = 0;
+  /* init list of manifest lines, with the header: */
+  var manifest_lines = [
+    ['LICSAR_MANIFEST', 1, site_vars['search_results']['total_count'],
+     site_vars['search_results']['total_size']].join('\t')
+  ];
+  /* loop through files: */
+  for (var i = 0; i < results_files.length; i++) {
+    /* details for this file: */
+    var file_name = results_files[i]['name'];
+    var file_path = results_files[i]['path'];
+    var file_url = results_files[i]['url'];
+    var file_size = results_files[i]['size'];
+    var file_mtime = results_files[i]['mtime'];
+    /* url directory, without the file name: */
+    var url_dir = file_url.slice(0, file_url.length - file_name.length);
+    /* add base url and directory records if the directory has changed: */
+    if (url_dir + '\t' + file_path != prev_dir) {
+      var base_url = url_dir.slice(0, url_dir.indexOf('/', 8) + 1);
+      for (var j = 0; j < known_urls.length; j++) {
+        if (url_dir.startsWith(known_urls[j])) {
+          base_url = known_urls[j];
+          break;
+        };
+      };
+      var base_index = base_urls.indexOf(base_url);
+      if (base_index < 0) {
+        base_urls.push(base_url);
+        base_index = base_urls.length - 1;
+        manifest_lines.push(['U', base_url].join('\t'));
+      };
+      var url_dir_rel = url_dir.slice(base_url.length);
+      var url_shared = get_shared(prev_url_dir, url_dir_rel);
+      var path_shared = get_shared(prev_path, file_path);
+      manifest_lines.push([
+        'D', base_index, url_shared, url_dir_rel.slice(url_shared),
+        path_shared, file_path.slice(path_shared)
+      ].join('\t'));
+      prev_dir = url_dir + '\t' + file_path;
+      prev_url_dir = url_dir_rel;
+      prev_path = file_path;
+    };
+    /* add file record. an mtime which is not known is left empty: */
+    var name_shared = get_shared(prev_name, file_name);
+    var mtime_delta = '';
+    if (file_mtime != undefined) {
+      mtime_delta = file_mtime - prev_mtime;
+      prev_mtime = file_mtime;
+    };
+    manifest_lines.push([
+      'F', name_shared, file_name.slice(name_shared), file_size, mtime_delta
+    ].join('\t'));
+    prev_name = file_name;
+  };
+  /* return the manifest text: */
+  return manifest_lines.join('\n') + '\n';
+};
+
+/* function to return the manifest as comment lines to embed at the end of
+   the python download script. the manifest is zlib compressed and base64
+   encoded if the browser supports compression, else stored as text: */
+async function embed_manifest(manifest_text) {
+  /* uncompressed: */
+  if (typeof CompressionStream == 'undefined') {
+    var manifest_lines = manifest_text.split('\n');
+    manifest_lines.pop();
+    return '#LICSAR_MANIFEST text\n#' + manifest_lines.join('\n#') + '\n';
+  };
+  /* compress. the deflate format is zlib format: */
+  var compressed_stream = new Blob([manifest_text]).stream().pipeThrough(
+    new CompressionStream('deflate')
+  );
+  var compressed = new Uint8Array(
+    await new Response(compressed_stream).arrayBuffer()
+  );
+  /* base64 encode, in lines of 57 bytes: */
+  var embed_text = '#LICSAR_MANIFEST zlib\n';
+  for (var i = 0; i < compressed.length; i += 57) {
+    embed_text += '#' + btoa(String.fromCharCode.apply(
+      null, compressed.subarray(i, i + 57)
+    )) + '\n';
+  };
+  /* return the text to embed: */
+  return embed_text;
+};
+
+/* function to save script text as a file. the text is stored as a blob,
+   rather than encoded in a data url, so large scripts are not copied: */
+function save_script(script_text, text_name) {
+  /* url for the text data: */
+  var text_blob = new Blob([script_text], {'type': 'text/plain'});
+  var text_url = URL.createObjectURL(text_blob);
   /* create a temporary link element: */
   var text_link = document.createElement("a");
-  text_link.setAttribute("href", encoded_uri);
+  text_link.setAttribute("href", text_url);
   text_link.setAttribute("download", text_name);
   text_link.style.visibility = 'hidden';
   /* add link to document, click to init download, then remove: */
   document.body.appendChild(text_link);
   text_link.click();
   document.body.removeChild(text_link);
+  /* release the text once the download has started: */
+  setTimeout(function() { URL.revokeObjectURL(text_url); }, 10000);
+};
+
+/* function to return a python script to download found files: */
+async function get_script_python() {
+  /* get script template using fetch: */
+  var python_template_req = await fetch(site_vars['python_script_template']);
+  var python_template = await python_template_req.text();
+  /* the manifest of files is embedded at the end of the script, and read
+     by the script as it is needed: */
+  var file_text = await embed_manifest(get_manifest());
+  /* search and replace file list in template: */
+  var script_text = python_template.replace('{{ FILES }}\n', file_text);
+  /* save the script: */
+  save_script(script_text, 'get_licsar_files.py');
 };
 
 /* function to return a wget script to download found files: */
@@ -655,50 +1077,29 @@ async function get_script_wget() {
   var wget_template = await wget_template_req.text();
   /* init text for list of files: */
   var file_text = '';
-  /* results file types: */
-  var results_types = ['metadata', 'epochs', 'ifgs'];
-  /* results for all frames: */
-  var frames_results = site_vars['search_results']['frames'];
-  /* loop throuhg frames: */
-  for (var i = 0; i < frames_results.length; i++) {
-    /* results for this frame: */
-    var frame_results = frames_results[i];
-    /* loop through types: */
-    for (var j = 0; j < results_types.length; j++) {
-      /* this file type: */
-      var results_type = results_types[j];
-      /* results for this file type: */
-      var results_files = frame_results[results_type];
-      /* loop through search results: */
-      for (var k = 0; k < results_files.length; k++) {
-          /* details for this file: */
-          var file_name = results_files[k]['name'];
-          var file_path = results_files[k]['path'];
-          var file_url = results_files[k]['url'];
-          /* commands to make output directory and wget file: */
-          file_text += 'mkdir -p "${OUT_DIR}/' + file_path + '"\n';
-          file_text += 'wget ${WGET_OPTIONS} -P \'' + file_path +
-                       '\' \'' + file_url + '\'\n';
+  /* found files: */
+  var results_files = get_results_files();
+  /* one wget command for the files in each directory, which reads the
+     urls from the script and makes the directory: */
+  for (var i = 0; i < results_files.length; i++) {
+    var file_path = results_files[i]['path'];
+    var file_url = results_files[i]['url'];
+    if (i == 0 || file_path != results_files[i - 1]['path']) {
+      if (i > 0) {
+        file_text += 'EOF\n';
       };
+      file_text += 'wget ${WGET_OPTIONS} -P "${OUT_DIR}/' + file_path +
+                   '" -i - << \'EOF\'\n';
     };
+    file_text += file_url + '\n';
+  };
+  if (results_files.length > 0) {
+    file_text += 'EOF\n';
   };
   /* search and replace file list in template: */
   var script_text = wget_template.replace('{{ FILES }}', file_text);
-  /* script text header: */
-  var script_text_header = 'data:text/plain;charset=utf-8,';
-  /* encode text data: */
-  var encoded_uri = script_text_header + encodeURIComponent(script_text);
-  /* name for text file: */
-  var text_name = 'wget_licsar_files.sh';
-  /* create a temporary link element: */
-  var text_link = document.createElement("a");
-  text_link.setAttribute("href", encoded_uri);
-  text_link.setAttribute("download", text_name);
-  text_link.style.visibility = 'hidden';
-  /* add link to document, click to init download, then remove: */
-  document.body.appendChild(text_link);
-  text_link.click();
-  document.body.removeChild(text_link);
+  /* save the script: */
+  save_script(script_text, 'wget_licsar_files.sh');
 };
 
 /* function to return a curl script to download found files: */
@@ -708,50 +1109,32 @@ async function get_script_curl() {
   var curl_template = await curl_template_req.text();
   /* init text for list of files: */
   var file_text = '';
-  /* results file types: */
-  var results_types = ['metadata', 'epochs', 'ifgs'];
-  /* results for all frames: */
-  var frames_results = site_vars['search_results']['frames'];
-  /* loop throuhg frames: */
-  for (var i = 0; i < frames_results.length; i++) {
-    /* results for this frame: */
-    var frame_results = frames_results[i];
-    /* loop through types: */
-    for (var j = 0; j < results_types.length; j++) {
-      /* this file type: */
-      var results_type = results_types[j];
-      /* results for this file type: */
-      var results_files = frame_results[results_type];
-      /* loop through search results: */
-      for (var k = 0; k < results_files.length; k++) {
-          /* details for this file: */
-          var file_name = results_files[k]['name'];
-          var file_path = results_files[k]['path'];
-          var file_url = results_files[k]['url'];
-          /* commands to make output directory and curl file: */
-          file_text += 'mkdir -p "${OUT_DIR}/' + file_path + '"\n';
-          file_text += 'curl ${CURL_OPTIONS} -o \'' + file_path + '/' +
-                       file_name + '\' \'' + file_url + '\'\n';
+  /* found files: */
+  var results_files = get_results_files();
+  /* curl commands for batches of files, which read the url and output
+     path of each file from the script, and make the directories: */
+  var batch_size = site_vars['curl_batch_size'];
+  for (var i = 0; i < results_files.length; i++) {
+    var file_name = results_files[i]['name'];
+    var file_path = results_files[i]['path'];
+    var file_url = results_files[i]['url'];
+    if (i % batch_size == 0) {
+      if (i > 0) {
+        file_text += 'EOF\n';
       };
+      file_text += 'curl ${CURL_OPTIONS} --create-dirs -K - << EOF\n';
     };
+    file_text += 'url = "' + file_url + '"\n';
+    file_text += 'output = "${OUT_DIR}/' + file_path + '/' + file_name +
+                 '"\n';
+  };
+  if (results_files.length > 0) {
+    file_text += 'EOF\n';
   };
   /* search and replace file list in template: */
   var script_text = curl_template.replace('{{ FILES }}', file_text);
-  /* script text header: */
-  var script_text_header = 'data:text/plain;charset=utf-8,';
-  /* encode text data: */
-  var encoded_uri = script_text_header + encodeURIComponent(script_text);
-  /* name for text file: */
-  var text_name = 'curl_licsar_files.sh';
-  /* create a temporary link element: */
-  var text_link = document.createElement("a");
-  text_link.setAttribute("href", encoded_uri);
-  text_link.setAttribute("download", text_name);
-  text_link.style.visibility = 'hidden';
-  /* add link to document, click to init download, then remove: */
-  document.body.appendChild(text_link);
-  text_link.click();
-  document.body.removeChild(text_link);
+  /* save the script: */
+  save_script(script_text, 'curl_licsar_files.sh');
 };
 
 /* add frame input element: */
@@ -4,25 +4,78 @@
 # ---
 
 from __future__ import division
-from ctypes import c_int
-import datetime
-from multiprocessing import Manager, Pool
+import base64
+import collections
+from email.utils import formatdate, mktime_tz, parsedate_tz
+import gzip
+import heapq
+import itertools
+import json
 import os
+import random
+import socket
 import sys
+import threading
 import time
+import zlib
 try:
-    from urllib.request import Request, urlopen
+    from http.client import HTTPConnection, HTTPException, HTTPSConnection
+    from urllib.parse import urljoin, urlsplit
 except ImportError:
-    from urllib2 import Request, urlopen
+    from httplib import HTTPConnection, HTTPException, HTTPSConnection
+    from urlparse import urljoin, urlsplit
 
 # ---
 
 OUT_DIR = '.'
-POOL_SIZE = 2
-LICSAR_FILES = [
-{{ FILES }}
-]
-TOTAL_SIZE = sum([i['size'] for i in LICSAR_FILES])
+# path to a manifest of the files to download. by default the manifest at
+# the end of this script is used. a path can also be given as the first
+# argument:
+MANIFEST_PATH = None
+# files are read from the manifest as they are needed, and scheduled in
+# batches:
+SCHEDULE_BATCH = 1000
+# number of download threads. the number in use starts at POOL_SIZE, and is
+# adjusted between the minimum and maximum against the measured throughput
+# and server errors every ADAPT_INTERVAL seconds:
+POOL_SIZE = 4
+POOL_SIZE_MIN = 1
+POOL_SIZE_MAX = 16
+ADAPT_INTERVAL = 3
+ADAPT_TOLERANCE = 0.05
+# failed downloads are retried after a delay which doubles for each attempt,
+# up to the maximum:
+RETRY_COUNT = 5
+RETRY_DELAY = 2
+RETRY_DELAY_MAX = 60
+RETRY_STATUS = [408, 429, 500, 502, 503, 504]
+# progress is displayed every PROGRESS_INTERVAL seconds, with the
+# throughput over the last RATE_WINDOW seconds, the average throughput and
+# the estimated time remaining:
+PROGRESS_INTERVAL = 0.5
+RATE_WINDOW = 5
+# path to a log of each download attempt, with timings and retries, and of
+# each change to the number of threads, as JSON lines, or None:
+LOG_PATH = None
+# files are read in chunks, which are small enough for the progress to
+# follow the bytes as they arrive on slow connections:
+CHUNK_SIZE = 65536
+PART_SUFFIX = '.part'
+# files of at least SEGMENT_MIN_SIZE bytes are downloaded in byte ranges of
+# SEGMENT_SIZE bytes by several threads at once, if the server supports
+# range requests. the segments which are complete are recorded in a file
+# with SEGMENTS_SUFFIX added to the partial file name:
+SEGMENT_MIN_SIZE = 33554432
+SEGMENT_SIZE = 8388608
+SEGMENTS_SUFFIX = '.segments'
+HTTP_TIMEOUT = 60
+MAX_REDIRECTS = 5
+USER_AGENT = 'get_licsar_files.py'
+MANIFEST_NAME = 'LICSAR_MANIFEST'
+MANIFEST_VERSION = 1
+EMBED_MARKER = b'#' + MANIFEST_NAME.encode('ascii')
+# open connections for each download thread, by url scheme and host:
+THREAD_DATA = threading.local()
 
 # ---
 
@@ -39,136 +92,998 @@ def format_size(value, total_size):
     value_str = '{0:5.01f}{1}'.format(value, units)
     return value_str
 
-def display_progress(progress_count, progress_total, current_size, total_size):
-    percent_complete = (current_size / total_size) * 100
+def format_time(seconds):
+    if seconds is None:
+        return '--:--:--'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{0:d}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+
+def display_progress(progress_count, progress_total, current_size, total_size,
+                     byte_rate, average_rate, time_left):
+    if total_size > 0:
+        percent_complete = (current_size / total_size) * 100
+    else:
+        percent_complete = 100
     current_size_str = format_size(current_size, total_size)
     total_size_str = format_size(total_size, total_size)
     file_count_fmt = '{{:{0}d}}'.format(len(str(progress_total)))
     progress_count_str = file_count_fmt.format(progress_count) 
     progress_total_str = file_count_fmt.format(progress_total) 
-    file_msg = '\r{0} of {1} files downloaded, {2} / {3} ({4:6.02f}%)'
+    byte_rate_str = format_size(byte_rate, byte_rate)
+    average_rate_str = format_size(average_rate, average_rate)
+    file_msg = ('\r{0} of {1} files, {2} / {3} ({4:6.02f}%), {5}/s, '
+                'average {6}/s, {7:>8} left')
     sys.stdout.flush()
     sys.stdout.write(file_msg.format(
         progress_count_str, progress_total_str,
         current_size_str, total_size_str,
-        percent_complete
+        percent_complete, byte_rate_str, average_rate_str,
+        format_time(time_left)
     ))
     sys.stdout.flush()
 
-def mp_wrapper(mp_options):
-    try:
-        mp_function = mp_options['mp_function']
-        mp_count = mp_options['mp_count']
-        mp_progress = mp_options['mp_progress']
-        mp_size = mp_options['mp_size']
-        mp_lock = mp_options['mp_lock']
-        mp_display_progress = mp_options['mp_display_progress']
-        file_size = mp_options['size']
-        total_size = mp_options['total_size']
-        if mp_display_progress:
-            mp_lock.acquire()
-            display_progress(
-                mp_progress.value, mp_count, mp_size.value, total_size
-            )
-            mp_lock.release()
-        mp_out = mp_function(mp_options)
-        mp_progress.value += 1
-        mp_size.value += file_size
-        if mp_display_progress:
-            mp_lock.acquire()
-            display_progress(
-                mp_progress.value, mp_count, mp_size.value, total_size
+def make_dir(out_dir):
+    # another thread may make the same directory:
+    if not os.path.isdir(out_dir):
+        try:
+            os.makedirs(out_dir)
+        except OSError:
+            if not os.path.isdir(out_dir):
+                raise
+
+def read_embedded(script_path):
+    # the manifest is stored as comments after the marker line at the end of
+    # this script, either as text or zlib compressed and base64 encoded:
+    with open(script_path, 'rb') as script_fh:
+        embed_encoding = None
+        for script_line in script_fh:
+            if script_line.startswith(EMBED_MARKER):
+                embed_encoding = script_line.split()[-1]
+                break
+        if embed_encoding == b'text':
+            for script_line in script_fh:
+                yield script_line[1:]
+            return
+        if embed_encoding != b'zlib':
+            raise ValueError('no manifest found in {0}'.format(script_path))
+        decompressor = zlib.decompressobj()
+        manifest_data = b''
+        for script_line in script_fh:
+            manifest_data += decompressor.decompress(
+                base64.b64decode(script_line[1:].strip())
             )
-            mp_lock.release()
-        return mp_out
-    except KeyboardInterrupt:
+            manifest_lines = manifest_data.split(b'\n')
+            manifest_data = manifest_lines.pop()
+            for manifest_line in manifest_lines:
+                yield manifest_line
+        manifest_data += decompressor.flush()
+        if manifest_data:
+            yield manifest_data
+
+def read_manifest_file(manifest_path):
+    # the manifest file may be gzip compressed:
+    with open(manifest_path, 'rb') as manifest_fh:
+        gzip_file = manifest_fh.read(2) == b'\x1f\x8b'
+        manifest_fh.seek(0)
+        if gzip_file:
+            manifest_fh = gzip.GzipFile(fileobj=manifest_fh)
+        for manifest_line in manifest_fh:
+            yield manifest_line
+
+def read_files(manifest_lines):
+    # each directory record sets the base url, and the url directory and
+    # output path as the number of characters kept from the previous value
+    # and the characters which follow. each file record follows its
+    # directory, with the name stored in the same way and the mtime as the
+    # difference from the previous mtime:
+    base_urls = []
+    dir_url = None
+    url_dir = ''
+    file_path = ''
+    file_name = ''
+    file_mtime = 0
+    for manifest_line in manifest_lines:
+        record = manifest_line.decode('utf-8').rstrip('\r\n').split('\t')
+        if record[0] == 'U':
+            base_urls.append(record[1])
+        elif record[0] == 'D':
+            url_dir = url_dir[:int(record[2])] + record[3]
+            file_path = file_path[:int(record[4])] + record[5]
+            dir_url = base_urls[int(record[1])] + url_dir
+        elif record[0] == 'F':
+            file_name = file_name[:int(record[1])] + record[2]
+            options = {
+                'name': file_name, 'path': file_path,
+                'url': dir_url + file_name, 'size': int(record[3])
+            }
+            if record[4]:
+                file_mtime += int(record[4])
+                options['mtime'] = file_mtime
+            yield options
+
+def open_manifest(manifest_path=None):
+    # returns the file count and total size from the manifest header, and a
+    # generator of the files, which are read as they are needed:
+    if manifest_path is None:
+        manifest_lines = read_embedded(os.path.abspath(__file__))
+    else:
+        manifest_lines = read_manifest_file(manifest_path)
+    header = next(manifest_lines, b'').decode('utf-8').rstrip('\r\n')
+    header = header.split('\t')
+    if header[0] != MANIFEST_NAME or len(header) < 4:
+        raise ValueError('not a manifest of LiCSAR files')
+    if int(header[1]) > MANIFEST_VERSION:
+        raise ValueError('unsupported manifest version {0}'.format(header[1]))
+    return int(header[2]), int(header[3]), read_files(manifest_lines)
+
+class HTTPStatusError(IOError):
+    def __init__(self, req_response, req_url):
+        self.status = req_response.status
+        self.retry_after = req_response.getheader('Retry-After')
+        err_msg = 'HTTP error {0} {1} for {2}'.format(
+            req_response.status, req_response.reason, req_url
+        )
+        IOError.__init__(self, err_msg)
+
+class DownloadStopped(Exception):
+    pass
+
+def get_connections():
+    if not hasattr(THREAD_DATA, 'connections'):
+        THREAD_DATA.connections = {}
+    return THREAD_DATA.connections
+
+def close_connections():
+    http_conns = get_connections()
+    for http_conn in http_conns.values():
+        http_conn.close()
+    http_conns.clear()
+
+def get_connection(conn_key):
+    http_conns = get_connections()
+    http_conn = http_conns.get(conn_key)
+    if http_conn is None:
+        url_scheme, url_host = conn_key
+        if url_scheme == 'https':
+            http_conn = HTTPSConnection(url_host, timeout=HTTP_TIMEOUT)
+        else:
+            http_conn = HTTPConnection(url_host, timeout=HTTP_TIMEOUT)
+        http_conns[conn_key] = http_conn
+    return http_conn
+
+def close_response(req_response, drop=False):
+    # the connection can only be used again once the whole response has been
+    # read, otherwise it is closed:
+    if drop:
+        req_response.close()
+        http_conn = get_connections().pop(req_response.conn_key, None)
+        if http_conn is not None:
+            http_conn.close()
+    else:
+        req_response.read()
+        req_response.close()
+
+def get_url(req_url, req_headers=None):
+    url_headers = {'User-Agent': USER_AGENT}
+    if req_headers:
+        url_headers.update(req_headers)
+    for i in range(MAX_REDIRECTS + 1):
+        url_parts = urlsplit(req_url)
+        url_path = url_parts.path or '/'
+        if url_parts.query:
+            url_path = '{0}?{1}'.format(url_path, url_parts.query)
+        conn_key = (url_parts.scheme, url_parts.netloc)
+        # a kept alive connection may have been closed by the server since
+        # it was last used, in which case it is opened again:
+        while True:
+            http_conn = get_connection(conn_key)
+            conn_reused = http_conn.sock is not None
+            try:
+                http_conn.request('GET', url_path, headers=url_headers)
+                req_response = http_conn.getresponse()
+                break
+            except (HTTPException, socket.error):
+                http_conn.close()
+                if not conn_reused:
+                    raise
+        req_response.conn_key = conn_key
+        req_location = req_response.getheader('Location')
+        if req_response.status in [301, 302, 303, 307, 308] and req_location:
+            close_response(req_response)
+            req_url = urljoin(req_url, req_location)
+            continue
+        return req_response
+    raise IOError('too many redirects for {0}'.format(req_url))
+
+def get_mtime(http_date):
+    http_time = None
+    if http_date:
+        http_time = parsedate_tz(http_date)
+    if http_time is None:
         return None
+    return mktime_tz(http_time)
 
-def mp_run(mp_function, mp_options, pool_size, mp_display_progress=True):
-    mp_options_new = []
-    for i in range(pool_size):
-        mp_options_new += mp_options[i::pool_size]
-    mp_options = mp_options_new
-    del mp_options_new
-    mp_manager = Manager()
-    mp_progress = mp_manager.Value(c_int, 0)
-    mp_size = mp_manager.Value(c_int, 0)
-    mp_lock = mp_manager.Lock()
-    for mp_option in mp_options:
-        mp_option['mp_function'] = mp_function
-        mp_option['mp_count'] = len(mp_options)
-        mp_option['mp_progress'] = mp_progress
-        mp_option['mp_size'] = mp_size
-        mp_option['total_size'] = TOTAL_SIZE
-        mp_option['mp_lock'] = mp_lock
-        mp_option['mp_display_progress'] = mp_display_progress
-    mp_pool = Pool(pool_size)
-    mp_result = mp_pool.map_async(mp_wrapper, mp_options)
+def replace_file(src_path, dst_path):
     try:
-        mp_out = mp_result.get()
-        mp_pool.close()
-        mp_pool.join()
-    except KeyboardInterrupt:
-        try:
-            mp_pool.terminate()
-            mp_pool.join()
-        except:
-            pass
-        sys.stdout.write('\n')
-        sys.exit()
-    display_progress(len(mp_options), len(mp_options), TOTAL_SIZE, TOTAL_SIZE)
-    sys.stdout.write('\n')
-    sys.stdout.flush()
-    mp_manager.shutdown()
-    return mp_out
-
-def make_dirs():
-    licsar_dirs = list(set([i['path'] for i in LICSAR_FILES]))
-    for licsar_dir in licsar_dirs:
-        out_dir = os.sep.join([OUT_DIR, licsar_dir])
-        if not os.path.exists(out_dir):
-            os.makedirs(out_dir)
+        os.replace(src_path, dst_path)
+    except AttributeError:
+        if os.path.exists(dst_path):
+            os.remove(dst_path)
+        os.rename(src_path, dst_path)
+
+def get_out_paths(options):
+    out_dir = os.sep.join([OUT_DIR, options['path']])
+    out_path = os.sep.join([out_dir, options['name']])
+    return out_dir, out_path, out_path + PART_SUFFIX
+
+def get_content_range(req_response):
+    # returns the start, end and total size from the Content-Range header:
+    content_range = req_response.getheader('Content-Range') or ''
+    try:
+        range_span, range_total = content_range.split(' ')[-1].split('/')
+        range_start, range_end = range_span.split('-')
+        return int(range_start), int(range_end), int(range_total)
+    except ValueError:
+        return None
 
-def get_url(req_url):
-    url_request = Request(req_url)
-    req_response = urlopen(url_request)
-    return req_response
-
-def check_url(req_url):
-    req_response = get_url(req_url)
-    req_info = req_response.info()
-    req_size = int(req_info['Content-Length'])
-    req_mtime = time.mktime(
-        datetime.datetime.strptime(
-            req_info['Last-Modified'],
-            '%a, %d %b %Y %H:%M:%S GMT'
-        ).utctimetuple()
-    )
-    req_response.close()
-    return req_size, req_mtime
-
-def get_file(options):
-    file_name = options['name']
-    file_path = options['path']
+def remove_files(*file_paths):
+    for file_path in file_paths:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+def get_file(options, progress=None, add_segments=None):
+    # returns 'current' if the file is already up to date, else
+    # 'downloaded'. if add_segments is given, large files are downloaded
+    # in segments, in which case the remaining segments are passed to
+    # add_segments, and 'segment' is returned if the first segment is not
+    # the last to complete:
     file_url = options['url']
-    out_dir = os.sep.join([OUT_DIR, file_path])
-    out_path = os.sep.join([out_dir, file_name])
-    remote_size, remote_mtime = check_url(file_url)
+    out_dir, out_path, part_path = get_out_paths(options)
+    # an existing file with the size and mtime which were recorded in the
+    # metadata is up to date, without contacting the server:
+    local_stat = None
     if os.path.exists(out_path):
         local_stat = os.stat(out_path)
-        local_size = local_stat.st_size
-        local_mtime = local_stat.st_mtime
-        if remote_size == local_size and remote_mtime == local_mtime:
+        if (options.get('mtime') is not None and
+                local_stat.st_size == options['size'] and
+                int(local_stat.st_mtime) == options['mtime']):
+            return 'current'
+    # else, a single conditional request is made for the file. an existing
+    # file is only downloaded again if the remote file is newer, and a
+    # partial file is resumed from its end if the remote file has the same
+    # mtime:
+    req_headers = {}
+    if local_stat is not None:
+        req_headers['If-Modified-Since'] = formatdate(
+            local_stat.st_mtime, usegmt=True
+        )
+    if add_segments is not None and options['size'] >= SEGMENT_MIN_SIZE:
+        return get_segmented(options, req_headers, local_stat, progress,
+                             add_segments)
+    # a partial file which was written in segments can not be resumed from
+    # its end:
+    segments_path = part_path + SEGMENTS_SUFFIX
+    if os.path.exists(segments_path):
+        remove_files(part_path, segments_path)
+    part_size = 0
+    if os.path.exists(part_path):
+        part_stat = os.stat(part_path)
+        part_size = part_stat.st_size
+        if part_size > 0:
+            req_headers['Range'] = 'bytes={0}-'.format(part_size)
+            req_headers['If-Range'] = formatdate(
+                part_stat.st_mtime, usegmt=True
+            )
+    req_response = get_url(file_url, req_headers)
+    req_status = req_response.status
+    if req_status == 304:
+        close_response(req_response)
+        return 'current'
+    # range not satisfiable, start again:
+    if req_status == 416:
+        close_response(req_response)
+        os.remove(part_path)
+        return get_file(options, progress)
+    if req_status not in [200, 206]:
+        close_response(req_response)
+        raise HTTPStatusError(req_response, file_url)
+    return save_response(req_response, options, local_stat, progress)
+
+def save_response(req_response, options, local_stat=None, progress=None):
+    # saves a whole or resumed file from a response:
+    file_url = options['url']
+    out_dir, out_path, part_path = get_out_paths(options)
+    req_status = req_response.status
+    remote_mtime = get_mtime(req_response.getheader('Last-Modified'))
+    if req_status == 206:
+        part_mode = 'ab'
+        remote_size = req_response.getheader('Content-Range').split('/')[-1]
+    else:
+        part_mode = 'wb'
+        remote_size = req_response.getheader('Content-Length')
+    if remote_size is not None:
+        remote_size = int(remote_size)
+    # in case the server ignored If-Modified-Since:
+    if (req_status == 200 and local_stat is not None and
+            local_stat.st_size == remote_size and
+            local_stat.st_mtime == remote_mtime):
+        close_response(req_response, drop=True)
+        return 'current'
+    make_dir(out_dir)
+    # stream to disk in chunks. the partial file is given the mtime of the
+    # remote file, so it can be resumed if the download is interrupted:
+    part_done = False
+    part_size = 0
+    try:
+        with open(part_path, part_mode) as out_fh:
+            while True:
+                file_chunk = req_response.read(CHUNK_SIZE)
+                if not file_chunk:
+                    break
+                out_fh.write(file_chunk)
+                if progress is not None:
+                    progress(len(file_chunk))
+        part_size = os.path.getsize(part_path)
+        part_done = remote_size is None or part_size == remote_size
+    finally:
+        close_response(req_response, drop=not part_done)
+        if remote_mtime is not None and os.path.exists(part_path):
+            os.utime(part_path, (remote_mtime, remote_mtime))
+    # the partial file is kept to resume from if the download is incomplete:
+    if not part_done:
+        err_msg = 'incomplete download of {0}, {1} of {2} bytes'.format(
+            file_url, part_size, remote_size
+        )
+        raise IOError(err_msg)
+    replace_file(part_path, out_path)
+    return 'downloaded'
+
+class FileChanged(IOError):
+    pass
+
+class SegmentedFile(object):
+    # a large file which is downloaded in byte ranges by several threads,
+    # written in to a preallocated partial file. the segments which are
+    # complete are recorded in a segments file, so an interrupted download
+    # can be resumed:
+    def __init__(self, options):
+        self.options = options
+        self.out_dir, self.out_path, self.part_path = get_out_paths(options)
+        self.segments_path = self.part_path + SEGMENTS_SUFFIX
+        self.size = options['size']
+        self.segment_count = (self.size + SEGMENT_SIZE - 1) // SEGMENT_SIZE
+        self.mtime = None
+        self.done = set()
+        self.first_index = None
+        self.part_fh = None
+        self.lock = threading.Lock()
+        self.cancelled = False
+        # number of segments being downloaded. the partial file is only
+        # closed once none are writing to it:
+        self.active = 0
+        # bytes read for complete segments, which is updated by the
+        # downloader:
+        self.bytes_read = 0
+
+    def load(self):
+        # an interrupted download is resumed if it was for the same size of
+        # file and segments:
+        try:
+            with open(self.segments_path, 'r') as segments_fh:
+                segments_info = json.load(segments_fh)
+            if (segments_info['size'] == self.size and
+                    segments_info['segment_size'] == SEGMENT_SIZE and
+                    segments_info['mtime'] is not None and
+                    len(segments_info['done']) < self.segment_count and
+                    os.path.getsize(self.part_path) == self.size):
+                self.mtime = segments_info['mtime']
+                self.done = set(segments_info['done'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def save(self):
+        # called with the lock held:
+        tmp_path = self.segments_path + '.tmp'
+        with open(tmp_path, 'w') as segments_fh:
+            json.dump({
+                'size': self.size, 'segment_size': SEGMENT_SIZE,
+                'mtime': self.mtime, 'done': sorted(self.done)
+            }, segments_fh)
+        replace_file(tmp_path, self.segments_path)
+
+    def remove(self):
+        remove_files(self.part_path, self.segments_path)
+
+    def get_pending(self):
+        return [i for i in range(self.segment_count) if i not in self.done]
+
+    def get_range(self, index):
+        seg_start = index * SEGMENT_SIZE
+        seg_end = min(seg_start + SEGMENT_SIZE, self.size) - 1
+        return seg_start, seg_end
+
+    def open(self, remote_mtime):
+        # a new partial file is preallocated at its full size, so segments
+        # can be written at their offsets as they arrive:
+        make_dir(self.out_dir)
+        if self.done:
+            self.part_fh = open(self.part_path, 'r+b')
+        else:
+            self.part_fh = open(self.part_path, 'w+b')
+            self.part_fh.truncate(self.size)
+            try:
+                os.posix_fallocate(self.part_fh.fileno(), 0, self.size)
+            except (AttributeError, OSError):
+                pass
+        with self.lock:
+            self.mtime = remote_mtime
+            self.save()
+
+    def close(self):
+        # may be called more than once:
+        with self.lock:
+            part_fh = self.part_fh
+            self.part_fh = None
+        if part_fh is not None:
+            part_fh.close()
+
+    def start_segment(self):
+        # returns False if the download has been cancelled:
+        with self.lock:
+            if self.cancelled:
+                return False
+            self.active += 1
+            return True
+
+    def end_segment(self):
+        with self.lock:
+            self.active -= 1
+            close_file = self.cancelled and not self.active
+        if close_file:
+            self.close()
+
+    def cancel(self):
+        # segments which are still waiting are skipped, and the partial file
+        # is closed once no segments are writing to it. the partial file and
+        # segments file are kept, to resume from:
+        with self.lock:
+            self.cancelled = True
+            close_file = not self.active
+        if close_file:
+            self.close()
+
+    def write(self, file_data, offset):
+        # positional writes, so the threads do not share a file position:
+        if hasattr(os, 'pwrite'):
+            part_fd = self.part_fh.fileno()
+            while file_data:
+                write_size = os.pwrite(part_fd, file_data, offset)
+                file_data = file_data[write_size:]
+                offset += write_size
+        else:
+            with self.lock:
+                self.part_fh.seek(offset)
+                self.part_fh.write(file_data)
+
+    def segment_done(self, index):
+        # returns True if this was the last segment, once the file is
+        # complete:
+        with self.lock:
+            if self.cancelled:
+                return False
+            self.done.add(index)
+            if len(self.done) < self.segment_count:
+                self.save()
+                return False
+        self.close()
+        part_size = os.path.getsize(self.part_path)
+        if part_size != self.size:
+            err_msg = 'incomplete download of {0}, {1} of {2} bytes'.format(
+                self.options['url'], part_size, self.size
+            )
+            raise IOError(err_msg)
+        if self.mtime is not None:
+            os.utime(self.part_path, (self.mtime, self.mtime))
+        replace_file(self.part_path, self.out_path)
+        remove_files(self.segments_path)
+        return True
+
+def get_segmented(options, req_headers, local_stat, progress, add_segments):
+    # the first request is for the first segment which is not complete. if
+    # the server returns the range, the remaining segments are passed to
+    # add_segments to be downloaded by other threads:
+    seg_file = SegmentedFile(options)
+    seg_file.load()
+    pending = seg_file.get_pending()
+    seg_start, seg_end = seg_file.get_range(pending[0])
+    req_headers['Range'] = 'bytes={0}-{1}'.format(seg_start, seg_end)
+    if seg_file.mtime is not None:
+        req_headers['If-Range'] = formatdate(seg_file.mtime, usegmt=True)
+    req_response = get_url(options['url'], req_headers)
+    req_status = req_response.status
+    if req_status == 304:
+        close_response(req_response)
+        return 'current'
+    # if the remote file has changed since an interrupted download, start
+    # again, or if it is smaller than expected, download it in one piece:
+    if req_status == 416 or (req_status == 200 and seg_file.mtime):
+        close_response(req_response, drop=True)
+        seg_file.remove()
+        if req_status == 416:
+            return get_file(options, progress)
+        return get_file(options, progress, add_segments)
+    # the server does not support ranges:
+    if req_status == 200:
+        return save_response(req_response, options, local_stat, progress)
+    if req_status != 206:
+        close_response(req_response)
+        raise HTTPStatusError(req_response, options['url'])
+    # if the remote file is not the expected size, download it in one
+    # piece:
+    if get_content_range(req_response) != (seg_start, seg_end, seg_file.size):
+        close_response(req_response, drop=True)
+        seg_file.remove()
+        return get_file(options, progress)
+    seg_file.first_index = pending[0]
+    seg_file.open(get_mtime(req_response.getheader('Last-Modified')))
+    add_segments(seg_file, pending[1:])
+    return get_segment(seg_file, pending[0], progress, req_response)
+
+def get_segment(seg_file, index, progress=None, req_response=None):
+    # returns 'downloaded' if this was the last segment, else 'segment':
+    if not seg_file.start_segment():
+        if req_response is not None:
+            close_response(req_response, drop=True)
+        return 'segment'
+    try:
+        return get_segment_data(seg_file, index, progress, req_response)
+    finally:
+        seg_file.end_segment()
+
+def get_segment_data(seg_file, index, progress=None, req_response=None):
+    file_url = seg_file.options['url']
+    seg_start, seg_end = seg_file.get_range(index)
+    if req_response is None:
+        req_headers = {'Range': 'bytes={0}-{1}'.format(seg_start, seg_end)}
+        if seg_file.mtime is not None:
+            req_headers['If-Range'] = formatdate(seg_file.mtime, usegmt=True)
+        req_response = get_url(file_url, req_headers)
+        if req_response.status in [200, 206, 416] and (
+            get_content_range(req_response) !=
+            (seg_start, seg_end, seg_file.size)
+        ):
+            close_response(req_response, drop=True)
+            raise FileChanged('{0} changed during download'.format(file_url))
+        if req_response.status != 206:
+            close_response(req_response)
+            raise HTTPStatusError(req_response, file_url)
+    # stream the segment to its offset in the partial file:
+    seg_offset = seg_start
+    try:
+        while seg_offset <= seg_end:
+            file_chunk = req_response.read(
+                min(CHUNK_SIZE, seg_end + 1 - seg_offset)
+            )
+            if not file_chunk:
+                break
+            seg_file.write(file_chunk, seg_offset)
+            seg_offset += len(file_chunk)
+            if progress is not None:
+                progress(len(file_chunk))
+    finally:
+        close_response(req_response, drop=seg_offset <= seg_end)
+    if seg_offset <= seg_end:
+        err_msg = 'incomplete download of {0}, bytes {1}-{2}'.format(
+            file_url, seg_start, seg_end
+        )
+        raise IOError(err_msg)
+    if seg_file.segment_done(index):
+        return 'downloaded'
+    return 'segment'
+
+def schedule_files(licsar_files):
+    # largest files first, so the download does not end on one large file,
+    # with the smallest files interleaved to keep the other threads busy:
+    sorted_files = sorted(licsar_files, key=lambda i: i['size'], reverse=True)
+    scheduled_files = []
+    while sorted_files:
+        scheduled_files.append(sorted_files.pop(0))
+        if sorted_files:
+            scheduled_files.append(sorted_files.pop())
+    return scheduled_files
+
+def get_retry_delay(download_err, attempt):
+    # returns the delay before a failed download is tried again, or None if
+    # it should not be:
+    if isinstance(download_err, HTTPStatusError):
+        if download_err.status not in RETRY_STATUS:
+            return None
+        if download_err.retry_after and download_err.retry_after.isdigit():
+            return min(int(download_err.retry_after), RETRY_DELAY_MAX)
+    elif not isinstance(download_err, (IOError, socket.error, HTTPException)):
+        return None
+    retry_delay = min(RETRY_DELAY * 2 ** attempt, RETRY_DELAY_MAX)
+    return retry_delay * random.uniform(0.5, 1)
+
+class Downloader(object):
+    def __init__(self, licsar_files, file_count, total_size, display=True,
+                 log_path=None):
+        # files not yet read, files and segments still to be downloaded,
+        # popped from the end of the list, and heap of files and segments
+        # waiting to be tried again, by time:
+        self.files = iter(licsar_files)
+        self.tasks = []
+        self.retries = []
+        self.retry_order = itertools.count()
+        self.lock = threading.Lock()
+        self.slots = threading.Condition(self.lock)
+        self.display = display
+        self.stopped = False
+        self.running = 0
+        self.finished = threading.Event()
+        self.pool_size = max(POOL_SIZE_MIN, min(POOL_SIZE, POOL_SIZE_MAX))
+        self.active = 0
+        # tasks being downloaded, which may add segments:
+        self.in_progress = 0
+        self.adapt_step = 1
+        self.adapt_rate = None
+        self.adapt_double = True
+        self.file_count = file_count
+        self.total_size = total_size
+        self.files_done = 0
+        # size of completed files, and bytes read for files in progress:
+        self.size_done = 0
+        self.size_partial = 0
+        self.bytes_read = 0
+        self.byte_rate = 0
+        self.start_time = None
+        self.errors = 0
+        self.failed = []
+        self.manifest_error = None
+        self.log_path = log_path
+        self.log_fh = None
+
+    def display_progress(self):
+        if not self.display:
+            return
+        with self.lock:
+            files_done = self.files_done
+            current_size = self.size_done + self.size_partial
+            bytes_read = self.bytes_read
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        # the time remaining is estimated from the current throughput:
+        size_left = max(self.total_size - current_size, 0)
+        time_left = None
+        if not size_left:
+            time_left = 0
+        elif self.byte_rate > 0:
+            time_left = size_left / self.byte_rate
+        display_progress(files_done, self.file_count, current_size,
+                         self.total_size, self.byte_rate, bytes_read / elapsed,
+                         time_left)
+
+    def write_log(self, log_record):
+        # called with the lock held:
+        if self.log_fh is not None:
+            log_record['time'] = round(time.time(), 3)
+            self.log_fh.write(json.dumps(log_record, sort_keys=True) + '\n')
+            self.log_fh.flush()
+
+    def log_task(self, options, attempt, task_start, task_bytes, task_status,
+                 download_err=None, retry_delay=None, index=None):
+        task_time = time.time() - task_start
+        log_record = {
+            'event': 'file', 'url': options['url'], 'size': options['size'],
+            'attempt': attempt, 'status': task_status,
+            'start': round(task_start, 3), 'elapsed': round(task_time, 3),
+            'bytes': task_bytes, 'threads': self.pool_size
+        }
+        if index is not None:
+            log_record['segment'] = index
+        if task_bytes and task_time > 0:
+            log_record['rate'] = int(round(task_bytes / task_time))
+        if download_err is not None:
+            log_record['error'] = str(download_err)
+            if isinstance(download_err, HTTPStatusError):
+                log_record['http_status'] = download_err.status
+        if retry_delay is not None:
+            log_record['retry_delay'] = round(retry_delay, 3)
+        self.write_log(log_record)
+
+    def add_bytes(self, byte_count):
+        with self.lock:
+            if self.stopped:
+                raise DownloadStopped()
+            self.bytes_read += byte_count
+            self.size_partial += byte_count
+
+    def read_tasks(self):
+        # reads and schedules the next batch of files from the manifest:
+        try:
+            licsar_files = list(itertools.islice(self.files, SCHEDULE_BATCH))
+        except Exception as manifest_err:
+            self.manifest_error = manifest_err
+            licsar_files = []
+        if not licsar_files:
+            self.files = None
+        self.tasks = [
+            (0, i, None) for i in reversed(schedule_files(licsar_files))
+        ]
+
+    def add_segments(self, seg_file, indexes):
+        # segments are downloaded before any other files, so the threads
+        # which are free join in with the file as soon as it starts:
+        with self.lock:
+            for index in reversed(indexes):
+                self.tasks.append((0, seg_file.options, (seg_file, index)))
+
+    def cancel_segments(self, seg_file):
+        # called with the lock held:
+        seg_file.cancel()
+        self.size_partial -= seg_file.bytes_read
+
+    def next_task(self):
+        # returns the next file, False if files are waiting to be tried
+        # again, or files in progress may add segments, or None if all are
+        # complete:
+        with self.lock:
+            task = None
+            if self.retries and self.retries[0][0] <= time.time():
+                task = heapq.heappop(self.retries)[2:]
+            else:
+                if not self.tasks and self.files is not None:
+                    self.read_tasks()
+                if self.tasks:
+                    task = self.tasks.pop()
+            if task is not None:
+                self.in_progress += 1
+                return task
+            if self.retries or self.in_progress:
+                return False
+            return None
+
+    def get_task(self, attempt, options, segment=None):
+        # bytes are counted as they are read. once the file is complete,
+        # its size is counted instead:
+        task_start = time.time()
+        task_bytes = [0]
+        def add_bytes(byte_count):
+            self.add_bytes(byte_count)
+            task_bytes[0] += byte_count
+        # a file which is started in segments continues as its first
+        # segment:
+        task_segments = []
+        def add_segments(seg_file, indexes):
+            task_segments.append(seg_file)
+            self.add_segments(seg_file, indexes)
+        seg_file = None
+        index = None
+        if segment is not None:
+            seg_file, index = segment
+            if seg_file.cancelled:
+                return
+        try:
+            if seg_file is None:
+                task_status = get_file(options, add_bytes, add_segments)
+            else:
+                task_status = get_segment(seg_file, index, add_bytes)
+        except DownloadStopped:
+            return
+        except Exception as download_err:
+            # only errors which may be temporary reduce the number of threads:
+            retry_delay = get_retry_delay(download_err, attempt)
+            with self.lock:
+                self.size_partial -= task_bytes[0]
+                # a file which failed during its first segment is retried
+                # from that segment:
+                if task_segments:
+                    seg_file = task_segments[0]
+                    index = seg_file.first_index
+                    segment = (seg_file, index)
+                if seg_file is not None and seg_file.cancelled:
+                    return
+                # a file which changed on the server during the download is
+                # started again, which replaces the partial file:
+                if seg_file is not None and isinstance(download_err,
+                                                       FileChanged):
+                    self.cancel_segments(seg_file)
+                    segment = None
+                elif retry_delay is not None:
+                    self.errors += 1
+                if retry_delay is None or attempt >= RETRY_COUNT:
+                    if seg_file is not None and not seg_file.cancelled:
+                        self.cancel_segments(seg_file)
+                    self.failed.append((options, download_err))
+                    self.files_done += 1
+                    self.log_task(options, attempt, task_start, task_bytes[0],
+                                  'failed', download_err, index=index)
+                else:
+                    heapq.heappush(self.retries, (
+                        time.time() + retry_delay, next(self.retry_order),
+                        attempt + 1, options, segment
+                    ))
+                    self.log_task(options, attempt, task_start, task_bytes[0],
+                                  'retry', download_err, retry_delay, index)
             return
-    file_req = get_url(file_url)
-    with open(out_path, 'wb') as out_fh:
-        out_fh.write(file_req.read())
-    file_req.close()
-    os.utime(out_path, (remote_mtime, remote_mtime))
+        with self.lock:
+            if task_segments:
+                seg_file = task_segments[0]
+                index = seg_file.first_index
+            # bytes for a segment are counted until the file is complete:
+            if task_status == 'segment':
+                if seg_file.cancelled:
+                    self.size_partial -= task_bytes[0]
+                else:
+                    seg_file.bytes_read += task_bytes[0]
+                self.log_task(options, attempt, task_start, task_bytes[0],
+                              task_status, index=index)
+                return
+            self.size_partial -= task_bytes[0]
+            if seg_file is not None:
+                self.size_partial -= seg_file.bytes_read
+            self.files_done += 1
+            self.size_done += options['size']
+            self.log_task(options, attempt, task_start, task_bytes[0],
+                          task_status, index=index)
+
+    def run_worker(self):
+        try:
+            while True:
+                with self.slots:
+                    while self.active >= self.pool_size and not self.stopped:
+                        self.slots.wait(1)
+                    if self.stopped:
+                        return
+                    self.active += 1
+                try:
+                    task = self.next_task()
+                    if task:
+                        try:
+                            self.get_task(*task)
+                        finally:
+                            with self.lock:
+                                self.in_progress -= 1
+                finally:
+                    with self.slots:
+                        self.active -= 1
+                        self.slots.notify()
+                if task is None:
+                    return
+                if task is False:
+                    time.sleep(0.5)
+        finally:
+            close_connections()
+            with self.lock:
+                self.running -= 1
+                if not self.running:
+                    self.finished.set()
+
+    def adapt(self, byte_rate, errors):
+        # halve the number of threads on errors, otherwise keep changing it
+        # in the same direction while throughput improves, and reverse the
+        # direction when it falls. the number is doubled until throughput
+        # first stops improving:
+        with self.slots:
+            pool_size = self.pool_size
+            if errors:
+                pool_size = self.pool_size // 2
+                self.adapt_step = 1
+                self.adapt_double = False
+            elif (self.adapt_rate is not None and
+                    byte_rate < self.adapt_rate * (1 - ADAPT_TOLERANCE)):
+                if not self.adapt_double:
+                    self.adapt_step = -self.adapt_step
+                    pool_size = self.pool_size + self.adapt_step
+                self.adapt_double = False
+            elif (self.adapt_rate is None or
+                    byte_rate > self.adapt_rate * (1 + ADAPT_TOLERANCE)):
+                if self.adapt_double:
+                    pool_size = self.pool_size * 2
+                else:
+                    pool_size = self.pool_size + self.adapt_step
+            else:
+                self.adapt_double = False
+            self.adapt_rate = byte_rate
+            self.pool_size = max(POOL_SIZE_MIN, min(pool_size, POOL_SIZE_MAX))
+            self.slots.notify_all()
+            self.write_log({
+                'event': 'adapt', 'rate': int(round(byte_rate)),
+                'errors': errors,
+                'threads': self.pool_size
+            })
+
+    def run(self):
+        if self.log_path is not None:
+            self.log_fh = open(self.log_path, 'a')
+        self.start_time = time.time()
+        self.display_progress()
+        self.running = POOL_SIZE_MAX
+        for i in range(POOL_SIZE_MAX):
+            worker = threading.Thread(target=self.run_worker)
+            worker.daemon = True
+            worker.start()
+        adapt_time = self.start_time
+        adapt_bytes = 0
+        adapt_errors = 0
+        # samples of the bytes read, for the throughput over the last
+        # RATE_WINDOW seconds:
+        rate_samples = collections.deque([(self.start_time, 0)])
+        try:
+            while not self.finished.wait(PROGRESS_INTERVAL):
+                sample_time = time.time()
+                with self.lock:
+                    bytes_read = self.bytes_read
+                    errors = self.errors
+                rate_samples.append((sample_time, bytes_read))
+                while (len(rate_samples) > 2 and
+                        rate_samples[1][0] <= sample_time - RATE_WINDOW):
+                    rate_samples.popleft()
+                self.byte_rate = (bytes_read - rate_samples[0][1]) / max(
+                    sample_time - rate_samples[0][0], 1e-6
+                )
+                self.display_progress()
+                adapt_elapsed = sample_time - adapt_time
+                if adapt_elapsed >= ADAPT_INTERVAL:
+                    self.adapt((bytes_read - adapt_bytes) / adapt_elapsed,
+                               errors - adapt_errors)
+                    adapt_time += adapt_elapsed
+                    adapt_bytes = bytes_read
+                    adapt_errors = errors
+        except KeyboardInterrupt:
+            with self.slots:
+                self.stopped = True
+                self.slots.notify_all()
+            # threads stop after their next chunk, or are left behind if
+            # they are waiting on the server:
+            self.finished.wait(5)
+            raise
+        finally:
+            self.close_log()
+        self.display_progress()
+        if self.display:
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+        return self.failed
+
+    def close_log(self):
+        with self.lock:
+            if self.log_fh is None:
+                return
+            self.write_log({
+                'event': 'summary', 'files': self.file_count,
+                'done': self.files_done, 'failed': len(self.failed),
+                'bytes': self.bytes_read,
+                'elapsed': round(time.time() - self.start_time, 3)
+            })
+            self.log_fh.close()
+            self.log_fh = None
 
 def main():
-    make_dirs()
-    mp_run(get_file, LICSAR_FILES, POOL_SIZE)
+    manifest_path = MANIFEST_PATH
+    if len(sys.argv) > 1:
+        manifest_path = sys.argv[1]
+    try:
+        file_count, total_size, licsar_files = open_manifest(manifest_path)
+    except (IOError, ValueError, zlib.error) as manifest_err:
+        sys.stderr.write('failed to read manifest : {0}\n'.format(
+            manifest_err
+        ))
+        sys.exit(1)
+    downloader = Downloader(licsar_files, file_count, total_size,
+                            log_path=LOG_PATH)
+    failed = downloader.run()
+    for options, download_err in failed:
+        err_msg = 'failed to download {0} : {1}\n'.format(
+            options['url'], download_err
+        )
+        sys.stderr.write(err_msg)
+    if downloader.manifest_error is not None:
+        sys.stderr.write('failed to read manifest : {0}\n'.format(
+            downloader.manifest_error
+        ))
+    if failed or downloader.manifest_error is not None:
+        sys.exit(1)
 
 if __name__ == '__main__':
     try:
@@ -176,3 +1091,7 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         sys.stdout.write('\n')
         sys.exit()
+
+# the manifest of files to download, which is read from here as it is
+# needed:
+{{ FILES }}
@@ -6,6 +6,13 @@ WORK_DIR=$(readlink -f $(dirname ${0}))
 PY_DIR="${WORK_DIR}/get_metadata"
 # name of python script:
 PY_SCRIPT='get_metadata.py'
+# options for python script, only rescan changed directories, and write
+# compressed copies of the output files:
+PY_OPTIONS='--incremental --compress'
+# number of parts to split the crawl in to by track. if greater than 1,
+# the parts are crawled by a slurm array job, followed by a job which
+# merges the results:
+PART_COUNT=1
 # name of job id file:
 JOB_ID="${PY_DIR}/job_id"
 
@@ -33,16 +40,45 @@ if [ ! -z "${LAST_JOB_ID}" ] ; then
     fi
   fi 
 fi
-# submit job:
-NEW_JOB_ID=$(sbatch \
-           --partition=par-single \
-           --cpus-per-task=4 \
-           --mem=2000 \
-           --time=00:30:00 \
-           --output=${PY_DIR}/${PY_SCRIPT}.out \
-           --error=${PY_DIR}/${PY_SCRIPT}.err \
-           --wrap="python3 ${PY_SCRIPT}" | \
-           awk '{print $NF}')
+# if splitting the crawl in to parts:
+if [ "${PART_COUNT}" -gt 1 ] ; then
+  # submit array job to crawl the parts:
+  PARTS_JOB_ID=$(sbatch \
+               --partition=par-single \
+               --array=0-$((PART_COUNT - 1)) \
+               --cpus-per-task=4 \
+               --mem=2000 \
+               --time=00:30:00 \
+               --output=${PY_DIR}/${PY_SCRIPT}.part_%a.out \
+               --error=${PY_DIR}/${PY_SCRIPT}.part_%a.err \
+               --wrap="python3 ${PY_SCRIPT} ${PY_OPTIONS} --part-count ${PART_COUNT}" | \
+               awk '{print $NF}')
+  # submit job to merge the parts once all parts have succeeded:
+  NEW_JOB_ID=$(sbatch \
+             --partition=par-single \
+             --dependency=afterok:${PARTS_JOB_ID} \
+             --cpus-per-task=1 \
+             --mem=2000 \
+             --time=00:30:00 \
+             --output=${PY_DIR}/${PY_SCRIPT}.out \
+             --error=${PY_DIR}/${PY_SCRIPT}.err \
+             --wrap="python3 ${PY_SCRIPT} ${PY_OPTIONS} --merge-parts --part-count ${PART_COUNT}" | \
+             awk '{print $NF}')
+else
+  # submit job. slurm sends SIGTERM to python two minutes before the
+  # walltime, so the crawl journal is saved, and the next job resumes the
+  # crawl from the journal:
+  NEW_JOB_ID=$(sbatch \
+             --partition=par-single \
+             --cpus-per-task=4 \
+             --mem=2000 \
+             --time=00:30:00 \
+             --signal=B:TERM@120 \
+             --output=${PY_DIR}/${PY_SCRIPT}.out \
+             --error=${PY_DIR}/${PY_SCRIPT}.err \
+             --wrap="exec python3 ${PY_SCRIPT} ${PY_OPTIONS} --resume" | \
+             awk '{print $NF}')
+fi
 # record job id:
 echo "${NEW_JOB_ID}" > ${JOB_ID}
 # end message:
@@ -0,0 +1,622 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the python download script against a local HTTP server which
+supports range requests, so downloads in a single stream and in segments
+can be tested and compared offline. The server can also be run on its own,
+to serve a directory to download scripts from the search site
+"""
+
+# ---
+
+# std lib imports:
+import argparse
+from email.utils import formatdate, parsedate_to_datetime
+import hashlib
+import http.server
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, unquote, urlsplit
+# local imports:
+import metadata_manifest
+
+# ---
+
+# Path to the download script template, relative to this module:
+SCRIPT_TEMPLATE = os.sep.join([
+    '..', 'LiCSAR_data_search_scripts', 'get_licsar_files.py'
+])
+
+# Template constants which are set for each download mode. Files are not
+# downloaded in segments in the single mode:
+DOWNLOAD_MODES = {
+    'single': {'SEGMENT_MIN_SIZE': 2 ** 62},
+    'segmented': {}
+}
+
+# Fake files, as the number of large and small files and their sizes in
+# bytes:
+LARGE_COUNT = 2
+LARGE_SIZE = 67108864
+SMALL_COUNT = 16
+SMALL_SIZE = 1048576
+
+# Server throughput per connection in bytes per second, or 0 for no limit,
+# latency of each request in seconds, and fraction of requests which fail
+# with a temporary error:
+SERVER_RATE = 8388608
+SERVER_LATENCY = 0.02
+SERVER_FAIL_RATE = 0.0
+
+# Size of data chunks which are written and sent:
+CHUNK_SIZE = 65536
+
+# Timeout for each download run in seconds:
+RUN_TIMEOUT = 3600
+
+# Wrapper which runs a download script, and on exit writes the number of
+# partial files which the process still has open to a file. Open files are
+# listed from /proc, so are only counted on Linux:
+RUN_WRAPPER = '''
+import atexit, os, runpy, sys
+script_path, count_path = sys.argv[1:3]
+def count_open_parts():
+    if not os.path.isdir('/proc/self/fd'):
+        return
+    open_parts = 0
+    for fd_name in os.listdir('/proc/self/fd'):
+        try:
+            fd_path = os.readlink(os.path.join('/proc/self/fd', fd_name))
+        except OSError:
+            continue
+        if fd_path.endswith('.part'):
+            open_parts += 1
+    with open(count_path, 'w') as count_file:
+        count_file.write(str(open_parts))
+atexit.register(count_open_parts)
+sys.argv = [script_path]
+runpy.run_path(script_path, run_name='__main__')
+'''
+
+# ---
+
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve files from the data path of the server, with single byte range,
+    If-Range and If-Modified-Since requests, and optional throughput limit,
+    latency and temporary failures
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_file(False)
+
+    def do_GET(self):
+        self.send_file(True)
+
+    def send_empty(self, status, headers=None):
+        """
+        Send a response with no content
+        """
+        self.server.count_status(status)
+        self.send_response(status)
+        for header_name, header_value in (headers or {}).items():
+            self.send_header(header_name, header_value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def get_path(self):
+        """
+        Return the path of the requested file, or None if the request is
+        outside of the data path
+        """
+        url_path = unquote(urlsplit(self.path).path)
+        path_parts = [i for i in url_path.split('/') if i]
+        if any(i in ['.', '..'] for i in path_parts):
+            return None
+        return os.sep.join([self.server.data_path] + path_parts)
+
+    def get_range(self, file_size):
+        """
+        Return the start and end of the requested byte range, None if no
+        range is requested, or False if the range can not be satisfied.
+        Requests for more than one range are answered with the whole file
+        """
+        range_match = re.match(r'^bytes=(\d*)-(\d*)$',
+                               self.headers.get('Range', '').strip())
+        if not self.server.ranges or range_match is None:
+            return None
+        range_start, range_end = range_match.groups()
+        if not range_start:
+            if not range_end:
+                return None
+            range_start = max(0, file_size - int(range_end))
+            range_end = file_size - 1
+        else:
+            range_start = int(range_start)
+            range_end = min(int(range_end or file_size - 1), file_size - 1)
+        if range_start >= file_size or range_start > range_end:
+            return False
+        return range_start, range_end
+
+    def send_file(self, send_content):
+        """
+        Send the requested file, or part of it
+        """
+        # Wait, and fail if requested:
+        time.sleep(self.server.latency)
+        if random.random() < self.server.fail_rate:
+            self.send_empty(503, {'Retry-After': '1'})
+            return
+        # Check the file exists:
+        file_path = self.get_path()
+        if file_path is None or not os.path.isfile(file_path):
+            self.send_empty(404)
+            return
+        file_stat = os.stat(file_path)
+        file_size = file_stat.st_size
+        last_modified = formatdate(int(file_stat.st_mtime), usegmt=True)
+        # Not modified since the requested time:
+        if_modified = self.headers.get('If-Modified-Since')
+        if if_modified:
+            try:
+                modified_time = parsedate_to_datetime(if_modified).timestamp()
+            except (TypeError, ValueError):
+                modified_time = None
+            if (modified_time is not None and
+                    int(file_stat.st_mtime) <= modified_time):
+                self.send_empty(304, {'Last-Modified': last_modified})
+                return
+        # The range is only sent if the file has not changed since the
+        # If-Range time:
+        byte_range = self.get_range(file_size)
+        if_range = self.headers.get('If-Range')
+        if if_range and if_range != last_modified:
+            byte_range = None
+        if byte_range is False:
+            self.send_empty(416, {
+                'Content-Range': 'bytes */{0}'.format(file_size)
+            })
+            return
+        # Send the headers:
+        if byte_range is None:
+            status = 200
+            range_start, range_end = 0, file_size - 1
+        else:
+            status = 206
+            range_start, range_end = byte_range
+        self.server.count_status(status)
+        self.send_response(status)
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                range_start, range_end, file_size
+            ))
+        self.send_header('Content-Length', str(range_end + 1 - range_start))
+        self.send_header('Last-Modified', last_modified)
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if not send_content:
+            return
+        # Send the content, limiting the throughput if requested:
+        send_start = time.perf_counter()
+        sent_size = 0
+        with open(file_path, 'rb') as file_fh:
+            file_fh.seek(range_start)
+            while sent_size < range_end + 1 - range_start:
+                file_chunk = file_fh.read(
+                    min(CHUNK_SIZE, range_end + 1 - range_start - sent_size)
+                )
+                if not file_chunk:
+                    break
+                try:
+                    self.wfile.write(file_chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+                    return
+                sent_size += len(file_chunk)
+                if self.server.rate:
+                    send_wait = sent_size / self.server.rate - (
+                        time.perf_counter() - send_start
+                    )
+                    if send_wait > 0:
+                        time.sleep(send_wait)
+        self.server.count_bytes(sent_size)
+
+class RangeServer(http.server.ThreadingHTTPServer):
+    """
+    Threaded HTTP server for a data path, which counts the responses
+    and bytes sent
+    """
+
+    daemon_threads = True
+
+    def __init__(self, data_path, port=0, rate=SERVER_RATE,
+                 latency=SERVER_LATENCY, fail_rate=SERVER_FAIL_RATE,
+                 ranges=True):
+        super().__init__(('127.0.0.1', port), RangeRequestHandler)
+        self.data_path = os.path.abspath(data_path)
+        self.rate = rate
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.ranges = ranges
+        self.lock = threading.Lock()
+        self.reset_counts()
+
+    def get_base_url(self):
+        """
+        Return the url of the data path
+        """
+        return 'http://127.0.0.1:{0}/'.format(self.server_address[1])
+
+    def reset_counts(self):
+        """
+        Reset the counts of responses and bytes sent
+        """
+        with self.lock:
+            self.counts = {'bytes': 0}
+
+    def count_status(self, status):
+        with self.lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+    def count_bytes(self, byte_count):
+        with self.lock:
+            self.counts['bytes'] += byte_count
+
+def write_file(file_path, file_size):
+    """
+    Write a file of random data, unless a file of the same size exists
+    """
+    if os.path.exists(file_path) and os.path.getsize(file_path) == file_size:
+        return
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'wb') as file_fh:
+        for i in range(0, file_size, CHUNK_SIZE * 16):
+            file_fh.write(os.urandom(min(CHUNK_SIZE * 16, file_size - i)))
+
+def make_files(data_path, large_count=LARGE_COUNT, large_size=LARGE_SIZE,
+               small_count=SMALL_COUNT, small_size=SMALL_SIZE):
+    """
+    Create large and small files of random data in the data path, in the
+    style of LiCSAR GeoTIFF and png products
+    """
+    for i in range(large_count):
+        write_file(os.sep.join([
+            data_path, 'large', '{0:02d}'.format(i), 'geo.unw.tif'
+        ]), large_size)
+    for i in range(small_count):
+        write_file(os.sep.join([
+            data_path, 'small', '{0:02d}'.format(i // 4),
+            '{0:02d}.geo.unw.png'.format(i)
+        ]), small_size)
+
+def get_files(data_path, base_url):
+    """
+    Return the information for all files in the data path, as dicts of
+    name, path, url, size and mtime, as returned by
+    search_metadata.search_frame
+    """
+    files = []
+    for dir_path, dir_names, file_names in os.walk(data_path):
+        dir_names.sort()
+        rel_dir = os.path.relpath(dir_path, data_path).replace(os.sep, '/')
+        for file_name in sorted(file_names):
+            file_stat = os.stat(os.sep.join([dir_path, file_name]))
+            rel_path = file_name if rel_dir == '.' else '/'.join([
+                rel_dir, file_name
+            ])
+            files.append({
+                'name': file_name,
+                'path': '' if rel_dir == '.' else rel_dir,
+                'url': '{0}{1}'.format(base_url, quote(rel_path)),
+                'size': file_stat.st_size,
+                'mtime': int(file_stat.st_mtime)
+            })
+    return files
+
+def make_script(template_path, script_path, files, base_url, constants):
+    """
+    Write a download script for a list of files, with template constants
+    replaced by the values in a dict
+    """
+    with open(template_path, 'r') as template_file:
+        script_template = template_file.read()
+    for const_name, const_value in constants.items():
+        script_template, const_count = re.subn(
+            r'^{0} = .*$'.format(const_name),
+            lambda i: '{0} = {1!r}'.format(const_name, const_value),
+            script_template, flags=re.M
+        )
+        if not const_count:
+            err_msg = 'constant {0} not found in {1}'.format(
+                const_name, template_path
+            )
+            raise ValueError(err_msg)
+    script_start, script_end = script_template.split('{{ FILES }}\n', 1)
+    with open(script_path, 'w') as script_file:
+        script_file.write(script_start)
+        metadata_manifest.embed_manifest(files, script_file, [base_url])
+        script_file.write(script_end)
+
+def check_files(files, data_path, out_path):
+    """
+    Compare downloaded files with the served files. Returns the lists of
+    paths of files which are missing, e.g. after failing to download, and
+    of files which differ
+    """
+    missing_paths = []
+    bad_paths = []
+    for file_info in files:
+        rel_path = '/'.join([i for i in [file_info['path'],
+                                         file_info['name']] if i])
+        file_hashes = []
+        for file_dir in [data_path, out_path]:
+            file_path = os.sep.join([file_dir] + rel_path.split('/'))
+            if not os.path.isfile(file_path):
+                file_hashes.append(None)
+                continue
+            file_hash = hashlib.sha256()
+            with open(file_path, 'rb') as file_fh:
+                for file_chunk in iter(lambda: file_fh.read(1048576), b''):
+                    file_hash.update(file_chunk)
+            file_hashes.append(file_hash.hexdigest())
+        if file_hashes[1] is None:
+            missing_paths.append(rel_path)
+        elif file_hashes[0] != file_hashes[1]:
+            bad_paths.append(rel_path)
+    return missing_paths, bad_paths
+
+def run_download(server, files, work_path, mode, constants):
+    """
+    Generate and run a download script for a mode, in a new process, and
+    check the downloaded files, and that no partial files were left open.
+    Returns a dict of metrics
+    """
+    # Paths for this mode:
+    script_path = os.sep.join([work_path, 'get_{0}.py'.format(mode)])
+    count_path = os.sep.join([work_path, 'open_{0}.txt'.format(mode)])
+    out_path = os.sep.join([work_path, 'out_{0}'.format(mode)])
+    shutil.rmtree(out_path, ignore_errors=True)
+    # Write the script:
+    template_path = os.sep.join([
+        os.path.dirname(os.path.abspath(__file__)), SCRIPT_TEMPLATE
+    ])
+    script_constants = {'OUT_DIR': out_path}
+    script_constants.update(constants)
+    script_constants.update(DOWNLOAD_MODES[mode])
+    make_script(template_path, script_path, files, server.get_base_url(),
+                script_constants)
+    # Run the script:
+    server.reset_counts()
+    if os.path.exists(count_path):
+        os.remove(count_path)
+    run_start = time.perf_counter()
+    run_status = subprocess.run(
+        [sys.executable, '-c', RUN_WRAPPER, script_path, count_path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE, universal_newlines=True, timeout=RUN_TIMEOUT
+    )
+    run_time = time.perf_counter() - run_start
+    if run_status.returncode != 0:
+        sys.stderr.write(run_status.stderr)
+    # Check the files, and count partial files left open, if known:
+    missing_paths, bad_paths = check_files(files, server.data_path, out_path)
+    open_parts = None
+    if os.path.exists(count_path):
+        with open(count_path, 'r') as count_file:
+            open_parts = int(count_file.read())
+    total_size = sum(i['size'] for i in files)
+    # Return the metrics:
+    return {
+        'wall': round(run_time, 3),
+        'mb_per_second': round(total_size / 1048576 / run_time, 2),
+        'requests': sum(j for i, j in server.counts.items() if i != 'bytes'),
+        'partial': server.counts.get(206, 0),
+        'sent_mb': round(server.counts['bytes'] / 1048576, 2),
+        'missing_files': len(missing_paths),
+        'bad_files': len(bad_paths),
+        'open_parts': open_parts,
+        'returncode': run_status.returncode
+    }
+
+def parse_constant(const_arg):
+    """
+    Parse a template constant given as NAME=VALUE, where the value is a
+    python literal, or else a string
+    """
+    const_name, sep, const_value = const_arg.partition('=')
+    if not sep or not re.match(r'^[A-Z_][A-Z0-9_]*$', const_name):
+        err_msg = 'constant must be given as NAME=VALUE: {0}'.format(
+            const_arg
+        )
+        raise argparse.ArgumentTypeError(err_msg)
+    try:
+        const_value = eval(const_value, {'__builtins__': {}})
+    except Exception:
+        pass
+    return const_name, const_value
+
+def parse_args():
+    """
+    Parse command line arguments
+    """
+    # Create the argument parser:
+    arg_parser = argparse.ArgumentParser(
+        description=('Benchmark the LiCSAR download script against a local '
+                     'HTTP server which supports range requests')
+    )
+    arg_parser.add_argument(
+        '--work-path', default=None,
+        help=('directory for the fake files, scripts and downloads '
+              '(default: a temporary directory which is removed afterwards)')
+    )
+    arg_parser.add_argument(
+        '--modes', nargs='+', default=sorted(DOWNLOAD_MODES),
+        choices=sorted(DOWNLOAD_MODES),
+        help='download modes to run (default: all)'
+    )
+    arg_parser.add_argument(
+        '--large', type=int, nargs=2, default=[LARGE_COUNT, LARGE_SIZE],
+        metavar=('COUNT', 'SIZE'),
+        help='number and size in bytes of large files (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--small', type=int, nargs=2, default=[SMALL_COUNT, SMALL_SIZE],
+        metavar=('COUNT', 'SIZE'),
+        help='number and size in bytes of small files (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--rate', type=int, default=SERVER_RATE,
+        help=('server throughput per connection in bytes per second, or 0 '
+              'for no limit (default: %(default)s)')
+    )
+    arg_parser.add_argument(
+        '--latency', type=float, default=SERVER_LATENCY,
+        help='server latency per request in seconds (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--fail-rate', type=float, default=SERVER_FAIL_RATE,
+        help=('fraction of requests which fail with a temporary error. '
+              'with --set RETRY_COUNT=0, some files fail to download, which '
+              'checks that failed downloads are cleaned up (default: '
+              '%(default)s)')
+    )
+    arg_parser.add_argument(
+        '--no-ranges', action='store_true',
+        help='serve whole files only, ignoring range requests'
+    )
+    arg_parser.add_argument(
+        '--set', type=parse_constant, action='append', default=[],
+        metavar='NAME=VALUE', dest='constants',
+        help=('set a constant in the download script, e.g. '
+              'SEGMENT_SIZE=4194304. may be given more than once')
+    )
+    arg_parser.add_argument(
+        '--repeat', type=int, default=1,
+        help='number of runs of each mode, keeping the fastest (default: '
+             '%(default)s)'
+    )
+    arg_parser.add_argument(
+        '--serve', default=None, metavar='DATA_PATH',
+        help=('only serve the files in a directory, until interrupted, e.g. '
+              'for use with a script from the search site')
+    )
+    arg_parser.add_argument(
+        '--port', type=int, default=0,
+        help='server port (default: any free port)'
+    )
+    # Return the parsed arguments:
+    return arg_parser.parse_args()
+
+def main():
+    """
+    Main program function
+    """
+    # Get command line arguments:
+    args = parse_args()
+    server_options = {
+        'port': args.port, 'rate': args.rate, 'latency': args.latency,
+        'fail_rate': args.fail_rate, 'ranges': not args.no_ranges
+    }
+    # If only serving files, serve until interrupted:
+    if args.serve:
+        server = RangeServer(args.serve, **server_options)
+        out_msg = '* serving {0} at {1}\n'
+        sys.stdout.write(out_msg.format(server.data_path,
+                                        server.get_base_url()))
+        sys.stdout.flush()
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        return
+    # Create a temporary work path if required:
+    if args.work_path:
+        work_path = os.path.abspath(args.work_path)
+        os.makedirs(work_path, exist_ok=True)
+    else:
+        work_path = tempfile.mkdtemp(prefix='benchmark_downloads_')
+    data_path = os.sep.join([work_path, 'data'])
+    server = None
+    try:
+        # Create the fake files:
+        sys.stdout.write('* creating fake files in {0}\n'.format(data_path))
+        make_files(data_path, args.large[0], args.large[1], args.small[0],
+                   args.small[1])
+        # Start the server:
+        server = RangeServer(data_path, **server_options)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        files = get_files(data_path, server.get_base_url())
+        out_msg = '* serving {0} files, {1:.1f} MB, at {2}\n'
+        sys.stdout.write(out_msg.format(
+            len(files), sum(i['size'] for i in files) / 1048576,
+            server.get_base_url()
+        ))
+        # Run each mode:
+        out_msg = ('{0:<12s} {1:>9s} {2:>9s} {3:>9s} {4:>9s} {5:>9s} '
+                   '{6:>9s} {7:>9s} {8:>9s}\n')
+        sys.stdout.write(out_msg.format(
+            'mode', 'wall s', 'MB/s', 'requests', 'ranges', 'sent MB',
+            'missing', 'bad', 'open'
+        ))
+        bad_runs = 0
+        for mode in args.modes:
+            mode_runs = [
+                run_download(server, files, work_path, mode,
+                             dict(args.constants))
+                for _ in range(args.repeat)
+            ]
+            metrics = min(mode_runs, key=lambda i: i['wall'])
+            # Files which differ, or partial files left open, are always
+            # errors. Files which failed to download are only errors if
+            # the server does not fail requests:
+            bad_runs += sum(1 for i in mode_runs if (
+                i['bad_files'] or i['open_parts'] or (
+                    not args.fail_rate and
+                    (i['missing_files'] or i['returncode'])
+                )
+            ))
+            out_msg = ('{0:<12s} {1:>9.3f} {2:>9.2f} {3:>9d} {4:>9d} '
+                       '{5:>9.2f} {6:>9d} {7:>9d} {8:>9}\n')
+            sys.stdout.write(out_msg.format(
+                mode, metrics['wall'], metrics['mb_per_second'],
+                metrics['requests'], metrics['partial'], metrics['sent_mb'],
+                metrics['missing_files'], metrics['bad_files'],
+                '-' if metrics['open_parts'] is None else metrics['open_parts']
+            ))
+    finally:
+        # Stop the server and remove a temporary work path:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        if not args.work_path:
+            shutil.rmtree(work_path, ignore_errors=True)
+    # Fail if any downloads were incorrect:
+    if bad_runs:
+        sys.stdout.write('{0} runs with failed or incorrect downloads\n'.format(
+            bad_runs
+        ))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    # Try to catch KeyboardInterrupt:
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.stdout.write('\n')
+        sys.exit()
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the stages of the LiCSAR metadata crawler against a fake products
+tree, and compare the results with a stored baseline
+"""
+
+# ---
+
+# std lib imports:
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+# local imports:
+import get_metadata
+import make_fake_products
+import metadata_stats
+
+# ---
+
+# Benchmark stages, in the order they are run. The save_metadata stage
+# times saving metadata which has already been scanned:
+STAGES = [
+    'get_frames', 'get_epochs', 'get_ifgs', 'get_frame_metadata',
+    'save_metadata', 'crawl', 'crawl_incremental'
+]
+
+# Fake tree sizes, as numbers of tracks, frames per track and mean epochs
+# per frame:
+TREE_SIZES = {
+    'small': {'tracks': 2, 'frames': 3, 'epochs': 40},
+    'medium': {'tracks': 4, 'frames': 6, 'epochs': 120},
+    'large': {'tracks': 8, 'frames': 10, 'epochs': 300}
+}
+TREE_SIZE = 'medium'
+
+# Metrics which are compared with the baseline, and whether larger values
+# are better:
+COMPARE_METRICS = {
+    'wall': False,
+    'cpu': False,
+    'dirs_per_second': True,
+    'files_per_second': True,
+    'peak_rss_mb': False,
+    'output_size': False
+}
+
+# Fractional change in a metric which is reported as a regression:
+TOLERANCE = 0.1
+
+# Timing metrics are not checked for regressions for stages which take less
+# than this many seconds, as they are dominated by noise:
+MIN_WALL = 0.05
+
+# Timing metrics:
+TIME_METRICS = ['wall', 'cpu', 'dirs_per_second', 'files_per_second']
+
+# ---
+
+def get_peak_rss():
+    """
+    Return the peak resident memory of this process and its waited for
+    child processes, in MB
+    """
+    peak_rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    return round(peak_rss / 1024, 1)
+
+def get_dir_size(dir_path):
+    """
+    Return the total size of the files in a directory
+    """
+    dir_size = 0
+    for root_path, _, file_names in os.walk(dir_path):
+        for file_name in file_names:
+            dir_size += os.path.getsize(os.sep.join([root_path, file_name]))
+    return dir_size
+
+def count_entries(entries):
+    """
+    Return the number of directories and files in a dict of epoch or
+    interferogram information
+    """
+    return len(entries), sum(len(i['files']) for i in entries.values())
+
+def run_stage(stage, tree_path, work_path, pool_size, thread_count):
+    """
+    Run a single benchmark stage, returning a dict of metrics. Output from
+    the crawler is discarded
+    """
+    # Get the frames before timing, for stages which require them:
+    with contextlib.redirect_stdout(io.StringIO()):
+        frames = get_metadata.get_frames(tree_path)
+    # Init counts:
+    dir_count = 0
+    file_count = 0
+    stats = metadata_stats.CrawlStats()
+    # Paths for crawl output:
+    out_path = os.sep.join([work_path, 'out'])
+    cache_path = os.sep.join([work_path, 'cache'])
+    state_path = os.sep.join([work_path, 'state'])
+    # Scan the frames before timing for the save stage, which writes to
+    # empty paths of its own, so all files are written:
+    if stage == 'save_metadata':
+        out_path = os.sep.join([work_path, 'save_out'])
+        state_path = os.sep.join([work_path, 'save_state'])
+        for stage_path in [out_path, state_path]:
+            shutil.rmtree(stage_path, ignore_errors=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            frames_metadata = list(get_metadata.scan_frames(
+                tree_path, frames, None, False, pool_size, thread_count,
+                display_progress_info=False
+            ))
+    # Start times:
+    wall_start = time.perf_counter()
+    cpu_start = metadata_stats.get_cpu_time(True)
+    # Run the stage:
+    with contextlib.redirect_stdout(io.StringIO()):
+        if stage == 'get_frames':
+            frames = get_metadata.get_frames(tree_path)
+            dir_count = len(frames)
+        elif stage in ['get_epochs', 'get_ifgs']:
+            if stage == 'get_epochs':
+                dirs_name = 'epochs'
+                get_function = get_metadata.get_epochs
+                file_match = get_metadata.EPOCH_FILE_MATCH
+            else:
+                dirs_name = 'interferograms'
+                get_function = get_metadata.get_ifgs
+                file_match = get_metadata.IFG_FILE_MATCH
+            for frame in frames:
+                dirs_path = os.sep.join([
+                    tree_path, frame['track_dir'], frame['id'], dirs_name
+                ])
+                dir_info = count_entries(get_function(dirs_path, file_match))
+                dir_count += dir_info[0]
+                file_count += dir_info[1]
+        elif stage == 'get_frame_metadata':
+            for frame in frames:
+                frame_metadata = get_metadata.get_frame_metadata({
+                    'lics_path': tree_path,
+                    'id': frame['id'],
+                    'track_dir': frame['track_dir']
+                })
+                for dirs_key in ['epochs', 'ifgs']:
+                    dir_info = count_entries(frame_metadata[dirs_key])
+                    dir_count += dir_info[0]
+                    file_count += dir_info[1]
+        elif stage == 'save_metadata':
+            get_metadata.save_metadata(
+                out_path, frames_metadata, state_path, stats=stats
+            )
+            for frame_metadata in frames_metadata:
+                for dirs_key in ['epochs', 'ifgs']:
+                    dir_info = count_entries(frame_metadata[dirs_key])
+                    dir_count += dir_info[0]
+                    file_count += dir_info[1]
+        else:
+            frames_metadata = get_metadata.scan_frames(
+                tree_path, frames, cache_path,
+                stage == 'crawl_incremental', pool_size, thread_count,
+                display_progress_info=False, stats=stats
+            )
+            get_metadata.save_metadata(
+                out_path, frames_metadata, state_path, stats=stats
+            )
+            dir_count = stats.get_stats()['totals']['dirs']
+            file_count = stats.get_stats()['totals']['files']
+    # Get the times:
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = metadata_stats.get_cpu_time(True) - cpu_start
+    # Metrics for this stage:
+    metrics = {
+        'wall': round(wall_time, 4),
+        'cpu': round(cpu_time, 4),
+        'dirs': dir_count,
+        'files': file_count,
+        'dirs_per_second': round(dir_count / wall_time, 1),
+        'files_per_second': round(file_count / wall_time, 1),
+        'peak_rss_mb': get_peak_rss()
+    }
+    # Output size for stages which save metadata:
+    if stage == 'save_metadata':
+        metrics['output_size'] = get_dir_size(out_path)
+    # Phase times and output size for crawl stages:
+    if stage.startswith('crawl'):
+        phases = stats.get_stats()['phases']
+        metrics['scan_wall'] = phases['scan']['wall']
+        metrics['save_wall'] = round(sum(
+            phases[i]['wall'] for i in ['save_frames', 'save_indexes',
+                                        'finish']
+        ), 4)
+        metrics['output_size'] = get_dir_size(out_path)
+    # Return the metrics:
+    return metrics
+
+def run_benchmark(tree_path, work_path, stages=STAGES, repeat=1,
+                  pool_size=None, thread_count=get_metadata.THREAD_COUNT):
+    """
+    Run the benchmark stages. Each stage is run in a new process, so that
+    peak memory is measured separately for each stage. If repeat is greater
+    than one, each stage is run repeatedly and the fastest run is kept.
+    Returns a dict of metrics for each stage
+    """
+    # Init results:
+    results = {}
+    # Loop through stages:
+    for stage in stages:
+        stage_runs = []
+        for _ in range(repeat):
+            # A fresh crawl starts without a cache or previous output:
+            if stage == 'crawl':
+                for sub_dir in ['out', 'cache', 'state']:
+                    shutil.rmtree(os.sep.join([work_path, sub_dir]),
+                                  ignore_errors=True)
+            # Run the stage in a new process:
+            stage_cmd = [
+                sys.executable, os.path.abspath(__file__), '--run-stage',
+                stage, '--tree', tree_path, '--work-path', work_path,
+                '--threads', str(thread_count)
+            ]
+            if pool_size is not None:
+                stage_cmd += ['--processes', str(pool_size)]
+            stage_out = subprocess.run(
+                stage_cmd, check=True, stdout=subprocess.PIPE,
+                universal_newlines=True
+            ).stdout
+            stage_runs.append(json.loads(stage_out))
+        # Keep the fastest run:
+        results[stage] = min(stage_runs, key=lambda i: i['wall'])
+        # Display a message:
+        out_msg = '{0:<20s} {1:8.3f} s {2:10.1f} dirs/s {3:10.1f} files/s '
+        out_msg += '{4:8.1f} MB\n'
+        sys.stdout.write(out_msg.format(
+            stage, results[stage]['wall'], results[stage]['dirs_per_second'],
+            results[stage]['files_per_second'], results[stage]['peak_rss_mb']
+        ))
+    # Return the results:
+    return results
+
+def compare_results(results, baseline, tolerance=TOLERANCE):
+    """
+    Compare benchmark results with baseline results, displaying the change
+    in each metric. Returns a list of (stage, metric) pairs which are
+    worse than the baseline by more than the tolerance. Timing metrics are
+    not checked for stages which are too fast to time reliably
+    """
+    # Init list of regressions:
+    regressions = []
+    # Display a header:
+    out_msg = '{0:<20s} {1:<18s} {2:>14s} {3:>14s} {4:>9s}\n'
+    sys.stdout.write(out_msg.format(
+        'stage', 'metric', 'baseline', 'current', 'change'
+    ))
+    # Loop through stages and metrics:
+    for stage in results:
+        if stage not in baseline:
+            continue
+        for metric, larger_better in COMPARE_METRICS.items():
+            if metric not in results[stage] or metric not in baseline[stage]:
+                continue
+            current_value = results[stage][metric]
+            baseline_value = baseline[stage][metric]
+            # Fractional change, positive if worse:
+            if baseline_value:
+                change = (current_value - baseline_value) / baseline_value
+            else:
+                change = 0.0
+            worse = -change if larger_better else change
+            # Check for regressions:
+            flag = ''
+            if metric in TIME_METRICS and baseline[stage]['wall'] < MIN_WALL:
+                flag = ' -'
+            elif worse > tolerance:
+                regressions.append((stage, metric))
+                flag = ' *'
+            sys.stdout.write(
+                '{0:<20s} {1:<18s} {2:>14} {3:>14} {4:>+8.1f}%{5}\n'.format(
+                    stage, metric, baseline_value, current_value,
+                    change * 100, flag
+                )
+            )
+    # Return the regressions:
+    return regressions
+
+def parse_args():
+    """
+    Parse command line arguments
+    """
+    # Create the argument parser:
+    arg_parser = argparse.ArgumentParser(
+        description=('Benchmark the LiCSAR metadata crawler against a fake '
+                     'products tree')
+    )
+    arg_parser.add_argument(
+        '--tree', default=None,
+        help=('existing products tree to benchmark against (default: '
+              'create a fake tree in the work path)')
+    )
+    arg_parser.add_argument(
+        '--size', default=TREE_SIZE, choices=sorted(TREE_SIZES),
+        help='size of fake tree to create (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--work-path', default=None,
+        help=('directory for the fake tree and crawl output (default: a '
+              'temporary directory which is removed afterwards)')
+    )
+    arg_parser.add_argument(
+        '--stages', nargs='+', default=STAGES, choices=STAGES,
+        help='stages to run (default: all)'
+    )
+    arg_parser.add_argument(
+        '--repeat', type=int, default=1,
+        help='number of runs of each stage, keeping the fastest (default: '
+             '%(default)s)'
+    )
+    arg_parser.add_argument(
+        '-p', '--processes', type=int, default=None,
+        help='number of processes for crawl stages'
+    )
+    arg_parser.add_argument(
+        '-t', '--threads', type=int, default=get_metadata.THREAD_COUNT,
+        help='number of threads per process (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--baseline', default=None,
+        help='baseline results JSON file to compare against'
+    )
+    arg_parser.add_argument(
+        '--save', default=None,
+        help='path to save results as JSON, e.g. for use as a baseline'
+    )
+    arg_parser.add_argument(
+        '--tolerance', type=float, default=TOLERANCE,
+        help=('fractional change in a metric which is reported as a '
+              'regression (default: %(default)s)')
+    )
+    arg_parser.add_argument(
+        '--run-stage', default=None, choices=STAGES,
+        help=argparse.SUPPRESS
+    )
+    # Return the parsed arguments:
+    return arg_parser.parse_args()
+
+def main():
+    """
+    Main program function
+    """
+    # Get command line arguments:
+    args = parse_args()
+    # If running a single stage, write the metrics as JSON:
+    if args.run_stage:
+        metrics = run_stage(args.run_stage, args.tree, args.work_path,
+                            args.processes, args.threads)
+        sys.stdout.write('{0}\n'.format(json.dumps(metrics)))
+        return
+    # Create a temporary work path if required:
+    if args.work_path:
+        work_path = os.path.abspath(args.work_path)
+        os.makedirs(work_path, exist_ok=True)
+    else:
+        work_path = tempfile.mkdtemp(prefix='benchmark_metadata_')
+    try:
+        # Create a fake tree if required:
+        if args.tree:
+            tree_path = os.path.abspath(args.tree)
+        else:
+            tree_path = os.sep.join([work_path, 'tree'])
+            if not os.path.exists(tree_path):
+                out_msg = '* creating {0} fake products tree in {1}\n'
+                sys.stdout.write(out_msg.format(args.size, tree_path))
+                make_fake_products.make_tree(make_fake_products.get_options(
+                    tree_path, **TREE_SIZES[args.size]
+                ))
+        # Run the benchmark:
+        sys.stdout.write('* running benchmark\n')
+        results = run_benchmark(tree_path, work_path, args.stages,
+                                args.repeat, args.processes, args.threads)
+    finally:
+        # Remove a temporary work path:
+        if not args.work_path:
+            shutil.rmtree(work_path, ignore_errors=True)
+    # Save the results if requested:
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=1, sort_keys=True)
+    # Compare with the baseline if requested:
+    if args.baseline:
+        sys.stdout.write('* comparing with {0}\n'.format(args.baseline))
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            out_msg = '{0} metrics worse than baseline by more than {1:.0f}%\n'
+            sys.stdout.write(out_msg.format(len(regressions),
+                                            args.tolerance * 100))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    # Try to catch KeyboardInterrupt:
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.stdout.write('\n')
+        sys.exit()
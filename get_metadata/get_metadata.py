@@ -9,43 +9,127 @@ Get LiCSAR metadata and save as JSON
 
 # std lib imports:
 from __future__ import division
-from ctypes import c_int
+import argparse
+import collections
+import concurrent.futures
+import cProfile
+import hashlib
 import json
-from multiprocessing import Manager, Pool
+import multiprocessing
+import multiprocessing.connection
 import os
 import re
+import signal
 import sys
 import time
+import zlib
+# local imports:
+import metadata_catalog
+import metadata_compress
+import metadata_format
+import metadata_products
+import metadata_records
+import metadata_spatial
+import metadata_stats
 
 # ---
 
-# Pool size for multiprocessing:
+# Pool size for multiprocessing, used if the number of cpus is not
+# available from SLURM_CPUS_PER_TASK:
 POOL_SIZE = 4
 
+# Number of threads per process used for scanning directories:
+THREAD_COUNT = 8
+
+# Number of epoch / interferogram directories scanned per task:
+SCAN_BATCH_SIZE = 64
+
+# Expected directory name patterns:
+TRACK_DIR_MATCH = r'^[0-9]+$'
+FRAME_DIR_MATCH = r'^[0-9]{3}[AD]_[0-9]{5}_[0-9]{6}$'
+EPOCH_DIR_MATCH = r'^[0-9]{8}$'
+IFG_DIR_MATCH = r'^[0-9]{8}_[0-9]{8}$'
+
 # Path to top level LiCSAR products directory
 LICS_PATH = '/gws/nopw/j04/nceo_geohazards_vol1/public/LiCSAR_products'
 
+# Product schema, which lists the expected metadata, epoch and
+# interferogram files, from products.json:
+PRODUCTS = metadata_products.load_products()
+
 # Expected epoch file patterns:
-EPOCH_FILE_MATCH = [
-    'geo.mli.png', 'geo.mli.tif', 'sltd.geo.tif', 'ztd.geo.tif', 'ztd.jpg'
-]
+EPOCH_FILE_MATCH = metadata_products.get_patterns(PRODUCTS, 'epoch_files')
 
 # Expected metadata file patterns:
-METADATA_FILE_MATCH = [
-    'geo.E.tif', 'geo.N.tif', 'geo.U.tif', 'geo.hgt.tif', 'baselines',
-    'metadata.txt', 'network.png'
-]
+METADATA_FILE_MATCH = metadata_products.get_patterns(
+    PRODUCTS, 'metadata_files'
+)
 
 # Expected interferogram file patterns:
-IFG_FILE_MATCH = [
-    'geo.cc.png', 'geo.cc.tif', 'geo.diff.png', 'geo.diff_pha.tif',
-    'geo_diff_unfiltered.png', 'geo_diff_unfiltered_pha.tif', 'geo.unw.png',
-    'geo.unw.tif'
-]
+IFG_FILE_MATCH = metadata_products.get_patterns(PRODUCTS, 'ifg_files')
+
+# Sets of epoch and interferogram file patterns, so each file is classified
+# with a single lookup:
+EPOCH_FILE_SET = frozenset(EPOCH_FILE_MATCH)
+IFG_FILE_SET = frozenset(IFG_FILE_MATCH)
+
+# Fingerprint of the epoch and interferogram file patterns, which is stored
+# in the crawl cache. Cached directory information which was recorded with
+# different patterns is not reused, so files of new product types are found
+# by incremental crawls. Metadata files are always scanned:
+CACHE_SCHEMA = metadata_products.get_fingerprint(
+    PRODUCTS, ['epoch_files', 'ifg_files']
+)
+
+# Expression which matches the end of expected metadata file names, so
+# each file is classified with a single search:
+METADATA_FILE_SUFFIX = metadata_products.compile_suffix_match(
+    METADATA_FILE_MATCH
+)
 
 # Output path for storing JSON data:
 OUT_PATH = '../metadata'
 
+# Output format for per frame JSON data, one of metadata_format.FORMATS:
+OUT_FORMAT = 'compact'
+
+# Period for splitting large frames in to date shards, one of
+# metadata_format.SHARD_PERIODS, or None to never shard frames:
+SHARD_PERIOD = 'year'
+
+# Frames with at least this many epochs plus interferograms are sharded:
+SHARD_MIN_ENTRIES = 2000
+
+# Path for SQLite catalog of all frames and files, or None to not write a
+# catalog:
+CATALOG_PATH = None
+
+# Path for storing crawl cache, used for incremental crawls:
+CACHE_PATH = '../metadata_cache'
+
+# Path for storing output state information, such as hashes of the
+# output files and the manifest of changed files for publishing:
+STATE_PATH = '../metadata_state'
+
+# Path for JSON statistics of the most recent crawl:
+STATS_PATH = '../metadata_stats.json'
+
+# Path for partial results when the crawl is split in to parts by track:
+PARTS_PATH = '../metadata_parts'
+
+# Maximum number of seconds between syncs of the crawl journal to disk:
+CHECKPOINT_INTERVAL = 60
+
+# Name of the file in the state path which stores the crawl cost of each
+# track, used to balance the parts of a split crawl:
+TRACK_COSTS_FILE = 'track_costs.json'
+
+# ---
+
+# Thread pool used for scanning directories within a process, created when
+# required:
+SCAN_THREAD_POOL = None
+
 # ---
 
 def display_progress(progress_count, progress_total):
@@ -60,89 +144,18 @@ def display_progress(progress_count, progress_total):
     sys.stdout.write(file_msg.format(percent_complete))
     sys.stdout.flush()
 
-def mp_wrapper(mp_options):
+def get_pool_size():
     """
-    Wrapper for multiprocessing function
+    Return the number of processes to use, from the SLURM_CPUS_PER_TASK
+    environment variable if set, else POOL_SIZE
     """
-    # try to catch KeyboardInterrupt:
-    try:
-        # get options:
-        mp_function = mp_options['mp_function']
-        mp_count = mp_options['mp_count']
-        mp_progress = mp_options['mp_progress']
-        mp_lock = mp_options['mp_lock']
-        mp_display_progress = mp_options['mp_display_progress']
-        # acquire lock and display progress message:
-        if mp_display_progress:
-            mp_lock.acquire()
-            display_progress(mp_progress.value, mp_count)
-            mp_lock.release()
-        # run the worker function:
-        mp_out = mp_function(mp_options)
-        # increment progress count:
-        mp_progress.value += 1
-        # acquire lock and display progress message:
-        if mp_display_progress:
-            mp_lock.acquire()
-            display_progress(mp_progress.value, mp_count)
-            mp_lock.release()
-        # return the result:
-        return mp_out
-    except KeyboardInterrupt:
-        return None
-
-def mp_run(mp_function, mp_options, pool_size, mp_display_progress=True):
-    """
-    Run function via multiprocessing pool with specified options and pool
-    size
-    """
-    # re-arrange options to try and balance load:
-    mp_options_new = []
-    for i in range(pool_size):
-        mp_options_new += mp_options[i::pool_size]
-    mp_options = mp_options_new
-    del mp_options_new
-    # create a multiprocessing manager:
-    mp_manager = Manager()
-    # add progress counter value to the multiprocessing manager:
-    mp_progress = mp_manager.Value(c_int, 0)
-    # multiprocessing lock for message display:
-    mp_lock = mp_manager.Lock()
-    # update mp_options to add function and multiprocessing manager
-    # information:
-    for mp_option in mp_options:
-        mp_option['mp_function'] = mp_function
-        mp_option['mp_count'] = len(mp_options)
-        mp_option['mp_progress'] = mp_progress
-        mp_option['mp_lock'] = mp_lock
-        mp_option['mp_display_progress'] = mp_display_progress
-    # create a multiprocessing pool:
-    mp_pool = Pool(pool_size)
-    # use map_async to run the function:
-    mp_result = mp_pool.map_async(mp_wrapper, mp_options)
-    # try to exit cleanly on KeyboardInterrupt:
+    # Try to get the value from the environment:
     try:
-        mp_out = mp_result.get()
-        mp_pool.close()
-        mp_pool.join()
-    except KeyboardInterrupt:
-        # try to kill mp pool nicely:
-        try:
-            mp_pool.terminate()
-            mp_pool.join()
-        except:
-            pass
-        # exit:
-        sys.stdout.write('\n')
-        sys.exit()
-    # update progress and add a line break after execution:
-    display_progress(1, 1)
-    sys.stdout.write('\n')
-    sys.stdout.flush()
-    # close the multiprocessing manager:
-    mp_manager.shutdown()
-    # return any result:
-    return mp_out
+        pool_size = int(os.environ['SLURM_CPUS_PER_TASK'])
+    except (KeyError, ValueError):
+        pool_size = POOL_SIZE
+    # Return the pool size:
+    return max(pool_size, 1)
 
 def get_frames(lics_path):
     """
@@ -159,7 +172,7 @@ def get_frames(lics_path):
         if not item.is_dir():
             continue
         # Check if directory name matches expected file pattern:
-        name_match = re.search(r'^[0-9]+$', item.name)
+        name_match = re.search(TRACK_DIR_MATCH, item.name)
         if not name_match or name_match.group(0) != item.name:
             continue
         # If we get here, this looks like a track directory, so add to list:
@@ -178,7 +191,7 @@ def get_frames(lics_path):
             if not item.is_dir():
                 continue
             # Check if directory name matches expected file pattern:
-            name_match = re.search(r'^[0-9]{3}[AD]_[0-9]{5}_[0-9]{6}$', item.name)
+            name_match = re.search(FRAME_DIR_MATCH, item.name)
             if not name_match or name_match.group(0) != item.name:
                 continue
             # If we get here, this looks like a frame directory. Store information:
@@ -192,272 +205,1996 @@ def get_frames(lics_path):
     # Return the frame information:
     return frames
 
-def get_epochs(epochs_path, file_match):
+def load_json(json_path, default=None):
+    """
+    Load JSON data from a file, returning a default value if the file does
+    not exist or can not be read
+    """
+    # Try to read the file:
+    try:
+        with open(json_path, 'r') as json_file:
+            return json.load(json_file)
+    # If that fails, return the default value:
+    except (OSError, ValueError):
+        return default
+
+def save_file(file_path, file_data):
+    """
+    Save bytes to a file. The data is written to a temporary file which is
+    then renamed, so a partially written file is never left in place
+    """
+    # Make output directory if required:
+    file_dir, file_name = os.path.split(file_path)
+    if file_dir and not os.path.exists(file_dir):
+        os.makedirs(file_dir, exist_ok=True)
+    # Temporary file for writing:
+    tmp_path = os.path.join(
+        file_dir, '.{0}.{1}.tmp'.format(file_name, os.getpid())
+    )
+    # Write the data to the temporary file:
+    with open(tmp_path, 'wb') as out_file:
+        out_file.write(file_data)
+    # Move the temporary file in to place:
+    os.replace(tmp_path, file_path)
+
+def dump_json(json_data):
+    """
+    Serialise data as compact JSON bytes
+    """
+    return json.dumps(json_data, separators=(',', ':')).encode('utf-8')
+
+def save_json(json_path, json_data):
+    """
+    Save JSON data to a file, via a temporary file
+    """
+    save_file(json_path, dump_json(json_data))
+
+def get_frame_cache_path(cache_path, track_dir, frame_id):
+    """
+    Return path to the incremental crawl cache file for a frame
+    """
+    return os.sep.join([
+        cache_path, track_dir, '{0}.json'.format(frame_id)
+    ])
+
+def load_frame_cache(cache_path, track_dir, frame_id):
+    """
+    Load the incremental crawl cache for a frame. Returns None if there is
+    no cache for the frame, or if it was recorded with different file
+    patterns, in which case all directories are scanned again
+    """
+    frame_cache = load_json(
+        get_frame_cache_path(cache_path, track_dir, frame_id)
+    )
+    if frame_cache is None or frame_cache.get('schema') != CACHE_SCHEMA:
+        return None
+    return frame_cache
+
+def get_dir_records(dirs_key, dirs_cache=None):
+    """
+    Return compact records for epoch or interferogram directories,
+    containing the information from dirs_cache, a dict in the crawl cache
+    format, if specified
+    """
+    # Date keys and file patterns for this type of directory:
+    if dirs_key == 'epochs':
+        date_keys = ['date']
+        file_match = EPOCH_FILE_MATCH
+    else:
+        date_keys = ['start', 'end']
+        file_match = IFG_FILE_MATCH
+    # Return the records:
+    return metadata_records.from_cache(date_keys, file_match,
+                                       dirs_cache or {})
+
+def get_file_info(dir_entry):
+    """
+    Return size, link and mtime information for a directory entry. The
+    link information is from the directory listing, so the only stat call
+    is for the size and mtime, which is cached by the entry. The mtime is
+    in whole seconds, as for the Last-Modified time of the file from the
+    web server, so download scripts can compare it with the mtime of a
+    downloaded file
+    """
+    # File size and mtime:
+    file_stat = dir_entry.stat()
+    file_size = file_stat.st_size
+    file_mtime = int(file_stat.st_mtime)
+    # Link information:
+    if dir_entry.is_symlink():
+        file_link = 1
+    else:
+        file_link = 0
+    # Return the information:
+    return file_size, file_link, file_mtime
+
+def get_dir_files(dir_path, dir_name, file_match):
+    """
+    Get information for the files in an epoch or interferogram directory,
+    whose names are the directory name and a file pattern joined with a
+    dot. file_match is the collection of expected file patterns, ideally a
+    set, so each file is classified with a single lookup. Returns lists of
+    the patterns, sizes, links and mtimes of the files which are found, or
+    None if the directory contains no files
+    """
+    # Init file information:
+    files = []
+    sizes = []
+    links = []
+    mtimes = []
+    # Prefix of expected file names:
+    name_prefix = '{0}.'.format(dir_name)
+    prefix_length = len(name_prefix)
+    # Init file count for this directory:
+    file_count = 0
+    # Use os scandir to search through content, sorted by name so that
+    # output is consistent between runs:
+    for item in sorted(os.scandir(dir_path), key=lambda i: i.name):
+        # Skip directories:
+        if item.is_dir():
+            continue
+        # Increment file count:
+        file_count += 1
+        # Check if name is an expected pattern:
+        file_pattern = item.name[prefix_length:]
+        if item.name.startswith(name_prefix) and file_pattern in file_match:
+            # Get size, link and mtime information:
+            file_size, file_link, file_mtime = get_file_info(item)
+            # Store the file information:
+            files.append(file_pattern)
+            sizes.append(file_size)
+            links.append(file_link)
+            mtimes.append(file_mtime)
+    # If no files were found, there is no information for this directory:
+    if file_count == 0:
+        return None
+    # Return the file information:
+    return files, sizes, links, mtimes
+
+def list_dirs(dirs_path, dir_match, get_mtimes=False):
     """
-    Get information from epochs path
+    List sub directories of dirs_path whose names match the dir_match
+    pattern. Returns a list of (name, mtime) pairs, where mtime is None
+    unless get_mtimes is True
     """
-    # Init list for storing epoch directories:
-    epoch_dirs = []
-    # Use os scandir to search for epoch directories:
-    for item in os.scandir(epochs_path):
+    # Init list for storing directories:
+    dirs = []
+    # Use os scandir to search for directories:
+    for item in os.scandir(dirs_path):
         # If not a directory, move on:
         if not item.is_dir():
             continue
         # Check if directory name matches expected file pattern:
-        name_match = re.search(r'^[0-9]{8}$', item.name)
+        name_match = re.search(dir_match, item.name)
         if not name_match or name_match.group(0) != item.name:
             continue
-        # If we get here, this looks like an epoch directory, so add to list:
-        epoch_dirs.append(item.name)
-    # Init dict for storing epoch information:
+        # If we get here, add directory to list, with mtime if requested:
+        if get_mtimes:
+            dirs.append((item.name, item.stat().st_mtime_ns))
+        else:
+            dirs.append((item.name, None))
+    # Return the directories:
+    return dirs
+
+def split_cached(dirs, cache):
+    """
+    Split a list of (name, mtime) directory pairs into those which are
+    unchanged according to the cache, and those which need to be scanned.
+    Returns a dict of the cached [mtime, information] values which can be
+    reused, and a list of the (name, mtime) pairs to scan
+    """
+    # If no cache, everything needs to be scanned:
+    if cache is None:
+        return {}, list(dirs)
+    # Init reused information and directories to scan:
+    cached = {}
+    scan_dirs = []
+    # Loop through directories:
+    for dir_name, dir_mtime in dirs:
+        # If directory is unchanged, use the cached information:
+        if (dir_name in cache and cache[dir_name][0] == dir_mtime and
+                has_file_mtimes(cache[dir_name])):
+            cached[dir_name] = cache[dir_name]
+        # Else, directory needs to be scanned:
+        else:
+            scan_dirs.append((dir_name, dir_mtime))
+    # Return the cached information and directories to scan:
+    return cached, scan_dirs
+
+def has_file_mtimes(dir_cache):
+    """
+    Check whether cached [mtime, information] values for a directory
+    include the mtimes of the files, which were not recorded by earlier
+    versions of the crawler
+    """
+    return dir_cache[1] is None or 'mtimes' in dir_cache[1]
+
+def get_epoch(epochs_path, epoch_dir, file_match):
+    """
+    Get information for a single epoch directory. Returns None if the
+    directory contains no files
+    """
+    # Get the files in the epoch directory:
+    epoch_files = get_dir_files(
+        os.sep.join([epochs_path, epoch_dir]), epoch_dir, file_match
+    )
+    # If no files were found, there is no information for this epoch:
+    if epoch_files is None:
+        return None
+    # Return the epoch information:
+    return {
+        'date': int(epoch_dir),
+        'files': epoch_files[0],
+        'sizes': epoch_files[1],
+        'links': epoch_files[2],
+        'mtimes': epoch_files[3]
+    }
+
+def get_epochs(epochs_path, file_match, cache=None):
+    """
+    Get information from epochs path. If a cache dict is provided, epoch
+    information is reused for any epoch directory whose mtime matches the
+    cached value, and the cache is updated in place
+    """
+    # Find epoch directories, with mtimes if using the cache:
+    epoch_dirs = list_dirs(epochs_path, EPOCH_DIR_MATCH, cache is not None)
+    # Check which epochs can be reused from the cache:
+    cached, scan_dirs = split_cached(epoch_dirs, cache)
+    # Loop through epoch dirs which need to be scanned:
+    for epoch_dir, epoch_mtime in scan_dirs:
+        # Get the information for this epoch:
+        epoch = get_epoch(epochs_path, epoch_dir, file_match)
+        cached[epoch_dir] = [epoch_mtime, epoch]
+    # Update the cache:
+    if cache is not None:
+        cache.clear()
+        cache.update(cached)
+    # Store information for epochs which contain files:
     epochs = {}
-    # Loop through epoch dirs:
-    for epoch_dir in epoch_dirs:
-        # Full path to epoch directory:
-        epoch_path = os.sep.join([epochs_path, epoch_dir])
-        # Init dict for this epoch:
-        epoch = {
-            'date': int(epoch_dir),
-            'files': [],
-            'sizes': [],
-            'links': []
-        }
-        # Use os scandir to search through content:
-        for item in os.scandir(epoch_path):
-            # Skip directories:
-            if item.is_dir():
-                continue
-            # Check if name matches an expected pattern:
-            for file_pattern in file_match:
-                # If so ... :
-                if item.name == '{0}.{1}'.format(epoch_dir, file_pattern):
-                    # Store the file information:
-                    epoch['files'].append(file_pattern)
-                    # Store file size information:
-                    epoch['sizes'].append(os.stat(item.path).st_size)
-                    # Store link information:
-                    if os.path.islink(item.path):
-                        epoch['links'].append(1)
-                    else:
-                        epoch['links'].append(0)
-            # Store the information for this epoch:
+    for epoch_dir in sorted(cached):
+        epoch = cached[epoch_dir][1]
+        if epoch is not None:
             epochs[epoch_dir] = epoch
     # Return the epochs information:
     return epochs
 
-def get_metadata(metadata_path, file_match):
+def get_metadata(metadata_path, suffix_match):
     """
-    Get information from metadtaa path
+    Get information from metadtaa path, including the center and bounds
+    of the frame where available. suffix_match is a compiled expression
+    which matches the end of expected file names
     """
     # Init dict for storing metadata information:
     metadata = {
         'files': [],
         'sizes': [],
-        'links': []
+        'links': [],
+        'mtimes': []
     }
-    # Use os scandir to search through content:
-    for item in os.scandir(metadata_path):
+    # Use os scandir to search through content, sorted by name so that
+    # output is consistent between runs:
+    for item in sorted(os.scandir(metadata_path), key=lambda i: i.name):
         # Skip directories:
         if item.is_dir():
             continue
         # Check if name matches an expected pattern:
-        for file_pattern in file_match:
-            # If so ... :
-            if item.name.endswith(file_pattern):
-                # Store the file information:
-                metadata['files'].append(item.name)
-                # Store file size information:
-                metadata['sizes'].append(os.stat(item.path).st_size)
-                # Store link information:
-                if os.path.islink(item.path):
-                    metadata['links'].append(1)
-                else:
-                    metadata['links'].append(0)
+        if suffix_match.search(item.name):
+            # Get size, link and mtime information:
+            file_size, file_link, file_mtime = get_file_info(item)
+            # Store the file information:
+            metadata['files'].append(item.name)
+            metadata['sizes'].append(file_size)
+            metadata['links'].append(file_link)
+            metadata['mtimes'].append(file_mtime)
+    # Add the center and bounds of the frame, if these can be read from the
+    # metadata files:
+    metadata.update(metadata_spatial.get_frame_geo(
+        metadata_path, metadata['files']
+    ))
     # Return the metadata information:
     return metadata
 
-def get_ifgs(ifgs_path, file_match):
+def get_ifg(ifgs_path, ifg_dir, file_match):
     """
-    Get information from interferograms path
+    Get information for a single interferogram directory. Returns None if the
+    directory contains no files
     """
-    # Init list for storing interferogram directories:
-    ifg_dirs = []
-    # Use os scandir to search for interferogram directories:
-    for item in os.scandir(ifgs_path):
-        # If not a directory, move on:
-        if not item.is_dir():
-            continue
-        # Check if directory name matches expected file pattern:
-        name_match = re.search(r'^[0-9]{8}_[0-9]{8}$', item.name)
-        if not name_match or name_match.group(0) != item.name:
-            continue
-        # If we get here, this looks like an interferogram directory, so add
-        # to list:
-        ifg_dirs.append(item.name)
-    # Init dict for storing interferogram information:
+    # Get the files in the ifg directory:
+    ifg_files = get_dir_files(
+        os.sep.join([ifgs_path, ifg_dir]), ifg_dir, file_match
+    )
+    # If no files were found, there is no information for this ifg:
+    if ifg_files is None:
+        return None
+    # Start and end data from directory name:
+    start_date, end_date = ifg_dir.split('_')
+    # Return the ifg information:
+    return {
+        'start': int(start_date),
+        'end': int(end_date),
+        'files': ifg_files[0],
+        'sizes': ifg_files[1],
+        'links': ifg_files[2],
+        'mtimes': ifg_files[3]
+    }
+
+def get_ifgs(ifgs_path, file_match, cache=None):
+    """
+    Get information from interferograms path. If a cache dict is provided,
+    interferogram information is reused for any interferogram directory
+    whose mtime matches the cached value, and the cache is updated in place
+    """
+    # Find interferogram directories, with mtimes if using the cache:
+    ifg_dirs = list_dirs(ifgs_path, IFG_DIR_MATCH, cache is not None)
+    # Check which interferograms can be reused from the cache:
+    cached, scan_dirs = split_cached(ifg_dirs, cache)
+    # Loop through interferogram dirs which need to be scanned:
+    for ifg_dir, ifg_mtime in scan_dirs:
+        # Get the information for this ifg:
+        ifg = get_ifg(ifgs_path, ifg_dir, file_match)
+        cached[ifg_dir] = [ifg_mtime, ifg]
+    # Update the cache:
+    if cache is not None:
+        cache.clear()
+        cache.update(cached)
+    # Store information for interferograms which contain files:
     ifgs = {}
-    # Loop through interferogram dirs:
-    for ifg_dir in ifg_dirs:
-        # Full path to ifg directory:
-        ifg_path = os.sep.join([ifgs_path, ifg_dir])
-        # Start and end data from directory name:
-        start_date, end_date = ifg_dir.split('_')
-        # Init dict for this ifg:
-        ifg = {
-            'start': int(start_date),
-            'end': int(end_date),
-            'files': [],
-            'sizes': [],
-            'links': []
-        }
-        # Use os scandir to search through content:
-        for item in os.scandir(ifg_path):
-            # Skip directories:
-            if item.is_dir():
-                continue
-            # Check if name matches an expected pattern:
-            for file_pattern in file_match:
-                # If so ... :
-                if item.name == '{0}.{1}'.format(ifg_dir, file_pattern):
-                    # Store the file information:
-                    ifg['files'].append(file_pattern)
-                    # Store file size information:
-                    ifg['sizes'].append(os.stat(item.path).st_size)
-                    # Store link information:
-                    if os.path.islink(item.path):
-                        ifg['links'].append(1)
-                    else:
-                        ifg['links'].append(0)
-            # Store the information for this ifg:
+    for ifg_dir in sorted(cached):
+        ifg = cached[ifg_dir][1]
+        if ifg is not None:
             ifgs[ifg_dir] = ifg
     # Return the ifgs information:
     return ifgs
 
-def get_frame_metadata(options):
+def list_frame(options):
     """
-    Get metadata for specified frame
+    Get the metadata information for a frame, and list the epoch and
+    interferogram directories of the frame. If a cache path is specified in
+    the options, directory mtimes are recorded, and when running
+    incrementally, directories which are unchanged since the previous run
+    are reused from the cache rather than being listed for scanning
     """
     # Get options:
     lics_path = options['lics_path']
     frame_id = options['id']
     track_dir = options['track_dir']
+    cache_path = options.get('cache_path')
+    incremental = options.get('incremental', False)
     # Full path to frame directory:
     frame_path = os.sep.join([
         lics_path, track_dir, frame_id
     ])
+    # Load the cached information for this frame if required:
+    frame_cache = None
+    if cache_path and incremental:
+        frame_cache = load_frame_cache(cache_path, track_dir, frame_id)
+    if frame_cache is None:
+        frame_cache = {}
+    # Directory mtimes are only required if the cache is in use:
+    get_mtimes = bool(cache_path)
+    # Init frame information:
+    frame_info = {
+        'task': 'list',
+        'id': frame_id,
+        'track_dir': track_dir,
+        'frame_path': frame_path,
+        'metadata': {},
+        'stats': {'dirs': 0, 'files': 0, 'stats': 3}
+    }
     # Get metadata data. Path to metadata directory:
     metadata_path = os.sep.join([frame_path, 'metadata'])
-    # If directory doesn't exist:
-    if not os.path.isdir(metadata_path):
-        # Empty metadata information:
-        metadata = {}
-    # Else, get the metadata information:
-    else:
-        metadata = get_metadata(metadata_path, METADATA_FILE_MATCH)
-    # Get epochs data. Path to epochs directory:
-    epochs_path = os.sep.join([frame_path, 'epochs'])
-    # If directory doesn't exist:
-    if not os.path.isdir(epochs_path):
-        # Empty epochs information:
-        epochs = {}
-    # Else, get the epochs information:
+    # If directory exists, get the metadata information. Metadata files may
+    # be updated in place, and there are only a few of them, so these are
+    # always scanned:
+    if os.path.isdir(metadata_path):
+        frame_info['metadata'] = get_metadata(
+            metadata_path, METADATA_FILE_SUFFIX
+        )
+        metadata_count = len(frame_info['metadata']['files'])
+        frame_info['stats']['files'] += metadata_count
+        frame_info['stats']['stats'] += metadata_count
+    # Loop through epochs and interferograms directories:
+    for dirs_key, dirs_name, dir_match in [
+        ('epochs', 'epochs', EPOCH_DIR_MATCH),
+        ('ifgs', 'interferograms', IFG_DIR_MATCH)
+    ]:
+        # Path to the directory:
+        dirs_path = os.sep.join([frame_path, dirs_name])
+        # If directory exists, find sub directories:
+        if os.path.isdir(dirs_path):
+            dirs = list_dirs(dirs_path, dir_match, get_mtimes)
+        else:
+            dirs = []
+        # Check which directories can be reused from the cache:
+        if get_mtimes:
+            dirs_cache = frame_cache.get(dirs_key, {})
+        else:
+            dirs_cache = None
+        cached, scan_dirs = split_cached(dirs, dirs_cache)
+        # Count the directories, and stat calls for directory mtimes:
+        frame_info['stats']['dirs'] += len(dirs)
+        if get_mtimes:
+            frame_info['stats']['stats'] += len(dirs)
+        # Store the information, using compact records for the cached
+        # directories, as these are returned to the main process:
+        frame_info[dirs_key] = get_dir_records(dirs_key, cached)
+        frame_info['scan_{0}'.format(dirs_key)] = scan_dirs
+    # Return the frame information:
+    return frame_info
+
+def scan_dirs(options):
+    """
+    Scan a batch of epoch or interferogram directories for a frame. If the
+    thread count in the options is greater than one, the directories are
+    scanned using a pool of threads
+    """
+    # Get options:
+    frame_id = options['id']
+    dirs_key = options['dirs_key']
+    dirs_path = options['dirs_path']
+    dirs = options['dirs']
+    thread_count = options.get('thread_count', 1)
+    # Scanning function and file patterns for this type of directory:
+    if dirs_key == 'epochs':
+        scan_function = get_epoch
+        file_match = EPOCH_FILE_SET
     else:
-        epochs = get_epochs(epochs_path, EPOCH_FILE_MATCH)
-    # Get interferogram data. Path to inteferograms directory:
-    ifgs_path = os.sep.join([frame_path, 'interferograms'])
-    # If directory doesn't exist:
-    if not os.path.isdir(ifgs_path):
-        # Empty interferograms information:
-        ifgs = {}
-    # Else, get the interferograms information:
+        scan_function = get_ifg
+        file_match = IFG_FILE_SET
+    # Function to scan a single directory:
+    def scan_dir(dir_info):
+        return scan_function(dirs_path, dir_info[0], file_match)
+    # Scan the directories, using threads if requested:
+    if thread_count > 1 and len(dirs) > 1:
+        thread_pool = get_thread_pool(thread_count)
+        scanned = thread_pool.map(scan_dir, dirs)
     else:
-        ifgs = get_ifgs(ifgs_path, IFG_FILE_MATCH)
+        scanned = map(scan_dir, dirs)
+    # Store the scanned information as compact records, and count the
+    # files which were found, each of which requires one stat call:
+    dir_records = get_dir_records(dirs_key)
+    file_count = 0
+    for (dir_name, dir_mtime), dir_info in zip(dirs, scanned):
+        dir_records.append(dir_name, dir_mtime, dir_info)
+        if dir_info:
+            file_count += len(dir_info['files'])
+    # Return the scanned information:
+    return {
+        'task': 'scan',
+        'id': frame_id,
+        'dirs_key': dirs_key,
+        'dirs': dir_records,
+        'stats': {
+            'scanned_dirs': len(dirs),
+            'files': file_count,
+            'stats': file_count
+        }
+    }
+
+def get_scan_tasks(frame_info, thread_count):
+    """
+    Split the directories of a frame which need to be scanned in to tasks
+    of up to SCAN_BATCH_SIZE directories
+    """
+    # Init list of tasks:
+    scan_tasks = []
+    # Loop through epochs and interferograms directories:
+    for dirs_key, dirs_name in [
+        ('epochs', 'epochs'), ('ifgs', 'interferograms')
+    ]:
+        # Path to the directory:
+        dirs_path = os.sep.join([frame_info['frame_path'], dirs_name])
+        # Directories to be scanned:
+        dirs = frame_info['scan_{0}'.format(dirs_key)]
+        # Create tasks for batches of directories:
+        for i in range(0, len(dirs), SCAN_BATCH_SIZE):
+            scan_tasks.append({
+                'task_function': scan_dirs,
+                'id': frame_info['id'],
+                'dirs_key': dirs_key,
+                'dirs_path': dirs_path,
+                'dirs': dirs[i:i + SCAN_BATCH_SIZE],
+                'thread_count': thread_count
+            })
+    # Return the tasks:
+    return scan_tasks
+
+def finish_frame(frame_info, cache_path=None):
+    """
+    Assemble the metadata for a frame once all directories have been
+    scanned, saving the updated crawl cache for the frame if required
+    """
+    # Frame id and track directory:
+    frame_id = frame_info['id']
+    track_dir = frame_info['track_dir']
+    # Expand the compact records for the epochs and interferograms in to
+    # the cache format:
+    frame_cache = {
+        'schema': CACHE_SCHEMA,
+        'epochs': frame_info['epochs'].get_cache(),
+        'ifgs': frame_info['ifgs'].get_cache()
+    }
+    # Save the updated cache information for this frame:
+    if cache_path:
+        save_json(
+            get_frame_cache_path(cache_path, track_dir, frame_id), frame_cache
+        )
+    # Store information for epochs and interferograms which contain files:
+    epochs = {i: j[1] for i, j in frame_cache['epochs'].items()
+              if j[1] is not None}
+    ifgs = {i: j[1] for i, j in frame_cache['ifgs'].items()
+            if j[1] is not None}
     # Dict of frame metadata:
     frame_metadata = {
         'id': frame_id,
         'path': os.sep.join([track_dir, frame_id]),
         'epochs': epochs,
-        'metadata': metadata,
+        'metadata': frame_info['metadata'],
         'ifgs': ifgs
     }
     # Return the metadata:
     return frame_metadata
 
-def get_frames_metadata(lics_path, frames):
+def get_frame_metadata(options):
+    """
+    Get metadata for specified frame. If a cache path is specified in the
+    options, the previous results for the frame are loaded from the cache
+    (when running incrementally), and the updated results are saved back to
+    the cache
+    """
+    # List the content of the frame:
+    frame_info = list_frame(options)
+    # Scan the epoch and interferogram directories:
+    for scan_task in get_scan_tasks(frame_info, 1):
+        scan_info = scan_dirs(scan_task)
+        frame_info[scan_info['dirs_key']].extend(scan_info['dirs'])
+    # Return the metadata:
+    return finish_frame(frame_info, options.get('cache_path'))
+
+def get_thread_pool(thread_count):
+    """
+    Return the thread pool for scanning directories in this process,
+    creating it if required
+    """
+    global SCAN_THREAD_POOL
+    # Create the thread pool if required:
+    if SCAN_THREAD_POOL is None:
+        SCAN_THREAD_POOL = concurrent.futures.ThreadPoolExecutor(thread_count)
+    # Return the thread pool:
+    return SCAN_THREAD_POOL
+
+def init_worker():
+    """
+    Initializer for scanning pool processes. Interrupts are handled by the
+    main process, which shuts down the pool, so workers ignore them
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+def run_task(options):
+    """
+    Wrapper for task functions run by the scanning pool, which adds the wall
+    and CPU time of the task to the task statistics
+    """
+    # Tasks which use threads are timed using the CPU time of the process,
+    # else using the CPU time of the thread running the task:
+    if options.get('thread_count', 1) > 1:
+        cpu_timer = time.process_time
+    else:
+        cpu_timer = time.thread_time
+    # Start times:
+    wall_start = time.perf_counter()
+    cpu_start = cpu_timer()
+    # try to catch KeyboardInterrupt:
+    try:
+        task_out = options['task_function'](options)
+    except KeyboardInterrupt:
+        return None
+    # Add the times to the task statistics:
+    task_out['stats']['duration'] = time.perf_counter() - wall_start
+    task_out['stats']['cpu'] = cpu_timer() - cpu_start
+    # Return the task output:
+    return task_out
+
+def scan_frames(lics_path, frames, cache_path=None, incremental=False,
+                pool_size=None, thread_count=THREAD_COUNT,
+                display_progress_info=True, stats=None):
     """
-    Get metadata for all of the frames
+    Generator which scans frames and yields the metadata for each frame as
+    it is completed. The work is split in to tasks which list the content
+    of a frame, and tasks which scan batches of epoch and interferogram
+    directories. Tasks are submitted to the pool as workers become
+    available, with tasks for frames which have already been started taking
+    priority over starting new frames. If the pool size is greater than
+    one, tasks are run by a pool of processes, each of which uses threads
+    for scanning directories, else tasks are run by a pool of threads.
+    Task timings and counts are recorded in stats, a CrawlStats instance,
+    if specified
+    """
+    # Create a stats instance if not specified:
+    if stats is None:
+        stats = metadata_stats.CrawlStats()
+    # Get pool size if not specified:
+    if pool_size is None:
+        pool_size = get_pool_size()
+    # Create pool of processes or threads:
+    if pool_size > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(
+            pool_size, initializer=init_worker
+        )
+        task_thread_count = thread_count
+        max_tasks = pool_size * 2
+        stats.start_workers('processes', pool_size)
+    else:
+        pool = concurrent.futures.ThreadPoolExecutor(thread_count)
+        task_thread_count = 1
+        max_tasks = thread_count * 2
+        stats.start_workers('threads', thread_count)
+    # Iterator for frames which have not yet been started:
+    frames_iter = iter(frames)
+    frame_count = len(frames)
+    # Progress count:
+    progress_count = 0
+    if display_progress_info and frame_count > 0:
+        display_progress(progress_count, frame_count)
+    # Scanning tasks waiting to be submitted:
+    waiting_tasks = collections.deque()
+    # Information for frames which have been started:
+    open_frames = {}
+    # Set of running tasks:
+    running_tasks = set()
+    # try to exit cleanly on KeyboardInterrupt:
+    try:
+        while True:
+            # Submit tasks while there are free slots:
+            while len(running_tasks) < max_tasks:
+                # Tasks for already started frames take priority:
+                if waiting_tasks:
+                    task_options = waiting_tasks.popleft()
+                # Else start a new frame:
+                else:
+                    frame = next(frames_iter, None)
+                    if frame is None:
+                        break
+                    task_options = {
+                        'task_function': list_frame,
+                        'lics_path': lics_path,
+                        'id': frame['id'],
+                        'track_dir': frame['track_dir'],
+                        'cache_path': cache_path,
+                        'incremental': incremental
+                    }
+                    stats.start_frame(frame['id'])
+                running_tasks.add(pool.submit(run_task, task_options))
+            # If nothing is running, all done:
+            if not running_tasks:
+                break
+            # Wait for a task to complete:
+            done_tasks, running_tasks = concurrent.futures.wait(
+                running_tasks,
+                return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            # Loop through completed tasks:
+            for done_task in done_tasks:
+                task_out = done_task.result()
+                # If the worker was interrupted:
+                if task_out is None:
+                    raise KeyboardInterrupt
+                # Record the task statistics:
+                stats.add_task(task_out)
+                # If this is the listing of a frame, create tasks for
+                # scanning the frame directories:
+                if task_out['task'] == 'list':
+                    frame_info = task_out
+                    scan_tasks = get_scan_tasks(frame_info, task_thread_count)
+                    frame_info['pending'] = len(scan_tasks)
+                    open_frames[frame_info['id']] = frame_info
+                    waiting_tasks.extend(scan_tasks)
+                # Else, store the scanned directory information:
+                else:
+                    frame_info = open_frames[task_out['id']]
+                    frame_info[task_out['dirs_key']].extend(task_out['dirs'])
+                    frame_info['pending'] -= 1
+                # If all directories for the frame have been scanned, the
+                # frame is complete:
+                if frame_info['pending'] == 0:
+                    del open_frames[frame_info['id']]
+                    stats.end_frame(frame_info['id'])
+                    progress_count += 1
+                    if display_progress_info:
+                        display_progress(progress_count, frame_count)
+                    yield finish_frame(frame_info, cache_path)
+    except (KeyboardInterrupt, GeneratorExit):
+        # shut down the pool before unwinding, cancelling tasks which have
+        # not started. this also applies if the caller is interrupted and
+        # closes the generator:
+        pool.shutdown(cancel_futures=True)
+        raise
+    # Shut down the pool:
+    pool.shutdown()
+    stats.end_workers()
+    # add a line break after execution:
+    if display_progress_info:
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+
+def get_frames_metadata(lics_path, frames, cache_path=None,
+                        incremental=False, pool_size=None,
+                        thread_count=THREAD_COUNT, stats=None,
+                        display_progress_info=True):
+    """
+    Get metadata for all of the frames. Returns a generator which yields
+    the metadata for each frame as it is completed, in no particular order.
+    If a cache path is specified, the crawl cache is updated, and if
+    incremental is True, cached information is reused for unchanged epoch
+    and interferogram directories. Task timings and counts are recorded in
+    stats, a CrawlStats instance, if specified
     """
     # Display a message:
-    err_msg = '* getting metadata for frames'
+    if incremental:
+        err_msg = '* getting metadata for frames (incremental)'
+    else:
+        err_msg = '* getting metadata for frames'
     sys.stdout.write('{0}\n'.format(err_msg))
-    # Create multiprocessing options:
-    mp_options = []
-    for frame in frames:
-        # Options for this task:
-        options = {
-            'lics_path': lics_path,
-            'id': frame['id'],
-            'track_dir': frame['track_dir']
-        }
-        # store the options:
-        mp_options.append(options)
-    # Get metadata using multiprocessing:
-    frames_metadata = mp_run(get_frame_metadata, mp_options, POOL_SIZE)
-    # Return the metadata:
-    return frames_metadata
+    # Return generator for metadata from the scanning pool:
+    return scan_frames(
+        lics_path, frames, cache_path, incremental, pool_size, thread_count,
+        display_progress_info, stats
+    )
+
+class MetadataWriter(object):
+    """
+    Writer for metadata output files. The hash of the content of every
+    output file is stored in the state path, and files are only written if
+    their content has changed, via a temporary file which is renamed in to
+    place. The relative paths of changed and removed files are added to a
+    manifest file in the state path, which can be used to publish only
+    those files. If compress is True, compressed copies of the JSON files
+    are also written when writing is finished, using a pool of pool_size
+    processes
+    """
+
+    def __init__(self, out_path, state_path=None, compress=False,
+                 pool_size=None):
+        # Output path:
+        self.out_path = out_path
+        # Compression options:
+        self.compress = compress
+        self.pool_size = pool_size or get_pool_size()
+        # State file paths:
+        if state_path:
+            self.hashes_path = os.sep.join([state_path, 'hashes.json'])
+            self.manifest_path = os.sep.join([state_path, 'manifest.txt'])
+            self.compressed_path = os.sep.join([
+                state_path, 'compressed.json'
+            ])
+            self.report_path = os.sep.join([state_path, 'compression.json'])
+        else:
+            self.hashes_path = None
+            self.manifest_path = None
+            self.compressed_path = None
+            self.report_path = None
+        # Load hashes from previous run:
+        prev_hashes = {}
+        if self.hashes_path:
+            prev_hashes = load_json(self.hashes_path, {})
+        self.prev_frames = prev_hashes.get('frames', {})
+        self.prev_files = prev_hashes.get('files', {})
+        # Hashes of files from this run, per frame and for other files:
+        self.frames = {}
+        self.files = {}
+        # Changed and removed files:
+        self.changed = []
+        self.removed = []
+
+    def write_file(self, rel_path, file_data, prev_hash=None):
+        """
+        Write data to a file relative to the output path, if the content
+        has changed. Returns the hash of the data
+        """
+        # Hash of the content:
+        file_hash = hashlib.sha1(file_data).hexdigest()
+        # Full path to file:
+        file_path = os.sep.join([self.out_path, rel_path])
+        # Write file if content has changed, or file does not exist:
+        if file_hash != prev_hash or not os.path.exists(file_path):
+            save_file(file_path, file_data)
+            self.changed.append(rel_path)
+        # Return the hash:
+        return file_hash
+
+    def remove_file(self, rel_path):
+        """
+        Remove a file relative to the output path
+        """
+        # Full path to file:
+        file_path = os.sep.join([self.out_path, rel_path])
+        # Remove the file if it exists:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        self.removed.append(rel_path)
+
+    def save_file(self, rel_path, file_data):
+        """
+        Save data to a file which does not belong to a frame
+        """
+        self.files[rel_path] = self.write_file(
+            rel_path, file_data, self.prev_files.get(rel_path)
+        )
+
+    def save_frame(self, frame_id, frame_files):
+        """
+        Save the files for a frame. frame_files is a dict of file data,
+        keyed by path relative to the output path. Any files previously
+        written for the frame which are not included are removed
+        """
+        # Hashes of files previously written for this frame:
+        prev_hashes = self.prev_frames.get(frame_id, {})
+        # Write the files:
+        frame_hashes = {}
+        for rel_path, file_data in frame_files.items():
+            frame_hashes[rel_path] = self.write_file(
+                rel_path, file_data, prev_hashes.get(rel_path)
+            )
+        # Remove any files which are no longer required:
+        for rel_path in prev_hashes:
+            if rel_path not in frame_hashes:
+                self.remove_file(rel_path)
+        # Store the hashes:
+        self.frames[frame_id] = frame_hashes
+
+    def resume_frame(self, frame_id, frame_hashes, changed, removed):
+        """
+        Restore the hashes and changes for a frame which was saved before a
+        crawl was interrupted
+        """
+        self.frames[frame_id] = frame_hashes
+        self.changed += changed
+        self.removed += removed
+
+    def remove_frame(self, frame_id):
+        """
+        Remove all files previously written for a frame
+        """
+        for rel_path in self.prev_frames.pop(frame_id, {}):
+            self.remove_file(rel_path)
+        self.frames.pop(frame_id, None)
+
+    def save_manifest(self):
+        """
+        Add the changed and removed files to any existing manifest, which
+        lists files not yet published
+        """
+        # Nothing to do if there is no state path:
+        if not self.manifest_path:
+            return
+        manifest = set(self.changed + self.removed)
+        if manifest:
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, 'r') as manifest_file:
+                    manifest.update(manifest_file.read().split())
+            manifest = sorted(manifest)
+            save_file(self.manifest_path, '\n'.join(
+                manifest + ['']
+            ).encode('utf-8'))
+
+    def compress_files(self):
+        """
+        Write compressed copies of the JSON output files which have changed,
+        or which have no compressed copies, and remove the compressed
+        copies of removed files. The compressed copies are added to the
+        changed and removed files, the size of every file and its copies
+        is stored in the state path, and a report of the total sizes is
+        saved and displayed
+        """
+        # Load the sizes of files which were previously compressed:
+        prev_sizes = {}
+        if self.compressed_path:
+            prev_sizes = load_json(self.compressed_path, {})
+        # All current output files:
+        out_files = set(self.files)
+        for frame_hashes in self.frames.values():
+            out_files.update(frame_hashes)
+        out_files = {i for i in out_files
+                     if i.endswith(metadata_compress.COMPRESS_MATCH)}
+        # Files which need to be compressed, because they have changed, or
+        # do not have a copy with every available encoding:
+        changed = set(self.changed)
+        encodings = metadata_compress.get_encodings()
+        compress_paths = sorted(
+            i for i in out_files if i in changed or
+            any(j not in prev_sizes.get(i, {}) for j in encodings)
+        )
+        # Remove compressed copies of files which no longer exist:
+        for rel_path in sorted(set(prev_sizes) - out_files):
+            for compressed_path in metadata_compress.get_compressed_paths(
+                rel_path
+            ):
+                self.remove_file(compressed_path)
+        # Compress the files:
+        files_sizes = {i: prev_sizes[i] for i in out_files
+                       if i in prev_sizes}
+        files_sizes.update(metadata_compress.compress_files(
+            self.out_path, compress_paths, self.pool_size
+        ))
+        # Add the compressed copies to the changed and removed files:
+        for rel_path in compress_paths:
+            for compressed_path, encoding in zip(
+                metadata_compress.get_compressed_paths(rel_path),
+                ['gz', 'br']
+            ):
+                if encoding in files_sizes[rel_path]:
+                    self.changed.append(compressed_path)
+                elif encoding in prev_sizes.get(rel_path, {}):
+                    self.removed.append(compressed_path)
+        # Get the report of compressed sizes:
+        report = metadata_compress.get_report(files_sizes)
+        # Save the sizes and report:
+        if self.compressed_path:
+            save_json(self.compressed_path, files_sizes)
+            save_file(self.report_path, json.dumps(report, indent=1).encode(
+                'utf-8'
+            ))
+        # Display a message:
+        totals = report['total']
+        err_msg = '  {0} files compressed, total size {1} bytes'.format(
+            len(compress_paths), totals['size']
+        )
+        for encoding in ['gz', 'br']:
+            if encoding in totals:
+                err_msg += ', {0} : {1} bytes'.format(encoding, totals[encoding])
+        sys.stdout.write('{0}\n'.format(err_msg))
+
+    def remove_compressed(self):
+        """
+        Remove the compressed copies of files which have changed or been
+        removed, when compressed copies are no longer being written
+        """
+        # Load the sizes of files which were previously compressed:
+        prev_sizes = load_json(self.compressed_path, {})
+        # Remove the copies for changed and removed files:
+        for rel_path in set(self.changed + self.removed):
+            if prev_sizes.pop(rel_path, None) is not None:
+                for compressed_path in (
+                    metadata_compress.get_compressed_paths(rel_path)
+                ):
+                    self.remove_file(compressed_path)
+        # Save the sizes of the remaining copies:
+        save_json(self.compressed_path, prev_sizes)
+
+    def finish(self, remove_missing=True):
+        """
+        Finish writing. If remove_missing is True, files for frames which
+        were written previously, but not in this run, are removed, else the
+        previous files for those frames, and any other files not written in
+        this run, are kept. The hashes and manifest are then saved
+        """
+        # Remove files for missing frames if requested, else keep the
+        # previous hashes for the missing frames:
+        for frame_id, prev_hashes in self.prev_frames.items():
+            if frame_id in self.frames:
+                continue
+            if remove_missing:
+                for rel_path in prev_hashes:
+                    self.remove_file(rel_path)
+            else:
+                self.frames[frame_id] = prev_hashes
+        if not remove_missing:
+            for rel_path, prev_hash in self.prev_files.items():
+                self.files.setdefault(rel_path, prev_hash)
+        # Write compressed copies of the output files if requested, else
+        # remove any previous copies which are now out of date:
+        if self.compress:
+            self.compress_files()
+        elif self.compressed_path and os.path.exists(self.compressed_path):
+            self.remove_compressed()
+        # Nothing more to do if there is no state path:
+        if not self.hashes_path:
+            return
+        # Save the hashes:
+        save_json(self.hashes_path, {
+            'frames': self.frames,
+            'files': self.files
+        })
+        # Save the manifest:
+        self.save_manifest()
+        # Display a message:
+        err_msg = '  {0} files changed, {1} files removed'.format(
+            len(self.changed), len(self.removed)
+        )
+        sys.stdout.write('{0}\n'.format(err_msg))
 
-def save_metadata(out_path, frames_metadata):
+class CrawlJournal(object):
     """
-    Save metadata as JSON
+    Journal of the frames completed by a crawl, stored as JSON lines in the
+    state path. The journal records the output hashes, changed and removed
+    files, summary and geographic information for each saved frame, and is
+    synced to disk at least every CHECKPOINT_INTERVAL seconds. If a crawl
+    is interrupted, a resumed crawl with the same settings skips the frames
+    in the journal. The journal is removed when the crawl completes
     """
+
+    def __init__(self, state_path, settings, resume=False):
+        # Path to journal file:
+        self.journal_path = os.sep.join([state_path, 'journal.jsonl'])
+        # Information for completed frames:
+        self.frames = {}
+        # Load the existing journal if resuming:
+        if resume and os.path.exists(self.journal_path):
+            self.load(settings)
+        # Open the journal, appending if resuming, else starting a new
+        # journal:
+        if not os.path.exists(state_path):
+            os.makedirs(state_path, exist_ok=True)
+        if self.frames:
+            self.journal_file = open(self.journal_path, 'a')
+        else:
+            self.journal_file = open(self.journal_path, 'w')
+            self.write_line({'settings': settings})
+            self.sync()
+        # Time of last sync:
+        self.sync_time = time.time()
+
+    def load(self, settings):
+        """
+        Load the frames from an existing journal, if the journal was written
+        with the same settings. A partially written last line is ignored
+        """
+        with open(self.journal_path, 'r') as journal_file:
+            journal_lines = journal_file.readlines()
+        # Check the settings:
+        try:
+            if json.loads(journal_lines[0])['settings'] != settings:
+                return
+        except (IndexError, KeyError, ValueError):
+            return
+        # Load the frames:
+        for journal_line in journal_lines[1:]:
+            try:
+                frame_entry = json.loads(journal_line)
+            except ValueError:
+                continue
+            self.frames[frame_entry['id']] = frame_entry
+
+    def write_line(self, line_data):
+        """
+        Write a line of JSON data to the journal
+        """
+        self.journal_file.write('{0}\n'.format(
+            json.dumps(line_data, separators=(',', ':'))
+        ))
+
+    def add_frame(self, frame_entry):
+        """
+        Add the information for a completed frame to the journal. Returns
+        True if the journal was synced to disk
+        """
+        self.frames[frame_entry['id']] = frame_entry
+        self.write_line(frame_entry)
+        if time.time() - self.sync_time >= CHECKPOINT_INTERVAL:
+            self.sync()
+            return True
+        return False
+
+    def sync(self):
+        """
+        Flush the journal and sync it to disk
+        """
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.sync_time = time.time()
+
+    def close(self, remove=False):
+        """
+        Close the journal, syncing it to disk, or removing it if the crawl
+        is complete
+        """
+        self.sync()
+        self.journal_file.close()
+        if remove:
+            os.remove(self.journal_path)
+
+def sum_sizes(entries, file_match, match_suffix=False):
+    """
+    Return the total size of the files in a list of epoch, interferogram or
+    metadata information, for each pattern in file_match. If match_suffix
+    is True, file names are matched to the pattern they end with, else
+    file names are expected to be the patterns
+    """
+    # Init sizes:
+    sizes = [0] * len(file_match)
+    # Index of each pattern:
+    pattern_indexes = {j: i for i, j in enumerate(file_match)}
+    # Loop through entries and files:
+    for entry in entries:
+        for file_name, file_size in zip(entry['files'], entry['sizes']):
+            # Get the pattern for this file:
+            if match_suffix:
+                file_pattern = next(
+                    (i for i in file_match if file_name.endswith(i)), None
+                )
+            else:
+                file_pattern = file_name
+            # Add the size:
+            if file_pattern in pattern_indexes:
+                sizes[pattern_indexes[file_pattern]] += file_size
+    # Return the sizes:
+    return sizes
+
+def get_frame_summary(frame_metadata):
+    """
+    Get summary information for a frame for the frames summary index. This
+    includes the first and last epoch dates, epoch and interferogram
+    counts, and the total size of the files for each file pattern
+    """
+    # Epoch, interferogram and metadata information:
+    epochs = list(frame_metadata['epochs'].values())
+    ifgs = list(frame_metadata['ifgs'].values())
+    metadata = frame_metadata['metadata']
+    # All dates for the frame:
+    dates = ([i['date'] for i in epochs] + [i['start'] for i in ifgs] +
+             [i['end'] for i in ifgs])
+    # Return the summary:
+    return {
+        'first': min(dates) if dates else None,
+        'last': max(dates) if dates else None,
+        'epochs': len(epochs),
+        'ifgs': len(ifgs),
+        'epoch_sizes': sum_sizes(epochs, EPOCH_FILE_MATCH),
+        'ifg_sizes': sum_sizes(ifgs, IFG_FILE_MATCH),
+        'metadata_sizes': sum_sizes(
+            [metadata] if metadata else [], METADATA_FILE_MATCH, True
+        )
+    }
+
+def save_frame_metadata(writer, frame_metadata, out_format=OUT_FORMAT,
+                        shard_period=SHARD_PERIOD,
+                        shard_min_entries=SHARD_MIN_ENTRIES):
+    """
+    Save metadata for a single frame as JSON, in the requested format. If a
+    shard period is specified, and the frame has at least shard_min_entries
+    epochs plus interferograms, the frame is split in to date shards
+    """
+    # Frame id for this frame:
+    frame_id = frame_metadata['id']
+    # Output file for this frame:
+    frame_file = metadata_format.get_frame_file(frame_id)
+    # Number of epochs and interferograms:
+    entry_count = len(frame_metadata['epochs']) + len(frame_metadata['ifgs'])
+    # If the frame is not to be sharded:
+    if not shard_period or entry_count < shard_min_entries:
+        # Encode the frame metadata:
+        frame_data = metadata_format.encode_frame(frame_metadata, out_format)
+        # Save the frame metadata as JSON:
+        writer.save_frame(frame_id, {frame_file: dump_json(frame_data)})
+        return
+    # Encode the frame metadata as shards:
+    frame_header, shards_data = metadata_format.encode_shards(
+        frame_metadata, out_format, shard_period
+    )
+    # Files to be saved. Shard files are relative to the track directory:
+    frame_files = {frame_file: dump_json(frame_header)}
+    track_dir = os.path.dirname(frame_file)
+    for shard_file, shard_data in shards_data.items():
+        frame_files[os.sep.join([track_dir, shard_file])] = dump_json(
+            shard_data
+        )
+    # Save the frame metadata as JSON:
+    writer.save_frame(frame_id, frame_files)
+
+def get_frame_geo(frame_metadata):
+    """
+    Get the geographic information for a frame for the spatial index
+    """
+    return {i: frame_metadata['metadata'][i] for i in ['center', 'bbox']
+            if i in frame_metadata['metadata']}
+
+def save_indexes(writer, frame_ids, frames_summary, frames_geo):
+    """
+    Save the list of frame ids, the frames summary index and the spatial
+    index of frames
+    """
+    # Write a list of all frames. Sort the ids:
+    frame_ids = sorted(frame_ids)
+    # Write the frame ids as JSON:
+    writer.save_file('frames.json', dump_json(frame_ids))
+    # Write the frames summary index as JSON:
+    writer.save_file('frames_summary.json', dump_json({
+        'epoch_files': EPOCH_FILE_MATCH,
+        'ifg_files': IFG_FILE_MATCH,
+        'metadata_files': METADATA_FILE_MATCH,
+        'products': PRODUCTS,
+        'frames': {i: frames_summary[i] for i in frame_ids}
+    }))
+    # Write the spatial index of frames as JSON:
+    writer.save_file('frames_spatial.json', dump_json(
+        metadata_spatial.build_index(frames_geo)
+    ))
+
+def save_metadata(out_path, frames_metadata, state_path=None,
+                  out_format=OUT_FORMAT, shard_period=SHARD_PERIOD,
+                  shard_min_entries=SHARD_MIN_ENTRIES, catalog_path=None,
+                  stats=None, journal=None, compress=False,
+                  pool_size=None):
+    """
+    Save metadata as JSON. frames_metadata can be any iterable of frame
+    metadata, such as the generator returned by get_frames_metadata, and
+    each frame is written as soon as it is available, so only the frame ids
+    and summary information are kept in memory. If a state path is
+    specified, only files whose content has changed are written, and
+    changes are recorded in the publishing manifest. Per frame metadata is
+    written in out_format, with large frames split in to date shards
+    according to shard_period and shard_min_entries, and a summary index
+    of all frames is written to frames_summary.json, and a spatial index of
+    frame bounds to frames_spatial.json. If a catalog path is
+    specified, an SQLite catalog of all frames and files is also written.
+    Time spent waiting for frames and saving them is recorded in stats, a
+    CrawlStats instance, if specified. If journal, a CrawlJournal instance,
+    is specified, the frames already in the journal are restored from the
+    output path, each saved frame is added to the journal, and the
+    manifest and catalog are checkpointed whenever the journal is synced,
+    or if saving is interrupted. If compress is True, compressed copies of
+    the output files are written using a pool of pool_size processes
+    """
+    # Create a stats instance if not specified:
+    if stats is None:
+        stats = metadata_stats.CrawlStats()
     # Display a message:
     err_msg = '* saving metadata in {0}'.format(out_path)
     sys.stdout.write('{0}\n'.format(err_msg))
     # Make output directory if required:
     if not os.path.exists(out_path):
         os.makedirs(out_path)
-    # Write a list of all frames first. Get all frame ids:
-    frame_ids = [
-        i['id'] for i in frames_metadata
-    ]
-    # Sort the ids:
-    frame_ids.sort()
-    # Path to output file storing frame ids:
-    frame_ids_path = os.sep.join([out_path, 'frames.json'])
-    # Open the output file for writing:
-    with open(frame_ids_path, 'w') as json_file:
-        # Write the frame ids as JSON:
-        json.dump(frame_ids, json_file, separators=(',', ':'))
-    # Loop through all of the frames in the metadata:
-    for frame_metadata in frames_metadata:
-        # Frame id for this frame:
-        frame_id = frame_metadata['id']
-        # Output directory for this frame:
-        frame_out_dir = frame_id.split('_')[0]
-        frame_out_dir_path = os.sep.join([out_path, frame_out_dir])
-        # Make output directory if required:
-        if not os.path.exists(frame_out_dir_path):
-            os.makedirs(frame_out_dir_path)
-        # Output file for this frame:
-        frame_out = '{0}.json'.format(frame_id)
-        frame_out_path = os.sep.join([frame_out_dir_path, frame_out])
-        # Open output file for writing:
-        with open(frame_out_path, 'w') as json_file:
-            # Write the frame metadata as JSON:
-            json.dump(frame_metadata, json_file, separators=(',', ':'))
+    # Create the writer:
+    writer = MetadataWriter(out_path, state_path, compress, pool_size)
+    # Create the catalog writer if required:
+    if catalog_path:
+        catalog = metadata_catalog.CatalogWriter(
+            catalog_path, METADATA_FILE_MATCH
+        )
+    else:
+        catalog = None
+    # Init list of frame ids, frame summaries and geographic information:
+    frame_ids = []
+    frames_summary = {}
+    frames_geo = {}
+    # Restore any frames which were saved before an interrupted crawl:
+    if journal and journal.frames:
+        with stats.phase('resume'):
+            for frame_id, frame_entry in sorted(journal.frames.items()):
+                writer.resume_frame(frame_id, frame_entry['hashes'],
+                                    frame_entry['changed'],
+                                    frame_entry['removed'])
+                frame_ids.append(frame_id)
+                frames_summary[frame_id] = frame_entry['summary']
+                frames_geo[frame_id] = frame_entry['geo']
+                # The catalog is rebuilt, so read the frame back from the
+                # output path:
+                if catalog:
+                    catalog.add_frame(
+                        metadata_format.read_frame(out_path, frame_id)
+                    )
+        err_msg = '  resumed {0} frames from journal'.format(
+            len(journal.frames)
+        )
+        sys.stdout.write('{0}\n'.format(err_msg))
+    # Loop through all of the frames in the metadata, timing the wait for
+    # each frame separately from saving it:
+    frames_iter = iter(frames_metadata)
+    try:
+        while True:
+            with stats.phase('scan'):
+                frame_metadata = next(frames_iter, None)
+            if frame_metadata is None:
+                break
+            with stats.phase('save_frames'):
+                # Position in the lists of changed and removed files:
+                changed_count = len(writer.changed)
+                removed_count = len(writer.removed)
+                # Save the metadata for this frame:
+                save_frame_metadata(
+                    writer, frame_metadata, out_format, shard_period,
+                    shard_min_entries
+                )
+                # Store the frame id and summary:
+                frame_id = frame_metadata['id']
+                frame_ids.append(frame_id)
+                frames_summary[frame_id] = get_frame_summary(frame_metadata)
+                frames_geo[frame_id] = get_frame_geo(frame_metadata)
+                # Add the frame to the catalog:
+                if catalog:
+                    catalog.add_frame(frame_metadata)
+                # Add the frame to the journal, and checkpoint if the
+                # journal was synced:
+                if journal and journal.add_frame({
+                    'id': frame_id,
+                    'hashes': writer.frames[frame_id],
+                    'changed': writer.changed[changed_count:],
+                    'removed': writer.removed[removed_count:],
+                    'summary': frames_summary[frame_id],
+                    'geo': frames_geo[frame_id],
+                    'cost': stats.frames.get(frame_id, {}).get('scan_time')
+                }):
+                    writer.save_manifest()
+                    if catalog:
+                        catalog.db.commit()
+    except BaseException:
+        # If interrupted, e.g. by a SIGTERM at the end of the walltime, sync
+        # the journal and record the files changed so far in the manifest,
+        # so a resumed crawl can continue from here:
+        if journal:
+            journal.close()
+            writer.save_manifest()
+        raise
+    with stats.phase('save_indexes'):
+        save_indexes(writer, frame_ids, frames_summary, frames_geo)
+    with stats.phase('finish'):
+        # Finish writing, removing any frames which no longer exist:
+        writer.finish()
+        # Close the catalog:
+        if catalog:
+            catalog.close()
+        # The crawl is complete, so the journal is no longer required:
+        if journal:
+            journal.close(remove=True)
+
+def parse_args():
+    """
+    Parse command line arguments
+    """
+    # Create the argument parser:
+    arg_parser = argparse.ArgumentParser(
+        description='Get LiCSAR metadata and save as JSON'
+    )
+    arg_parser.add_argument(
+        '--lics-path', default=LICS_PATH,
+        help='top level LiCSAR products directory (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--out-path', default=OUT_PATH,
+        help='output path for JSON data (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--format', default=OUT_FORMAT,
+        choices=sorted(metadata_format.FORMATS),
+        help='output format for per frame JSON data (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--shard-period', default=SHARD_PERIOD,
+        choices=sorted(metadata_format.SHARD_PERIODS) + ['none'],
+        help=('period for splitting large frames in to date shards '
+              '(default: %(default)s)')
+    )
+    arg_parser.add_argument(
+        '--shard-min-entries', type=int, default=SHARD_MIN_ENTRIES,
+        help=('minimum number of epochs plus interferograms for a frame to '
+              'be sharded (default: %(default)s)')
+    )
+    arg_parser.add_argument(
+        '--catalog', default=CATALOG_PATH,
+        help='path for SQLite catalog of all frames and files (optional)'
+    )
+    arg_parser.add_argument(
+        '--compress', action='store_true',
+        help=('also write gzip and, if the brotli module is available, '
+              'brotli compressed copies of the output JSON files, for '
+              'serving pre-compressed content')
+    )
+    arg_parser.add_argument(
+        '--cache-path', default=CACHE_PATH,
+        help='path for crawl cache (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--state-path', default=STATE_PATH,
+        help=('path for output state, including manifest of changed files '
+              '(default: %(default)s)')
+    )
+    arg_parser.add_argument(
+        '--stats-path', default=STATS_PATH,
+        help=('path for JSON crawl statistics, or an empty string to not '
+              'write statistics (default: %(default)s)')
+    )
+    arg_parser.add_argument(
+        '--profile', default=None,
+        help=('profile the main process with cProfile, and write the '
+              'profile data to this path (optional)')
+    )
+    arg_parser.add_argument(
+        '--part-count', type=int, default=None,
+        help=('split the crawl in to this many parts by track, and crawl '
+              'one part, writing partial results to the parts path')
+    )
+    arg_parser.add_argument(
+        '--part-index', type=int, default=None,
+        help=('index of the part to crawl, from 0 (default: from '
+              'SLURM_ARRAY_TASK_ID)')
+    )
+    arg_parser.add_argument(
+        '--merge-parts', action='store_true',
+        help=('merge the partial results of a split crawl with --part-count '
+              'parts, and save the metadata')
+    )
+    arg_parser.add_argument(
+        '--local-parts', type=int, default=None,
+        help=('split the crawl in to this many parts, crawl the parts in '
+              'parallel processes on this machine, and merge the results')
+    )
+    arg_parser.add_argument(
+        '--parts-path', default=PARTS_PATH,
+        help='path for partial results of a split crawl (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--update', default=None, metavar='CHANGELOG',
+        help=('update existing metadata for the frame, epoch and '
+              'interferogram paths listed in this file, or - for stdin, '
+              'rather than crawling all frames')
+    )
+    arg_parser.add_argument(
+        '--resume', action='store_true',
+        help=('resume an interrupted crawl, skipping the frames recorded in '
+              'the journal in the state path')
+    )
+    arg_parser.add_argument(
+        '-i', '--incremental', action='store_true',
+        help=('only rescan epoch and interferogram directories which have '
+              'changed since the previous run')
+    )
+    arg_parser.add_argument(
+        '-p', '--processes', type=int, default=None,
+        help=('number of processes to use (default: SLURM_CPUS_PER_TASK if '
+              'set, else {0})'.format(POOL_SIZE))
+    )
+    arg_parser.add_argument(
+        '-t', '--threads', type=int, default=THREAD_COUNT,
+        help='number of threads per process (default: %(default)s)'
+    )
+    # Parse the arguments:
+    args = arg_parser.parse_args()
+    if args.shard_period == 'none':
+        args.shard_period = None
+    # Check split crawl options:
+    if args.local_parts:
+        args.part_count = args.local_parts
+    if args.merge_parts and not args.part_count:
+        arg_parser.error('--merge-parts requires --part-count')
+    if args.part_count and not (args.merge_parts or args.local_parts):
+        # Get the part index from the SLURM array task id if required:
+        if args.part_index is None:
+            try:
+                args.part_index = (
+                    int(os.environ['SLURM_ARRAY_TASK_ID']) -
+                    int(os.environ.get('SLURM_ARRAY_TASK_MIN', 0))
+                )
+            except (KeyError, ValueError):
+                arg_parser.error(('--part-index is required if not running '
+                                  'as a SLURM array job'))
+        if not 0 <= args.part_index < args.part_count:
+            arg_parser.error('--part-index must be less than --part-count')
+    # Return the parsed arguments:
+    return args
+
+def get_track_costs(frame_tracks, frame_costs):
+    """
+    Sum the crawl cost of the frames in each track. frame_tracks is a dict
+    of the track directory for each frame id, and frame_costs a dict of the
+    cost for each frame id
+    """
+    track_costs = {}
+    for frame_id, frame_cost in frame_costs.items():
+        track_dir = frame_tracks[frame_id]
+        track_costs[track_dir] = track_costs.get(track_dir, 0) + frame_cost
+    return {i: round(j, 6) for i, j in track_costs.items()}
+
+def save_track_costs(state_path, track_costs):
+    """
+    Save the crawl cost of each track in the state path
+    """
+    if state_path:
+        save_json(os.sep.join([state_path, TRACK_COSTS_FILE]), track_costs)
+
+def split_tracks(track_dirs, part_count, track_costs):
+    """
+    Split track directories in to part_count parts, balanced by the crawl
+    cost of each track from a previous run. Tracks with a known cost are
+    assigned largest first to the part with the lowest total cost, and
+    tracks without a known cost are assigned by a hash of the name, so the
+    split only depends on the stored costs and not on which tracks exist.
+    Returns a list of sets of track directories for each part
+    """
+    # Init parts and total costs:
+    parts = [set() for _ in range(part_count)]
+    part_costs = [0] * part_count
+    # Assign tracks with known costs, largest first:
+    for track_dir in sorted(track_costs, key=lambda i: (-track_costs[i], i)):
+        part_index = part_costs.index(min(part_costs))
+        parts[part_index].add(track_dir)
+        part_costs[part_index] += track_costs[track_dir]
+    # Assign other tracks:
+    for track_dir in track_dirs:
+        if track_dir not in track_costs:
+            part_index = zlib.crc32(track_dir.encode('utf-8')) % part_count
+            parts[part_index].add(track_dir)
+    # Return the parts:
+    return parts
+
+def get_part_path(parts_path, part_index, part_count):
+    """
+    Return the path to the partial results file for a part of the crawl
+    """
+    return os.sep.join([parts_path, 'part_{0:04d}_of_{1:04d}.jsonl'.format(
+        part_index, part_count
+    )])
+
+def crawl_part(args, part_index, part_count, display_progress_info=True):
+    """
+    Crawl one part of a split crawl. The frames in the tracks assigned to
+    this part are scanned, and the metadata and crawl cost for each frame
+    are written as JSON lines to the partial results file for the part.
+    Statistics for the part are saved next to the stats path
+    """
+    # Create the crawl statistics:
+    stats = metadata_stats.CrawlStats()
+    with stats.phase('total'):
+        # Find all frame directories:
+        with stats.phase('get_frames'):
+            frames = get_frames(args.lics_path)
+        # Get the tracks for this part:
+        track_costs = {}
+        if args.state_path:
+            track_costs = load_json(
+                os.sep.join([args.state_path, TRACK_COSTS_FILE]), {}
+            )
+        part_tracks = split_tracks(
+            sorted(set(i['track_dir'] for i in frames)), part_count,
+            track_costs
+        )[part_index]
+        frames = [i for i in frames if i['track_dir'] in part_tracks]
+        # Display a message:
+        err_msg = '* crawling part {0} of {1}, {2} tracks, {3} frames'.format(
+            part_index + 1, part_count, len(part_tracks), len(frames)
+        )
+        sys.stdout.write('{0}\n'.format(err_msg))
+        # Get all frame metadata, as a generator:
+        frames_metadata = get_frames_metadata(
+            args.lics_path, frames, args.cache_path, args.incremental,
+            args.processes, args.threads, stats, display_progress_info
+        )
+        # Write the partial results, via a temporary file:
+        part_path = get_part_path(args.parts_path, part_index, part_count)
+        if not os.path.exists(args.parts_path):
+            os.makedirs(args.parts_path, exist_ok=True)
+        tmp_path = '{0}.tmp'.format(part_path)
+        with open(tmp_path, 'w') as part_file:
+            while True:
+                with stats.phase('scan'):
+                    frame_metadata = next(frames_metadata, None)
+                if frame_metadata is None:
+                    break
+                with stats.phase('save_frames'):
+                    part_file.write('{0}\n'.format(json.dumps({
+                        'cost': stats.frames[frame_metadata['id']]['scan_time'],
+                        'metadata': frame_metadata
+                    }, separators=(',', ':'))))
+        os.replace(tmp_path, part_path)
+    # Display the statistics report and save the statistics:
+    sys.stdout.write('{0}\n'.format(stats.format_report()))
+    if args.stats_path:
+        stats_base, stats_ext = os.path.splitext(args.stats_path)
+        stats.save('{0}.part_{1:04d}{2}'.format(
+            stats_base, part_index, stats_ext
+        ))
+
+def read_parts(parts_path, part_count, frame_costs, frame_tracks):
+    """
+    Generator which reads the partial results for all parts of a split
+    crawl, and yields the metadata for each frame. The crawl cost and track
+    directory of each frame are stored in the frame_costs and frame_tracks
+    dicts. An error is raised if the results for any part are missing
+    """
+    # Check all parts are available before starting:
+    part_paths = [get_part_path(parts_path, i, part_count)
+                  for i in range(part_count)]
+    for part_path in part_paths:
+        if not os.path.exists(part_path):
+            err_msg = 'missing partial results: {0}'.format(part_path)
+            raise FileNotFoundError(err_msg)
+    # Loop through parts:
+    for part_path in part_paths:
+        with open(part_path, 'r') as part_file:
+            for part_line in part_file:
+                frame_info = json.loads(part_line)
+                frame_id = frame_info['metadata']['id']
+                # Skip frames which have been seen in another part, in case
+                # the tracks changed between parts:
+                if frame_id in frame_costs:
+                    continue
+                frame_costs[frame_id] = frame_info['cost']
+                frame_tracks[frame_id] = os.path.dirname(
+                    frame_info['metadata']['path']
+                )
+                yield frame_info['metadata']
+
+def merge_parts(args, stats):
+    """
+    Merge the partial results of a split crawl, saving the metadata, indexes
+    and track costs as for a full crawl. The partial results are removed
+    once they have been merged
+    """
+    # Display a message:
+    err_msg = '* merging {0} parts from {1}'.format(
+        args.part_count, args.parts_path
+    )
+    sys.stdout.write('{0}\n'.format(err_msg))
+    # Crawl cost and track directory of each frame, read from the parts:
+    frame_costs = {}
+    frame_tracks = {}
+    # Save the metadata from the parts:
+    save_metadata(
+        args.out_path, read_parts(args.parts_path, args.part_count,
+                                  frame_costs, frame_tracks),
+        args.state_path, args.format, args.shard_period,
+        args.shard_min_entries, args.catalog, stats, None, args.compress,
+        args.processes
+    )
+    # Save the track costs:
+    save_track_costs(args.state_path,
+                     get_track_costs(frame_tracks, frame_costs))
+    # Remove the partial results:
+    for part_index in range(args.part_count):
+        os.remove(get_part_path(args.parts_path, part_index, args.part_count))
+
+def run_local_parts(args):
+    """
+    Run all parts of a split crawl on this machine, using a process for each
+    part in place of a SLURM array job. The requested number of processes is
+    shared between the parts. Progress is not displayed for the parts. If a
+    part fails, the parts which are still running are stopped
+    """
+    # Share the processes between the parts, so the machine is not
+    # oversubscribed:
+    pool_size = args.processes or get_pool_size()
+    part_args = argparse.Namespace(**vars(args))
+    part_args.processes = max(1, pool_size // args.part_count)
+    # Init list of processes:
+    part_processes = []
+    try:
+        # Start a process for each part:
+        for part_index in range(args.part_count):
+            part_process = multiprocessing.Process(
+                target=crawl_part,
+                args=(part_args, part_index, args.part_count, False)
+            )
+            part_process.start()
+            part_processes.append(part_process)
+        # Wait for the processes as they finish, and check they succeeded:
+        running = {j.sentinel: (i, j) for i, j in enumerate(part_processes)}
+        while running:
+            for sentinel in multiprocessing.connection.wait(list(running)):
+                part_index, part_process = running.pop(sentinel)
+                part_process.join()
+                if part_process.exitcode != 0:
+                    err_msg = 'crawl of part {0} failed'.format(part_index + 1)
+                    raise RuntimeError(err_msg)
+    finally:
+        # Stop any parts which are still running, e.g. after a part failed
+        # or this process was interrupted:
+        for part_process in part_processes:
+            if part_process.is_alive():
+                part_process.terminate()
+        for part_process in part_processes:
+            part_process.join()
+
+def match_dir(dir_name, dir_match):
+    """
+    Check if a directory name matches a directory name pattern
+    """
+    name_match = re.search(dir_match, dir_name)
+    return bool(name_match) and name_match.group(0) == dir_name
+
+def parse_changelog(changelog_lines, lics_path):
+    """
+    Parse a changelog of changed paths within the LiCSAR products directory.
+    Paths may be absolute, or relative to the products directory, and may
+    be frame, epoch or interferogram directories, or files within them.
+    Returns a dict of changes for each frame, containing the track
+    directory, whether the whole frame should be rescanned, and the sets of
+    epoch and interferogram directories to rescan
+    """
+    # Init changes:
+    changes = {}
+    # Loop through changelog lines:
+    for changelog_line in changelog_lines:
+        # Skip blank lines and comments:
+        changed_path = changelog_line.strip()
+        if not changed_path or changed_path.startswith('#'):
+            continue
+        # Path relative to the products directory:
+        if os.path.isabs(changed_path):
+            changed_path = os.path.relpath(changed_path, lics_path)
+        path_parts = os.path.normpath(changed_path).split(os.sep)
+        # Check the track and frame directories:
+        if len(path_parts) < 2 or not (
+            match_dir(path_parts[0], TRACK_DIR_MATCH) and
+            match_dir(path_parts[1], FRAME_DIR_MATCH)
+        ):
+            err_msg = '  skipping unrecognised path: {0}'.format(
+                changelog_line.strip()
+            )
+            sys.stdout.write('{0}\n'.format(err_msg))
+            continue
+        # Changes for this frame:
+        frame_changes = changes.setdefault(path_parts[1], {
+            'track_dir': path_parts[0],
+            'rescan': False,
+            'epochs': set(),
+            'ifgs': set()
+        })
+        # If the path is the frame directory, the whole frame is rescanned:
+        if len(path_parts) == 2:
+            frame_changes['rescan'] = True
+            continue
+        # Check for epoch and interferogram directories:
+        for dirs_key, dirs_name, dir_match in [
+            ('epochs', 'epochs', EPOCH_DIR_MATCH),
+            ('ifgs', 'interferograms', IFG_DIR_MATCH)
+        ]:
+            if path_parts[2] != dirs_name:
+                continue
+            # If a directory is specified, rescan it, else rescan the whole
+            # frame:
+            if len(path_parts) > 3 and match_dir(path_parts[3], dir_match):
+                frame_changes[dirs_key].add(path_parts[3])
+            else:
+                frame_changes['rescan'] = True
+    # Return the changes:
+    return changes
+
+def rescan_frame(lics_path, frame_id, frame_changes, cache_path=None):
+    """
+    Rescan the changed directories of a frame, using the crawl cache for
+    all other directories. Metadata files are always rescanned. If the
+    whole frame is to be rescanned, or there is no cached information for
+    the frame, the frame is crawled incrementally. Returns the frame
+    metadata, or None if the frame no longer exists
+    """
+    # Track directory and path to frame:
+    track_dir = frame_changes['track_dir']
+    frame_path = os.sep.join([lics_path, track_dir, frame_id])
+    # If the frame no longer exists, there is no metadata:
+    if not os.path.isdir(frame_path):
+        return None
+    # Load the cached information for the frame:
+    frame_cache = None
+    if cache_path:
+        frame_cache = load_frame_cache(cache_path, track_dir, frame_id)
+    # Crawl the whole frame if required. Cached information from before file
+    # mtimes were recorded, or with different file patterns, is rescanned by
+    # an incremental crawl:
+    if frame_changes['rescan'] or frame_cache is None or not all(
+        has_file_mtimes(i) for dirs_key in ['epochs', 'ifgs']
+        for i in frame_cache.get(dirs_key, {}).values()
+    ):
+        return get_frame_metadata({
+            'lics_path': lics_path,
+            'id': frame_id,
+            'track_dir': track_dir,
+            'cache_path': cache_path,
+            'incremental': True
+        })
+    # Init frame information from the cache:
+    frame_info = {
+        'id': frame_id,
+        'track_dir': track_dir,
+        'frame_path': frame_path,
+        'metadata': {},
+        'epochs': frame_cache.get('epochs', {}),
+        'ifgs': frame_cache.get('ifgs', {})
+    }
+    # Get the metadata information:
+    metadata_path = os.sep.join([frame_path, 'metadata'])
+    if os.path.isdir(metadata_path):
+        frame_info['metadata'] = get_metadata(
+            metadata_path, METADATA_FILE_SUFFIX
+        )
+    # Rescan the changed epoch and interferogram directories:
+    for dirs_key, dirs_name, scan_function, file_match in [
+        ('epochs', 'epochs', get_epoch, EPOCH_FILE_SET),
+        ('ifgs', 'interferograms', get_ifg, IFG_FILE_SET)
+    ]:
+        dirs_path = os.sep.join([frame_path, dirs_name])
+        for dir_name in frame_changes[dirs_key]:
+            dir_path = os.sep.join([dirs_path, dir_name])
+            # If the directory has been removed, remove the information:
+            if not os.path.isdir(dir_path):
+                frame_info[dirs_key].pop(dir_name, None)
+                continue
+            # Else, scan the directory:
+            frame_info[dirs_key][dir_name] = [
+                os.stat(dir_path).st_mtime_ns,
+                scan_function(dirs_path, dir_name, file_match)
+            ]
+        # Convert the information to compact records:
+        frame_info[dirs_key] = get_dir_records(dirs_key, frame_info[dirs_key])
+    # Return the metadata, updating the cache:
+    return finish_frame(frame_info, cache_path)
+
+def update_metadata(args, stats):
+    """
+    Update the metadata for the frames listed in a changelog, rescanning
+    only the changed directories and patching the existing output. The
+    list of frames is only changed if frames are added or removed
+    """
+    # Read the changelog:
+    if args.update == '-':
+        changes = parse_changelog(sys.stdin, args.lics_path)
+    else:
+        with open(args.update, 'r') as changelog_file:
+            changes = parse_changelog(changelog_file, args.lics_path)
+    # Display a message:
+    err_msg = '* updating {0} frames from changelog'.format(len(changes))
+    sys.stdout.write('{0}\n'.format(err_msg))
+    # Load the existing indexes:
+    frames_path = os.sep.join([args.out_path, 'frames.json'])
+    if not os.path.exists(frames_path):
+        err_msg = 'no existing metadata to update in {0}'.format(
+            args.out_path
+        )
+        raise FileNotFoundError(err_msg)
+    frame_ids = set(load_json(frames_path))
+    frames_summary = load_json(
+        os.sep.join([args.out_path, 'frames_summary.json']), {}
+    ).get('frames', {})
+    spatial_index = load_json(
+        os.sep.join([args.out_path, 'frames_spatial.json']), {}
+    )
+    frames_geo = {
+        i: {'bbox': j} for i, j in zip(spatial_index.get('frames', []),
+                                       spatial_index.get('bboxes', []))
+    }
+    # Create the writer:
+    writer = MetadataWriter(args.out_path, args.state_path, args.compress,
+                            args.processes)
+    # Update the catalog if it exists:
+    catalog = None
+    if args.catalog and os.path.exists(args.catalog):
+        catalog = metadata_catalog.CatalogWriter(
+            args.catalog, METADATA_FILE_MATCH, rebuild=False
+        )
+    # Loop through changed frames:
+    for frame_id in sorted(changes):
+        # Rescan the frame:
+        with stats.phase('scan'):
+            frame_metadata = rescan_frame(
+                args.lics_path, frame_id, changes[frame_id], args.cache_path
+            )
+        with stats.phase('save_frames'):
+            # If the frame has been removed, remove the output:
+            if frame_metadata is None:
+                writer.remove_frame(frame_id)
+                frame_ids.discard(frame_id)
+                frames_summary.pop(frame_id, None)
+                frames_geo.pop(frame_id, None)
+                if catalog:
+                    catalog.remove_frame(frame_id)
+                continue
+            # Else, save the updated metadata:
+            save_frame_metadata(
+                writer, frame_metadata, args.format, args.shard_period,
+                args.shard_min_entries
+            )
+            frame_ids.add(frame_id)
+            frames_summary[frame_id] = get_frame_summary(frame_metadata)
+            frames_geo[frame_id] = get_frame_geo(frame_metadata)
+            if catalog:
+                catalog.add_frame(frame_metadata)
+    with stats.phase('save_indexes'):
+        save_indexes(writer, frame_ids, frames_summary, frames_geo)
+    with stats.phase('finish'):
+        # Finish writing, keeping all frames which were not updated:
+        writer.finish(remove_missing=False)
+        # Close the catalog:
+        if catalog:
+            catalog.close()
+
+def run(args, stats):
+    """
+    Find the frames, and get and save the metadata for all frames. If the
+    crawl was split in to parts, the partial results are merged instead,
+    and if a changelog is specified, only the changed frames are updated
+    """
+    # Merge the parts of a split crawl if requested:
+    if args.merge_parts or args.local_parts:
+        merge_parts(args, stats)
+        return
+    # Update frames from a changelog if requested:
+    if args.update:
+        update_metadata(args, stats)
+        return
+    # Find all frame directories:
+    with stats.phase('get_frames'):
+        frames = get_frames(args.lics_path)
+    frame_tracks = {i['id']: i['track_dir'] for i in frames}
+    # Open the crawl journal if there is a state path, and skip any frames
+    # which were completed before an interrupted crawl if resuming:
+    journal = None
+    if args.state_path:
+        journal = CrawlJournal(args.state_path, {
+            'lics_path': os.path.abspath(args.lics_path),
+            'format': args.format,
+            'shard_period': args.shard_period,
+            'shard_min_entries': args.shard_min_entries
+        }, args.resume)
+        frames = [i for i in frames if i['id'] not in journal.frames]
+    # Get all frame metadata, as a generator:
+    frames_metadata = get_frames_metadata(
+        args.lics_path, frames, args.cache_path, args.incremental,
+        args.processes, args.threads, stats
+    )
+    # Save the metadata as each frame is completed:
+    save_metadata(
+        args.out_path, frames_metadata, args.state_path, args.format,
+        args.shard_period, args.shard_min_entries, args.catalog, stats,
+        journal, args.compress, args.processes
+    )
+    # Save the crawl cost of each track, for balancing split crawls,
+    # including the costs of any frames completed before the crawl was
+    # resumed:
+    frame_costs = {i: j['scan_time'] for i, j in stats.frames.items()}
+    if journal:
+        for frame_id, frame_entry in journal.frames.items():
+            if frame_entry.get('cost') is not None and (
+                frame_id in frame_tracks
+            ):
+                frame_costs.setdefault(frame_id, frame_entry['cost'])
+    save_track_costs(args.state_path, get_track_costs(
+        frame_tracks, frame_costs
+    ))
+
+class Terminated(KeyboardInterrupt):
+    """
+    Raised on SIGTERM. A subclass of KeyboardInterrupt, so it is handled in
+    the same way, but the process exits with the status for SIGTERM
+    """
+
+def handle_sigterm(signal_number, frame):
+    """
+    Handle SIGTERM, e.g. from SLURM before the walltime is reached, as a
+    KeyboardInterrupt, so the crawl journal and manifest are saved
+    """
+    raise Terminated
 
 def main():
     """
     Main program function
     """
+    # Get command line arguments:
+    args = parse_args()
+    # Treat SIGTERM as an interrupt:
+    signal.signal(signal.SIGTERM, handle_sigterm)
     # Get a start time value:
     start_time = time.time()
-    # Find all frame directories:
-    frames = get_frames(LICS_PATH)
-    # Get all frame metadata:
-    frames_metadata = get_frames_metadata(LICS_PATH, frames)
-    # Save the metadata:
-    save_metadata(OUT_PATH, frames_metadata)
+    # If crawling a single part of a split crawl, e.g. as a SLURM array
+    # job, crawl the part and stop:
+    if args.part_count and not (args.merge_parts or args.local_parts):
+        crawl_part(args, args.part_index, args.part_count)
+        return
+    # If running a split crawl locally, crawl all of the parts:
+    if args.local_parts:
+        run_local_parts(args)
+    # Create the crawl statistics:
+    stats = metadata_stats.CrawlStats()
+    # Run, with the profiler if requested:
+    with stats.phase('total'):
+        if args.profile:
+            profiler = cProfile.Profile()
+            profiler.runcall(run, args, stats)
+            profiler.dump_stats(args.profile)
+        else:
+            run(args, stats)
+    # Display the statistics report and save the statistics:
+    sys.stdout.write('{0}\n'.format(stats.format_report()))
+    if args.stats_path:
+        stats.save(args.stats_path)
     # Get the current time for elapsed time calculation and display:
     elapsed_time = time.time() - start_time
     time_msg = 'elapsed time : {0:.02f} seconds\n'
@@ -467,6 +2204,10 @@ if __name__ == '__main__':
     # Try to catch KeyboardInterrupt:
     try:
         main()
-    except KeyboardInterrupt:
+    except KeyboardInterrupt as interrupt:
         sys.stdout.write('\n')
-        sys.exit()
+        # Exit with the status of a process killed by the signal, so
+        # batch systems do not record the crawl as complete:
+        if isinstance(interrupt, Terminated):
+            sys.exit(128 + signal.SIGTERM)
+        sys.exit(128 + signal.SIGINT)
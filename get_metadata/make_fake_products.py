@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Create a fake LiCSAR products directory tree, for testing and benchmarking
+the metadata crawler without access to the real products directory
+"""
+
+# ---
+
+# std lib imports:
+import argparse
+import datetime
+import os
+import random
+import struct
+import sys
+# local imports:
+import get_metadata
+
+# ---
+
+# Number of tracks, frames per track and mean epochs per frame:
+TRACK_COUNT = 3
+FRAME_COUNT = 4
+EPOCH_COUNT = 60
+
+# Number of following epochs each epoch is paired with for interferograms:
+IFG_PAIRS = 3
+
+# Spread of the log normal distribution of frame sizes. Zero gives all
+# frames the same number of epochs:
+FRAME_SKEW = 1.0
+
+# Fraction of files which are symbolic links, and fraction of expected
+# files which are missing:
+LINK_RATIO = 0.1
+MISSING_RATIO = 0.05
+
+# Number of days between epochs, and date of the first epoch:
+EPOCH_INTERVAL = 6
+START_DATE = datetime.date(2016, 1, 1)
+
+# Random seed:
+SEED = 1
+
+# Ranges of file sizes in bytes, by file extension. Files are written
+# sparse, so take little space on disk:
+FILE_SIZES = {
+    'tif': (2000000, 50000000),
+    'png': (50000, 500000),
+    'jpg': (50000, 500000)
+}
+DEFAULT_FILE_SIZE = (1000, 10000)
+
+# Name of directory within the tree which contains the targets of links:
+LINK_TARGETS_DIR = 'link_targets'
+
+# Size of frames in degrees, for the bounds of the geo.hgt.tif files:
+FRAME_WIDTH = 2.5
+FRAME_HEIGHT = 2.0
+
+# ---
+
+def write_geotiff_header(tiff_path, bbox, pixel_size=0.001):
+    """
+    Write a GeoTIFF file which contains only the tags required to get the
+    bounds of the image
+    """
+    # Image size:
+    west, south, east, north = bbox
+    width = int(round((east - west) / pixel_size))
+    length = int(round((north - south) / pixel_size))
+    # Tags, as (tag, type, values):
+    tags = [
+        (256, 4, [width]),
+        (257, 4, [length]),
+        (33550, 12, [pixel_size, pixel_size, 0.0]),
+        (33922, 12, [0.0, 0.0, 0.0, west, north, 0.0])
+    ]
+    type_formats = {4: 'I', 12: 'd'}
+    # Offset of values which do not fit in directory entries:
+    values_offset = 8 + 2 + len(tags) * 12 + 4
+    # Create the image file directory and values:
+    ifd = struct.pack('<H', len(tags))
+    values = b''
+    for tag, field_type, tag_values in tags:
+        tag_data = struct.pack(
+            '<' + type_formats[field_type] * len(tag_values), *tag_values
+        )
+        ifd += struct.pack('<HHI', tag, field_type, len(tag_values))
+        if len(tag_data) <= 4:
+            ifd += tag_data.ljust(4, b'\0')
+        else:
+            ifd += struct.pack('<I', values_offset + len(values))
+            values += tag_data
+    ifd += struct.pack('<I', 0)
+    # Write the file:
+    with open(tiff_path, 'wb') as tiff_file:
+        tiff_file.write(b'II' + struct.pack('<HI', 42, 8) + ifd + values)
+
+def get_file_size(file_pattern):
+    """
+    Return a random file size for a file pattern
+    """
+    size_range = FILE_SIZES.get(file_pattern.split('.')[-1],
+                                DEFAULT_FILE_SIZE)
+    return random.randint(*size_range)
+
+def make_file(file_path, file_size, options):
+    """
+    Create a sparse file of the requested size. A fraction of files are
+    created as links to a file in the link targets directory
+    """
+    # Create a link if required. The link target is relative to the
+    # directory of the link, so links resolve wherever the tree is:
+    if random.random() < options['link_ratio']:
+        target_path = os.sep.join([
+            options['out_path'], LINK_TARGETS_DIR,
+            os.path.relpath(file_path, options['out_path'])
+        ])
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        with open(target_path, 'wb') as target_file:
+            target_file.truncate(file_size)
+        os.symlink(os.path.relpath(target_path, os.path.dirname(file_path)),
+                   file_path)
+        if not os.path.exists(file_path):
+            err_msg = 'link {0} does not resolve to {1}'.format(
+                file_path, target_path
+            )
+            raise OSError(err_msg)
+    else:
+        with open(file_path, 'wb') as out_file:
+            out_file.truncate(file_size)
+
+def make_files(dir_path, dir_name, file_patterns, options):
+    """
+    Create a directory and the files for an epoch or interferogram, with a
+    fraction of expected files missing
+    """
+    os.makedirs(dir_path, exist_ok=True)
+    for file_pattern in file_patterns:
+        if random.random() < options['missing_ratio']:
+            continue
+        make_file(
+            os.sep.join([dir_path, '{0}.{1}'.format(dir_name, file_pattern)]),
+            get_file_size(file_pattern), options
+        )
+
+def make_frame(frame_path, frame_id, epoch_count, options):
+    """
+    Create the metadata, epochs and interferograms for a frame
+    """
+    # Random frame center:
+    center_lon = round(random.uniform(-180, 180), 3)
+    center_lat = round(random.uniform(-60, 70), 3)
+    # Metadata:
+    metadata_path = os.sep.join([frame_path, 'metadata'])
+    os.makedirs(metadata_path, exist_ok=True)
+    with open(os.sep.join([metadata_path, 'metadata.txt']), 'w') as txt_file:
+        txt_file.write('center_lon={0}\ncenter_lat={1}\n'.format(
+            center_lon, center_lat
+        ))
+    for file_pattern in options['metadata_files']:
+        if file_pattern == 'metadata.txt':
+            continue
+        file_path = os.sep.join([
+            metadata_path, '{0}.{1}'.format(frame_id, file_pattern)
+        ])
+        if file_pattern.endswith('hgt.tif'):
+            write_geotiff_header(file_path, [
+                center_lon - FRAME_WIDTH / 2, center_lat - FRAME_HEIGHT / 2,
+                center_lon + FRAME_WIDTH / 2, center_lat + FRAME_HEIGHT / 2
+            ])
+        else:
+            make_file(file_path, get_file_size(file_pattern), options)
+    # Epoch dates, with occasional gaps:
+    epoch_dates = []
+    epoch_date = START_DATE
+    while len(epoch_dates) < epoch_count:
+        epoch_date += datetime.timedelta(days=options['epoch_interval'])
+        if random.random() < 0.9:
+            epoch_dates.append(epoch_date.strftime('%Y%m%d'))
+    # Epochs:
+    for epoch_dir in epoch_dates:
+        make_files(
+            os.sep.join([frame_path, 'epochs', epoch_dir]), epoch_dir,
+            options['epoch_files'], options
+        )
+    # Interferograms:
+    for i, start_date in enumerate(epoch_dates):
+        for end_date in epoch_dates[i + 1:i + 1 + options['ifg_pairs']]:
+            ifg_dir = '{0}_{1}'.format(start_date, end_date)
+            make_files(
+                os.sep.join([frame_path, 'interferograms', ifg_dir]), ifg_dir,
+                options['ifg_files'], options
+            )
+
+def make_tree(options):
+    """
+    Create a fake LiCSAR products directory tree. Returns a list of the
+    frame ids which were created
+    """
+    # Seed the random numbers, so trees are reproducible:
+    random.seed(options['seed'])
+    # Init list of frame ids:
+    frame_ids = []
+    # Loop through tracks:
+    for track in range(1, options['tracks'] + 1):
+        # Loop through frames:
+        for frame in range(options['frames']):
+            # Frame id:
+            frame_id = '{0:03d}{1}_{2:05d}_{3:06d}'.format(
+                track, 'AD'[frame % 2], frame * 100 + track,
+                random.randint(0, 999999)
+            )
+            frame_ids.append(frame_id)
+            # Number of epochs for this frame, from a log normal
+            # distribution with the requested mean:
+            epoch_count = max(2, int(round(
+                options['epochs'] *
+                random.lognormvariate(-options['skew'] ** 2 / 2,
+                                      options['skew'])
+            )))
+            # Create the frame:
+            make_frame(
+                os.sep.join([options['out_path'], str(track), frame_id]),
+                frame_id, epoch_count, options
+            )
+    # Return the frame ids:
+    return frame_ids
+
+def get_options(out_path, **kwargs):
+    """
+    Return a dict of options for make_tree, using default values for any
+    options which are not specified
+    """
+    options = {
+        'out_path': out_path,
+        'tracks': TRACK_COUNT,
+        'frames': FRAME_COUNT,
+        'epochs': EPOCH_COUNT,
+        'ifg_pairs': IFG_PAIRS,
+        'skew': FRAME_SKEW,
+        'link_ratio': LINK_RATIO,
+        'missing_ratio': MISSING_RATIO,
+        'epoch_interval': EPOCH_INTERVAL,
+        'epoch_files': get_metadata.EPOCH_FILE_MATCH,
+        'ifg_files': get_metadata.IFG_FILE_MATCH,
+        'metadata_files': get_metadata.METADATA_FILE_MATCH,
+        'seed': SEED
+    }
+    options.update(kwargs)
+    return options
+
+def parse_args():
+    """
+    Parse command line arguments
+    """
+    # Create the argument parser:
+    arg_parser = argparse.ArgumentParser(
+        description=('Create a fake LiCSAR products directory tree for '
+                     'testing and benchmarking the metadata crawler')
+    )
+    arg_parser.add_argument(
+        'out_path', help='output directory, which must not already exist'
+    )
+    arg_parser.add_argument(
+        '--tracks', type=int, default=TRACK_COUNT,
+        help='number of tracks (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--frames', type=int, default=FRAME_COUNT,
+        help='number of frames per track (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--epochs', type=int, default=EPOCH_COUNT,
+        help='mean number of epochs per frame (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--ifg-pairs', type=int, default=IFG_PAIRS,
+        help=('number of following epochs each epoch is paired with for '
+              'interferograms (default: %(default)s)')
+    )
+    arg_parser.add_argument(
+        '--skew', type=float, default=FRAME_SKEW,
+        help=('spread of the log normal distribution of frame sizes, 0 for '
+              'equal sized frames (default: %(default)s)')
+    )
+    arg_parser.add_argument(
+        '--link-ratio', type=float, default=LINK_RATIO,
+        help='fraction of files which are links (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--missing-ratio', type=float, default=MISSING_RATIO,
+        help='fraction of files which are missing (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--epoch-interval', type=int, default=EPOCH_INTERVAL,
+        help='number of days between epochs (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--epoch-files', nargs='+', default=get_metadata.EPOCH_FILE_MATCH,
+        help='epoch file patterns (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--ifg-files', nargs='+', default=get_metadata.IFG_FILE_MATCH,
+        help='interferogram file patterns (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--metadata-files', nargs='+',
+        default=get_metadata.METADATA_FILE_MATCH,
+        help='metadata file patterns (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--seed', type=int, default=SEED,
+        help='random seed (default: %(default)s)'
+    )
+    # Return the parsed arguments:
+    return arg_parser.parse_args()
+
+def main():
+    """
+    Main program function
+    """
+    # Get command line arguments:
+    args = parse_args()
+    # Check the output directory does not exist:
+    if os.path.exists(args.out_path):
+        err_msg = 'output path already exists: {0}\n'.format(args.out_path)
+        sys.stderr.write(err_msg)
+        sys.exit(1)
+    # Create the tree:
+    frame_ids = make_tree(vars(args))
+    # Display a message:
+    out_msg = 'created {0} frames in {1}\n'
+    sys.stdout.write(out_msg.format(len(frame_ids), args.out_path))
+
+if __name__ == '__main__':
+    # Try to catch KeyboardInterrupt:
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.stdout.write('\n')
+        sys.exit()
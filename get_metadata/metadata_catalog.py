@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+"""
+SQLite catalog of LiCSAR frames, epochs, interferograms and files
+"""
+
+# ---
+
+# std lib imports:
+import os
+import sqlite3
+
+# ---
+
+# Catalog schema. Epochs and interferograms belong to frames, and files
+# belong to a frame and, for epoch and interferogram files, to an epoch or
+# interferogram. Files store the dates of their epoch or interferogram, so
+# date range queries do not require a join:
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    id TEXT PRIMARY KEY,
+    track INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    first_date INTEGER,
+    last_date INTEGER
+);
+CREATE TABLE IF NOT EXISTS epochs (
+    id INTEGER PRIMARY KEY,
+    frame_id TEXT NOT NULL,
+    date INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ifgs (
+    id INTEGER PRIMARY KEY,
+    frame_id TEXT NOT NULL,
+    start_date INTEGER NOT NULL,
+    end_date INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    frame_id TEXT NOT NULL,
+    product TEXT NOT NULL,
+    epoch_id INTEGER,
+    ifg_id INTEGER,
+    start_date INTEGER,
+    end_date INTEGER,
+    name TEXT NOT NULL,
+    pattern TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    link INTEGER NOT NULL,
+    mtime INTEGER
+);
+CREATE INDEX IF NOT EXISTS frames_track ON frames (track);
+CREATE INDEX IF NOT EXISTS epochs_frame ON epochs (frame_id, date);
+CREATE INDEX IF NOT EXISTS epochs_date ON epochs (date);
+CREATE INDEX IF NOT EXISTS ifgs_frame ON ifgs (frame_id, start_date, end_date);
+CREATE INDEX IF NOT EXISTS ifgs_dates ON ifgs (start_date, end_date);
+CREATE INDEX IF NOT EXISTS files_frame ON files (frame_id, product, pattern);
+CREATE INDEX IF NOT EXISTS files_product ON files (
+    product, pattern, start_date, end_date
+);
+CREATE INDEX IF NOT EXISTS files_epoch ON files (epoch_id);
+CREATE INDEX IF NOT EXISTS files_ifg ON files (ifg_id);
+"""
+
+# Number of frames added between commits:
+COMMIT_INTERVAL = 100
+
+# ---
+
+def get_mtimes(entry):
+    """
+    Return the list of file mtimes for metadata, epoch or interferogram
+    information, which is a list of None values if mtimes were not recorded
+    """
+    return entry.get('mtimes', [None] * len(entry.get('files', [])))
+
+class CatalogWriter(object):
+    """
+    Writer for the SQLite catalog. If rebuild is True, a new catalog is
+    written to a temporary file, which replaces any existing catalog when
+    the writer is closed. Else, the existing catalog is updated in place
+    """
+
+    def __init__(self, catalog_path, metadata_file_match, rebuild=True):
+        # Catalog path:
+        self.catalog_path = catalog_path
+        # Expected metadata file patterns:
+        self.metadata_file_match = metadata_file_match
+        # Make output directory if required:
+        catalog_dir = os.path.dirname(catalog_path)
+        if catalog_dir and not os.path.exists(catalog_dir):
+            os.makedirs(catalog_dir, exist_ok=True)
+        # Path to the database file which is written:
+        self.rebuild = rebuild
+        if rebuild:
+            self.db_path = '{0}.tmp'.format(catalog_path)
+            if os.path.exists(self.db_path):
+                os.remove(self.db_path)
+        else:
+            self.db_path = catalog_path
+        # Connect to the database and create tables:
+        self.db = sqlite3.connect(self.db_path)
+        if rebuild:
+            self.db.execute('PRAGMA journal_mode = OFF')
+            self.db.execute('PRAGMA synchronous = OFF')
+        self.db.executescript(CATALOG_SCHEMA)
+        # Add the mtime column to a catalog from before file mtimes were
+        # recorded:
+        file_columns = [
+            i[1] for i in self.db.execute('PRAGMA table_info(files)')
+        ]
+        if 'mtime' not in file_columns:
+            self.db.execute('ALTER TABLE files ADD COLUMN mtime INTEGER')
+        # Count of frames since last commit:
+        self.frame_count = 0
+
+    def remove_frame(self, frame_id):
+        """
+        Remove all information for a frame from the catalog
+        """
+        for table, column in [('files', 'frame_id'), ('epochs', 'frame_id'),
+                              ('ifgs', 'frame_id'), ('frames', 'id')]:
+            self.db.execute(
+                'DELETE FROM {0} WHERE {1} = ?'.format(table, column),
+                (frame_id,)
+            )
+
+    def add_frame(self, frame_metadata):
+        """
+        Add the information for a frame to the catalog, replacing any
+        existing information for the frame
+        """
+        # Frame id and information:
+        frame_id = frame_metadata['id']
+        epochs = frame_metadata['epochs']
+        ifgs = frame_metadata['ifgs']
+        metadata = frame_metadata['metadata']
+        # Remove any existing information if updating:
+        if not self.rebuild:
+            self.remove_frame(frame_id)
+        # Range of dates for this frame:
+        dates = ([i['date'] for i in epochs.values()] +
+                 [i['start'] for i in ifgs.values()] +
+                 [i['end'] for i in ifgs.values()])
+        # Add the frame:
+        self.db.execute(
+            'INSERT INTO frames VALUES (?, ?, ?, ?, ?)',
+            (frame_id, int(frame_id[:3]), frame_metadata['path'],
+             min(dates) if dates else None, max(dates) if dates else None)
+        )
+        # Init list of files:
+        files = []
+        # Add metadata files:
+        for file_name, file_size, file_link, file_mtime in zip(
+            metadata.get('files', []), metadata.get('sizes', []),
+            metadata.get('links', []), get_mtimes(metadata)
+        ):
+            file_pattern = next(
+                (i for i in self.metadata_file_match
+                 if file_name.endswith(i)), file_name
+            )
+            files.append((frame_id, 'metadata', None, None, None, None,
+                          file_name, file_pattern, file_size, file_link,
+                          file_mtime))
+        # Add epochs and epoch files:
+        for epoch_name, epoch in epochs.items():
+            epoch_id = self.db.execute(
+                'INSERT INTO epochs (frame_id, date) VALUES (?, ?)',
+                (frame_id, epoch['date'])
+            ).lastrowid
+            for file_pattern, file_size, file_link, file_mtime in zip(
+                epoch['files'], epoch['sizes'], epoch['links'],
+                get_mtimes(epoch)
+            ):
+                files.append((
+                    frame_id, 'epoch', epoch_id, None, epoch['date'],
+                    epoch['date'], '{0}.{1}'.format(epoch_name, file_pattern),
+                    file_pattern, file_size, file_link, file_mtime
+                ))
+        # Add interferograms and interferogram files:
+        for ifg_name, ifg in ifgs.items():
+            ifg_id = self.db.execute(
+                'INSERT INTO ifgs (frame_id, start_date, end_date) '
+                'VALUES (?, ?, ?)',
+                (frame_id, ifg['start'], ifg['end'])
+            ).lastrowid
+            for file_pattern, file_size, file_link, file_mtime in zip(
+                ifg['files'], ifg['sizes'], ifg['links'], get_mtimes(ifg)
+            ):
+                files.append((
+                    frame_id, 'ifg', None, ifg_id, ifg['start'], ifg['end'],
+                    '{0}.{1}'.format(ifg_name, file_pattern), file_pattern,
+                    file_size, file_link, file_mtime
+                ))
+        # Add the files:
+        self.db.executemany(
+            'INSERT INTO files (frame_id, product, epoch_id, ifg_id, '
+            'start_date, end_date, name, pattern, size, link, mtime) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            files
+        )
+        # Commit periodically:
+        self.frame_count += 1
+        if self.frame_count % COMMIT_INTERVAL == 0:
+            self.db.commit()
+
+    def close(self):
+        """
+        Commit and close the catalog. If rebuilding, the new catalog then
+        replaces any existing catalog
+        """
+        self.db.commit()
+        self.db.close()
+        if self.rebuild:
+            os.replace(self.db_path, self.catalog_path)
+
+def query_files(catalog_path, frame_ids=None, tracks=None, start_date=None,
+                end_date=None, products=None, patterns=None):
+    """
+    Query the catalog for files. Epoch files are returned if the epoch date
+    is within the start and end dates, and interferogram files if both
+    interferogram dates are within the start and end dates. Metadata files
+    are returned regardless of dates. Returns a list of dicts, each with
+    the frame id, path, product, name, pattern, size, link and mtime
+    information for a file. The mtime is None if it was not recorded
+    """
+    # Init query conditions and parameters:
+    conditions = []
+    params = []
+    # Function to add a condition for a list of values:
+    def add_in(column, values):
+        if values:
+            conditions.append('{0} IN ({1})'.format(
+                column, ', '.join(['?'] * len(values))
+            ))
+            params.extend(values)
+    add_in('files.frame_id', frame_ids)
+    add_in('frames.track', tracks)
+    add_in('files.product', products)
+    add_in('files.pattern', patterns)
+    # Date conditions:
+    if start_date is not None:
+        conditions.append(
+            "(files.product = 'metadata' OR files.start_date >= ?)"
+        )
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append(
+            "(files.product = 'metadata' OR files.end_date <= ?)"
+        )
+        params.append(end_date)
+    # Create the query:
+    query = (
+        'SELECT files.frame_id, frames.path, files.product, files.name, '
+        'files.pattern, files.start_date, files.end_date, files.size, '
+        'files.link, files.mtime '
+        'FROM files JOIN frames ON files.frame_id = frames.id'
+    )
+    if conditions:
+        query += ' WHERE {0}'.format(' AND '.join(conditions))
+    query += ' ORDER BY files.frame_id, files.product, files.name'
+    # Run the query:
+    db = sqlite3.connect(catalog_path)
+    try:
+        rows = db.execute(query, params).fetchall()
+    finally:
+        db.close()
+    # Return the results:
+    columns = ['frame_id', 'path', 'product', 'name', 'pattern',
+               'start_date', 'end_date', 'size', 'link', 'mtime']
+    return [dict(zip(columns, i)) for i in rows]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pre-compressed copies of LiCSAR metadata files, so the web host can serve
+compressed content without compressing on the fly
+"""
+
+# ---
+
+# std lib imports:
+import concurrent.futures
+import gzip
+import os
+# third party imports, brotli is optional:
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# ---
+
+# Suffix of metadata files which are compressed:
+COMPRESS_MATCH = '.json'
+
+# Compression levels. Files are compressed once and served many times, so
+# the highest levels are used:
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# Minimum number of files for which a pool of processes is used:
+POOL_MIN_FILES = 16
+
+# ---
+
+def get_encodings():
+    """
+    Return the list of available encodings, as compressed file suffixes
+    """
+    encodings = ['gz']
+    if brotli is not None:
+        encodings.append('br')
+    return encodings
+
+def get_compressed_paths(rel_path):
+    """
+    Return the paths of all possible compressed copies of a file
+    """
+    return ['{0}.{1}'.format(rel_path, i) for i in ['gz', 'br']]
+
+def write_file(file_path, file_data):
+    """
+    Write data to a file via a temporary file, which is renamed in to place
+    """
+    tmp_path = '{0}.tmp'.format(file_path)
+    with open(tmp_path, 'wb') as tmp_file:
+        tmp_file.write(file_data)
+    os.replace(tmp_path, file_path)
+
+def compress_file(options):
+    """
+    Write compressed copies of a file, with each available encoding.
+    Returns a dict of the size of the file and of each compressed copy
+    """
+    # Get options:
+    out_path = options['out_path']
+    rel_path = options['rel_path']
+    # Read the file:
+    file_path = os.sep.join([out_path, rel_path])
+    with open(file_path, 'rb') as in_file:
+        file_data = in_file.read()
+    # Init sizes:
+    sizes = {'size': len(file_data)}
+    # Write gzip copy. The mtime is fixed, so the content only changes if
+    # the file changes:
+    gz_data = gzip.compress(file_data, GZIP_LEVEL, mtime=0)
+    write_file('{0}.gz'.format(file_path), gz_data)
+    sizes['gz'] = len(gz_data)
+    # Write brotli copy if available, else remove any existing copy, which
+    # would be out of date:
+    br_path = '{0}.br'.format(file_path)
+    if brotli is not None:
+        br_data = brotli.compress(file_data, quality=BROTLI_QUALITY)
+        write_file(br_path, br_data)
+        sizes['br'] = len(br_data)
+    elif os.path.exists(br_path):
+        os.remove(br_path)
+    # Return the sizes:
+    return sizes
+
+def compress_files(out_path, rel_paths, pool_size=1):
+    """
+    Write compressed copies of files relative to the output path, using a
+    pool of processes if pool_size is greater than one. Returns a dict of
+    sizes for each file
+    """
+    # Options for each file:
+    tasks = [{'out_path': out_path, 'rel_path': i} for i in rel_paths]
+    # Compress the files, in parallel if requested:
+    if pool_size > 1 and len(tasks) >= POOL_MIN_FILES:
+        with concurrent.futures.ProcessPoolExecutor(pool_size) as pool:
+            sizes = list(pool.map(
+                compress_file, tasks,
+                chunksize=max(1, len(tasks) // (pool_size * 4))
+            ))
+    else:
+        sizes = [compress_file(i) for i in tasks]
+    # Return the sizes:
+    return dict(zip(rel_paths, sizes))
+
+def get_report(files_sizes):
+    """
+    Summarise the sizes of all compressed files. Files are grouped in to
+    the index files at the top level of the output path and the frame
+    files, and the report lists the total size and file count for each
+    group and encoding
+    """
+    # Init report:
+    report = {}
+    # Loop through files:
+    for rel_path in sorted(files_sizes):
+        # Group for this file:
+        if os.sep in rel_path:
+            group = 'frames'
+        else:
+            group = 'indexes'
+        # Add the sizes:
+        group_sizes = report.setdefault(group, {'files': 0, 'size': 0})
+        group_sizes['files'] += 1
+        for size_key, file_size in files_sizes[rel_path].items():
+            group_sizes[size_key] = group_sizes.get(size_key, 0) + file_size
+    # Add totals:
+    totals = {'files': 0, 'size': 0}
+    for group_sizes in list(report.values()):
+        for size_key, group_size in group_sizes.items():
+            totals[size_key] = totals.get(size_key, 0) + group_size
+    report['total'] = totals
+    # Add compression ratios:
+    for group_sizes in report.values():
+        for encoding in ['gz', 'br']:
+            if encoding in group_sizes and group_sizes['size'] > 0:
+                group_sizes['{0}_ratio'.format(encoding)] = round(
+                    group_sizes[encoding] / group_sizes['size'], 4
+                )
+    # Return the report:
+    return report
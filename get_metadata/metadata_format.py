@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+"""
+Encode and decode LiCSAR frame metadata formats
+"""
+
+# ---
+
+# std lib imports:
+import itertools
+import json
+import os
+
+# ---
+
+# Format version of the full format, which stores lists of file patterns,
+# sizes, links and mtimes for every epoch and interferogram. Files in this
+# format do not include a version number:
+FULL_VERSION = 1
+
+# Format version of the compact format, which stores a dictionary of file
+# patterns for each frame, a bitmask of the files present for each epoch and
+# interferogram, and dates, sizes and mtimes in columnar arrays. File mtimes
+# are stored as the difference from the previous mtime, as the files of an
+# epoch or interferogram are usually created together. Metadata from before
+# mtimes were recorded has no mtimes array:
+COMPACT_VERSION = 2
+
+# Format version of sharded frame headers. The epochs and interferograms
+# for a sharded frame are split by date in to shard files, which are stored
+# in the full or compact format, and the header lists the shards and the
+# range of dates in each:
+SHARDED_VERSION = 3
+
+# Available output formats:
+FORMATS = {
+    'full': FULL_VERSION,
+    'compact': COMPACT_VERSION
+}
+
+# Available shard periods, and the number of characters of a date used to
+# name the shard for each period:
+SHARD_PERIODS = {
+    'year': 4,
+    'month': 6
+}
+
+# ---
+
+def encode_entries(entries, date_keys):
+    """
+    Encode a dict of epoch or interferogram information in the compact
+    format. date_keys is the list of keys which hold the dates for each
+    entry
+    """
+    # Sorted entry names:
+    entry_names = sorted(entries)
+    # Get the file patterns which are present, in sorted order:
+    patterns = set()
+    for entry_name in entry_names:
+        patterns.update(entries[entry_name]['files'])
+    patterns = sorted(patterns)
+    # Bit value for each pattern:
+    pattern_bits = {j: 1 << i for i, j in enumerate(patterns)}
+    # Init encoded information:
+    encoded = {'patterns': patterns}
+    for date_key in date_keys:
+        encoded['{0}s'.format(date_key)] = []
+    encoded['files'] = []
+    encoded['links'] = []
+    encoded['sizes'] = []
+    # mtimes are only stored if known for all entries:
+    has_mtimes = all('mtimes' in entries[i] for i in entry_names)
+    if has_mtimes:
+        encoded['mtimes'] = []
+    prev_mtime = 0
+    # Loop through entries:
+    for entry_name in entry_names:
+        entry = entries[entry_name]
+        # Store the dates:
+        for date_key in date_keys:
+            encoded['{0}s'.format(date_key)].append(entry[date_key])
+        # Sort the files in to pattern order:
+        entry_mtimes = entry.get('mtimes', [None] * len(entry['files']))
+        entry_files = sorted(zip(entry['files'], entry['sizes'],
+                                 entry['links'], entry_mtimes))
+        # Get file and link bitmasks, and store the sizes and mtimes:
+        files_mask = 0
+        links_mask = 0
+        for file_pattern, file_size, file_link, file_mtime in entry_files:
+            files_mask |= pattern_bits[file_pattern]
+            if file_link:
+                links_mask |= pattern_bits[file_pattern]
+            encoded['sizes'].append(file_size)
+            if has_mtimes:
+                encoded['mtimes'].append(file_mtime - prev_mtime)
+                prev_mtime = file_mtime
+        encoded['files'].append(files_mask)
+        encoded['links'].append(links_mask)
+    # Return the encoded information:
+    return encoded
+
+def decode_entries(encoded, date_keys):
+    """
+    Decode compact epoch or interferogram information, returning a dict of
+    information for each entry in the full format
+    """
+    # Init decoded information:
+    entries = {}
+    # File patterns and bit values:
+    patterns = [(1 << i, j) for i, j in enumerate(encoded['patterns'])]
+    # Date columns:
+    dates = [encoded['{0}s'.format(i)] for i in date_keys]
+    # File mtimes, if recorded:
+    mtimes = None
+    if 'mtimes' in encoded:
+        mtimes = list(itertools.accumulate(encoded['mtimes']))
+    # Index of the next size value:
+    size_index = 0
+    # Loop through entries:
+    for i, files_mask in enumerate(encoded['files']):
+        # Links mask for this entry:
+        links_mask = encoded['links'][i]
+        # Init entry, with dates:
+        entry = {}
+        for date_key, date_values in zip(date_keys, dates):
+            entry[date_key] = date_values[i]
+        entry['files'] = []
+        entry['sizes'] = []
+        entry['links'] = []
+        if mtimes is not None:
+            entry['mtimes'] = []
+        # Loop through patterns, and store information for those present:
+        for pattern_bit, file_pattern in patterns:
+            if files_mask & pattern_bit:
+                entry['files'].append(file_pattern)
+                entry['sizes'].append(encoded['sizes'][size_index])
+                entry['links'].append(1 if links_mask & pattern_bit else 0)
+                if mtimes is not None:
+                    entry['mtimes'].append(mtimes[size_index])
+                size_index += 1
+        # Entry name is the dates joined with underscores:
+        entry_name = '_'.join([str(entry[j]) for j in date_keys])
+        entries[entry_name] = entry
+    # Return the decoded information:
+    return entries
+
+def encode_frame(frame_metadata, out_format='full'):
+    """
+    Encode frame metadata in the requested format
+    """
+    # Full format is the metadata as is:
+    if FORMATS[out_format] == FULL_VERSION:
+        return frame_metadata
+    # Return the compact format:
+    return {
+        'version': COMPACT_VERSION,
+        'id': frame_metadata['id'],
+        'path': frame_metadata['path'],
+        'metadata': frame_metadata['metadata'],
+        'epochs': encode_entries(frame_metadata['epochs'], ['date']),
+        'ifgs': encode_entries(frame_metadata['ifgs'], ['start', 'end'])
+    }
+
+def encode_shards(frame_metadata, out_format='full', shard_period='year'):
+    """
+    Encode frame metadata as a sharded frame, in the requested format and
+    split by the requested period. Epochs are stored in the shard for their
+    date, and interferograms in the shard for their start date. Returns the
+    header for the frame and a dict of data for each shard, keyed by shard
+    file name relative to the track directory
+    """
+    # Frame id:
+    frame_id = frame_metadata['id']
+    # Number of characters of date string used for shard names:
+    name_length = SHARD_PERIODS[shard_period]
+    # Init information for each shard:
+    shards = {}
+    # Function to get the information for a shard:
+    def get_shard(shard_date):
+        shard_name = str(shard_date)[:name_length]
+        if shard_name not in shards:
+            shards[shard_name] = {
+                'id': frame_id,
+                'path': frame_metadata['path'],
+                'epochs': {},
+                'metadata': {},
+                'ifgs': {}
+            }
+        return shards[shard_name]
+    # Add epochs and interferograms to shards:
+    for epoch_name, epoch in frame_metadata['epochs'].items():
+        get_shard(epoch['date'])['epochs'][epoch_name] = epoch
+    for ifg_name, ifg in frame_metadata['ifgs'].items():
+        get_shard(ifg['start'])['ifgs'][ifg_name] = ifg
+    # Init header information:
+    header = {
+        'version': SHARDED_VERSION,
+        'id': frame_id,
+        'path': frame_metadata['path'],
+        'metadata': frame_metadata['metadata'],
+        'shards': []
+    }
+    # Init shard data:
+    shards_data = {}
+    # Loop through shards:
+    for shard_name in sorted(shards):
+        shard = shards[shard_name]
+        # Range of dates in this shard:
+        dates = ([i['date'] for i in shard['epochs'].values()] +
+                 [i['start'] for i in shard['ifgs'].values()] +
+                 [i['end'] for i in shard['ifgs'].values()])
+        # Shard file name, relative to the track directory:
+        shard_file = get_shard_file(frame_id, shard_name)
+        # Add shard information to the header:
+        header['shards'].append({
+            'name': shard_name,
+            'file': shard_file,
+            'start': min(dates),
+            'end': max(dates),
+            'epochs': len(shard['epochs']),
+            'ifgs': len(shard['ifgs'])
+        })
+        # Encode the shard data, without frame information:
+        shard_data = encode_frame(shard, out_format)
+        for frame_key in ['id', 'path', 'metadata']:
+            del shard_data[frame_key]
+        shards_data[shard_file] = shard_data
+    # Return the header and shards:
+    return header, shards_data
+
+def decode_frame(frame_data):
+    """
+    Decode frame metadata from any format, returning the full format
+    """
+    # Version of the data:
+    version = frame_data.get('version', FULL_VERSION)
+    # Full format is returned as is:
+    if version == FULL_VERSION:
+        return frame_data
+    # Decode the compact format:
+    if version == COMPACT_VERSION:
+        return {
+            'id': frame_data.get('id'),
+            'path': frame_data.get('path'),
+            'epochs': decode_entries(frame_data['epochs'], ['date']),
+            'metadata': frame_data.get('metadata', {}),
+            'ifgs': decode_entries(frame_data['ifgs'], ['start', 'end'])
+        }
+    # Unknown version:
+    err_msg = 'unknown metadata format version: {0}'.format(version)
+    raise ValueError(err_msg)
+
+def get_frame_file(frame_id):
+    """
+    Return the path to the metadata file for a frame, relative to the
+    metadata path
+    """
+    return os.sep.join([frame_id.split('_')[0], '{0}.json'.format(frame_id)])
+
+def get_shard_file(frame_id, shard_name):
+    """
+    Return the path to a shard file for a frame, relative to the track
+    directory
+    """
+    return os.sep.join([frame_id, '{0}.json'.format(shard_name)])
+
+def load_json(json_path):
+    """
+    Load JSON data from a file
+    """
+    with open(json_path, 'r') as json_file:
+        return json.load(json_file)
+
+def read_frame_compact(metadata_path, frame_id, start_date=None,
+                       end_date=None):
+    """
+    Read the metadata for a frame from the metadata path, in any format,
+    returning the compact format. Frames which are stored in the compact
+    format are returned without being decoded. start_date and end_date are
+    used as for read_frame
+    """
+    # Load the frame data:
+    frame_data = load_json(
+        os.sep.join([metadata_path, get_frame_file(frame_id)])
+    )
+    # If the data is already compact, return it:
+    if frame_data.get('version') == COMPACT_VERSION:
+        return frame_data
+    # If not sharded, encode the data as compact:
+    if frame_data.get('version') != SHARDED_VERSION:
+        return encode_frame(frame_data, 'compact')
+    # Else, read the required shards and encode as compact:
+    return encode_frame(
+        read_frame(metadata_path, frame_id, start_date, end_date), 'compact'
+    )
+
+def read_frame(metadata_path, frame_id, start_date=None, end_date=None):
+    """
+    Read the metadata for a frame from the metadata path, in any format,
+    returning the full format. For sharded frames, if start_date and / or
+    end_date are specified, only the shards which overlap the date range
+    are read, so epochs and interferograms outside of the range may not be
+    included
+    """
+    # Load the frame data:
+    frame_file = get_frame_file(frame_id)
+    frame_data = load_json(os.sep.join([metadata_path, frame_file]))
+    # If the frame is not sharded, return the decoded data:
+    if frame_data.get('version') != SHARDED_VERSION:
+        return decode_frame(frame_data)
+    # Init frame information:
+    frame_metadata = {
+        'id': frame_data['id'],
+        'path': frame_data['path'],
+        'epochs': {},
+        'metadata': frame_data['metadata'],
+        'ifgs': {}
+    }
+    # Track directory which contains the shard files:
+    track_path = os.sep.join([metadata_path, os.path.dirname(frame_file)])
+    # Loop through shards:
+    for shard in frame_data['shards']:
+        # Skip shards which do not overlap the date range:
+        if start_date is not None and shard['end'] < start_date:
+            continue
+        if end_date is not None and shard['start'] > end_date:
+            continue
+        # Load and decode the shard data:
+        shard_data = decode_frame(
+            load_json(os.sep.join([track_path, shard['file']]))
+        )
+        # Add the information to the frame:
+        frame_metadata['epochs'].update(shard_data['epochs'])
+        frame_metadata['ifgs'].update(shard_data['ifgs'])
+    # Return the frame information:
+    return frame_metadata
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compact manifest of files to download, as read by the python download
+script. The manifest is a text file with one tab separated record per line.
+The first line is a header with the format version, file count and total
+size. Base urls are listed once, and each directory record sets the base
+url, the remaining url directory and the output path for the files which
+follow it. Directory and file names are stored as the number of leading
+characters shared with the previous value and the remaining characters,
+and mtimes as the difference from the previous mtime, so the manifest is
+small, compresses well, and can be read one line at a time
+"""
+
+# ---
+
+# std lib imports:
+import base64
+import tempfile
+from urllib.parse import urlsplit
+import zlib
+
+# ---
+
+# Manifest header name and format version:
+MANIFEST_NAME = 'LICSAR_MANIFEST'
+MANIFEST_VERSION = 1
+
+# Record types, for base urls, directories and files:
+RECORD_BASE = 'U'
+RECORD_DIR = 'D'
+RECORD_FILE = 'F'
+
+# Prefix of the line which starts a manifest embedded at the end of a
+# download script, followed by the encoding. Each following line is a
+# comment containing a line of the manifest, or of the base64 encoded zlib
+# compressed manifest:
+EMBED_MARKER = '#{0}'.format(MANIFEST_NAME)
+EMBED_ENCODINGS = ['zlib', 'text']
+
+# Number of compressed bytes per embedded line, which base64 encode to 76
+# characters:
+EMBED_LINE_BYTES = 57
+
+# zlib compression level for embedded manifests:
+ZLIB_LEVEL = 9
+
+# ---
+
+def get_shared(prev_value, value):
+    """
+    Return the number of leading characters which a value shares with the
+    previous value
+    """
+    shared = 0
+    for prev_char, value_char in zip(prev_value, value):
+        if prev_char != value_char:
+            break
+        shared += 1
+    return shared
+
+class ManifestEncoder(object):
+    """
+    Encode file information as manifest records, and count the files and
+    total size. File information is a dict of name, path, url, size and
+    optionally mtime, as returned by search_metadata.search_frame
+    """
+
+    def __init__(self, base_urls=None):
+        # Base urls, in order of index:
+        self.base_urls = []
+        # Known base urls, longest first, which are listed once used:
+        self.known_urls = sorted(
+            [i.rstrip('/') + '/' for i in base_urls or []], key=len,
+            reverse=True
+        )
+        # Previous directory, file name and mtime:
+        self.prev_dir = None
+        self.prev_url_dir = ''
+        self.prev_path = ''
+        self.prev_name = ''
+        self.prev_mtime = 0
+        # File count and total size:
+        self.file_count = 0
+        self.total_size = 0
+
+    def get_base(self, url_dir):
+        """
+        Return the record for a new base url, or None, and the index of
+        the base url for a url directory. The longest known base url which
+        the directory starts with is used, else the scheme and host
+        """
+        base_url = None
+        for known_url in self.known_urls:
+            if url_dir.startswith(known_url):
+                base_url = known_url
+                break
+        if base_url is None:
+            url_parts = urlsplit(url_dir)
+            base_url = '{0}://{1}/'.format(url_parts.scheme, url_parts.netloc)
+        if base_url in self.base_urls:
+            return None, self.base_urls.index(base_url)
+        self.base_urls.append(base_url)
+        return [RECORD_BASE, base_url], len(self.base_urls) - 1
+
+    def encode(self, file_info):
+        """
+        Return the list of manifest records for a file, each a list of
+        values
+        """
+        # Init records:
+        records = []
+        # The file name is the end of the url:
+        file_name = file_info['name']
+        file_url = file_info['url']
+        if not file_url.endswith('/{0}'.format(file_name)):
+            err_msg = 'url {0} does not end with file name {1}'.format(
+                file_url, file_name
+            )
+            raise ValueError(err_msg)
+        url_dir = file_url[:-len(file_name)]
+        file_path = file_info['path']
+        # Add base url and directory records if the directory has changed:
+        if (url_dir, file_path) != self.prev_dir:
+            base_record, base_index = self.get_base(url_dir)
+            if base_record:
+                records.append(base_record)
+            url_dir_rel = url_dir[len(self.base_urls[base_index]):]
+            url_shared = get_shared(self.prev_url_dir, url_dir_rel)
+            path_shared = get_shared(self.prev_path, file_path)
+            records.append([
+                RECORD_DIR, base_index, url_shared, url_dir_rel[url_shared:],
+                path_shared, file_path[path_shared:]
+            ])
+            self.prev_dir = (url_dir, file_path)
+            self.prev_url_dir = url_dir_rel
+            self.prev_path = file_path
+        # Add file record. An mtime which is not known is left empty:
+        name_shared = get_shared(self.prev_name, file_name)
+        file_mtime = file_info.get('mtime')
+        if file_mtime is None:
+            mtime_delta = ''
+        else:
+            mtime_delta = file_mtime - self.prev_mtime
+            self.prev_mtime = file_mtime
+        records.append([
+            RECORD_FILE, name_shared, file_name[name_shared:],
+            file_info['size'], mtime_delta
+        ])
+        self.prev_name = file_name
+        # Update count and size:
+        self.file_count += 1
+        self.total_size += file_info['size']
+        # Return the records:
+        return records
+
+def format_record(record):
+    """
+    Format a manifest record as a line of text
+    """
+    return '{0}\n'.format('\t'.join(str(i) for i in record))
+
+def get_header(file_count, total_size):
+    """
+    Return the manifest header line
+    """
+    return format_record([
+        MANIFEST_NAME, MANIFEST_VERSION, file_count, total_size
+    ])
+
+def encode_manifest(files, encoder):
+    """
+    Generator which yields the lines of the manifest for a list of files,
+    using a ManifestEncoder. The header needs the file count and total
+    size, so the records are written to a temporary file as the files are
+    read, and memory use does not grow with the number of files
+    """
+    # Write the records to a temporary file:
+    with tempfile.TemporaryFile('w+') as records_file:
+        for file_info in files:
+            for record in encoder.encode(file_info):
+                records_file.write(format_record(record))
+        # Yield the header, then the records:
+        yield get_header(encoder.file_count, encoder.total_size)
+        records_file.seek(0)
+        for record_line in records_file:
+            yield record_line
+
+def write_manifest(files, out_file, base_urls=None):
+    """
+    Write the manifest for a list of files to an open text file. Returns
+    the number of files and the total size
+    """
+    encoder = ManifestEncoder(base_urls)
+    for manifest_line in encode_manifest(files, encoder):
+        out_file.write(manifest_line)
+    return encoder.file_count, encoder.total_size
+
+def write_encoded(compressed, out_file, flush=False):
+    """
+    Write compressed data as base64 encoded comment lines to an open text
+    file. Returns any data which does not fill a line, unless flushing
+    """
+    line_end = len(compressed)
+    if not flush:
+        line_end -= line_end % EMBED_LINE_BYTES
+    for i in range(0, line_end, EMBED_LINE_BYTES):
+        out_file.write('#{0}\n'.format(base64.b64encode(
+            compressed[i:i + EMBED_LINE_BYTES]
+        ).decode('ascii')))
+    return compressed[line_end:]
+
+def embed_manifest(files, out_file, base_urls=None, encoding='zlib'):
+    """
+    Write the manifest for a list of files to an open text file, as the
+    lines to embed at the end of a download script, with the requested
+    encoding. Returns the number of files and the total size
+    """
+    # Init encoder:
+    encoder = ManifestEncoder(base_urls)
+    # Marker line:
+    out_file.write('{0} {1}\n'.format(EMBED_MARKER, encoding))
+    # Uncompressed lines are written as they are:
+    if encoding == 'text':
+        for manifest_line in encode_manifest(files, encoder):
+            out_file.write('#{0}'.format(manifest_line))
+        return encoder.file_count, encoder.total_size
+    # Else compress, writing whole lines of compressed data as they are
+    # available:
+    compressor = zlib.compressobj(ZLIB_LEVEL)
+    compressed = b''
+    for manifest_line in encode_manifest(files, encoder):
+        compressed += compressor.compress(manifest_line.encode('utf-8'))
+        compressed = write_encoded(compressed, out_file)
+    compressed += compressor.flush()
+    write_encoded(compressed, out_file, True)
+    # Return the count and size:
+    return encoder.file_count, encoder.total_size
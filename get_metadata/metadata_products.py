@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+Schema of the LiCSAR product files which are recorded by the metadata
+crawler and offered by the search site, and the classifiers which are
+compiled from it
+"""
+
+# ---
+
+# std lib imports:
+import hashlib
+import json
+import os
+import re
+
+# ---
+
+# Path to the product schema, relative to this module:
+PRODUCTS_FILE = 'products.json'
+
+# Types of product files in the schema. Metadata files are matched by the
+# end of the file name, and epoch and interferogram files by the name of
+# their directory and the file pattern joined with a dot:
+PRODUCT_TYPES = ['metadata_files', 'epoch_files', 'ifg_files']
+
+# ---
+
+def load_products(products_path=None):
+    """
+    Load and check the product schema. The schema contains a list of files
+    for each product type, each with a file pattern, and optionally a
+    label for the search site, and whether the file is selected by
+    default. Returns the schema with all values filled in
+    """
+    # Default path to schema:
+    if products_path is None:
+        products_path = os.sep.join([
+            os.path.dirname(os.path.abspath(__file__)), PRODUCTS_FILE
+        ])
+    # Load the schema:
+    with open(products_path, 'r') as products_file:
+        products_data = json.load(products_file)
+    # Init checked schema:
+    products = {}
+    # Loop through product types:
+    for product_type in PRODUCT_TYPES:
+        # Check the files for this type:
+        products[product_type] = []
+        file_patterns = set()
+        for product_file in products_data.get(product_type, []):
+            file_pattern = product_file.get('pattern')
+            if not file_pattern or file_pattern in file_patterns:
+                err_msg = 'missing or duplicate {0} pattern in {1}'.format(
+                    product_type, products_path
+                )
+                raise ValueError(err_msg)
+            file_patterns.add(file_pattern)
+            products[product_type].append({
+                'pattern': file_pattern,
+                'label': product_file.get('label', file_pattern),
+                'selected': bool(product_file.get('selected', False))
+            })
+    # Return the schema:
+    return products
+
+def get_patterns(products, product_type, selected=False):
+    """
+    Get the list of file patterns for a product type, optionally only those
+    which are selected by default
+    """
+    return [i['pattern'] for i in products[product_type]
+            if i['selected'] or not selected]
+
+def compile_suffix_match(file_match):
+    """
+    Compile a list of file patterns in to a single regular expression
+    which matches the end of a file name. Longer patterns are tried first,
+    so the match is the longest pattern which the name ends with
+    """
+    # With no patterns, nothing matches:
+    if not file_match:
+        return re.compile('(?!)')
+    return re.compile('(?:{0})$'.format('|'.join(
+        re.escape(i) for i in sorted(file_match, key=len, reverse=True)
+    )))
+
+def get_fingerprint(products, product_types=PRODUCT_TYPES):
+    """
+    Return a fingerprint of the file patterns for the listed product types,
+    which changes if any pattern is added or removed, so information which
+    was recorded with a different schema can be detected
+    """
+    patterns = {i: sorted(get_patterns(products, i)) for i in product_types}
+    return hashlib.sha1(
+        json.dumps(patterns, sort_keys=True).encode('utf-8')
+    ).hexdigest()
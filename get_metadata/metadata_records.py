@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compact in-memory records of LiCSAR epoch and interferogram information,
+used while frames are being crawled
+"""
+
+# ---
+
+# std lib imports:
+import array
+
+# ---
+
+# Value stored for a directory mtime which is not known:
+NO_MTIME = -1
+
+# ---
+
+class DirRecords(object):
+    """
+    Compact columnar records of the information for a set of epoch or
+    interferogram directories. The dates, mtime, file and link bitmasks for
+    each directory are stored in arrays, and the sizes and mtimes of the
+    files present in flat arrays, in the order of the bits, so the records use
+    far less memory than a dict of lists for each directory, and are cheap
+    to pickle when passed between processes. Bit i of the bitmasks is for
+    the i'th file pattern in sorted order, which is also the order of the
+    file names in a directory. Directories which contain no files at all
+    are recorded, so they are not rescanned by incremental crawls, but are
+    not included in the frame metadata. Files which do not match one of the
+    file patterns are ignored
+    """
+
+    __slots__ = ['date_keys', 'patterns', 'pattern_bits', 'dates', 'mtimes',
+                 'found', 'files', 'links', 'sizes', 'file_mtimes']
+
+    def __init__(self, date_keys, file_match):
+        # Keys of the dates for each directory, e.g. date, or start and end:
+        self.date_keys = list(date_keys)
+        # File patterns, in bit order:
+        self.patterns = sorted(file_match)
+        self.pattern_bits = {j: 1 << i for i, j in enumerate(self.patterns)}
+        # Date columns:
+        self.dates = [array.array('l') for i in self.date_keys]
+        # Directory mtimes:
+        self.mtimes = array.array('q')
+        # Whether each directory contains any files:
+        self.found = array.array('B')
+        # File and link bitmasks:
+        self.files = array.array('Q')
+        self.links = array.array('Q')
+        # File sizes and mtimes:
+        self.sizes = array.array('q')
+        self.file_mtimes = array.array('q')
+
+    def __len__(self):
+        return len(self.mtimes)
+
+    def append(self, dir_name, dir_mtime, dir_info):
+        """
+        Add the information for a directory. dir_info is a dict of dates,
+        files, sizes, links and mtimes, as stored in the full metadata
+        format, or None if the directory contains no files
+        """
+        # Store the dates, from the directory name:
+        for date_values, dir_date in zip(self.dates, dir_name.split('_')):
+            date_values.append(int(dir_date))
+        # Store the mtime:
+        self.mtimes.append(NO_MTIME if dir_mtime is None else dir_mtime)
+        # If the directory contains no files:
+        if dir_info is None:
+            self.found.append(0)
+            self.files.append(0)
+            self.links.append(0)
+            return
+        # Get file and link bitmasks, and file sizes and mtimes in bit order.
+        # mtimes which are not known are stored as NO_MTIME:
+        files_mask = 0
+        links_mask = 0
+        file_values = {}
+        file_mtimes = dir_info.get(
+            'mtimes', [NO_MTIME] * len(dir_info['files'])
+        )
+        for file_pattern, file_size, file_link, file_mtime in zip(
+            dir_info['files'], dir_info['sizes'], dir_info['links'],
+            file_mtimes
+        ):
+            pattern_bit = self.pattern_bits.get(file_pattern)
+            if pattern_bit is None:
+                continue
+            files_mask |= pattern_bit
+            if file_link:
+                links_mask |= pattern_bit
+            file_values[pattern_bit] = (file_size, file_mtime)
+        # Store the information:
+        self.found.append(1)
+        self.files.append(files_mask)
+        self.links.append(links_mask)
+        for pattern_bit in sorted(file_values):
+            self.sizes.append(file_values[pattern_bit][0])
+            self.file_mtimes.append(file_values[pattern_bit][1])
+
+    def extend(self, dir_records):
+        """
+        Add all of the directories from another set of records, for the same
+        type of directory
+        """
+        for date_values, other_values in zip(self.dates, dir_records.dates):
+            date_values.extend(other_values)
+        self.mtimes.extend(dir_records.mtimes)
+        self.found.extend(dir_records.found)
+        self.files.extend(dir_records.files)
+        self.links.extend(dir_records.links)
+        self.sizes.extend(dir_records.sizes)
+        self.file_mtimes.extend(dir_records.file_mtimes)
+
+    def items(self):
+        """
+        Generator which yields the name, mtime and information for each
+        directory, in the order they were added. The information is a dict
+        in the full metadata format, or None if the directory contains no
+        files
+        """
+        # The same few combinations of files and links occur in most
+        # directories, so the lists of patterns and link flags are stored
+        # for each bitmask as they are decoded:
+        mask_patterns = {}
+        mask_links = {}
+        # Index of the next size value:
+        size_index = 0
+        # Loop through directories:
+        for i, dir_mtime in enumerate(self.mtimes):
+            # Directory dates and name:
+            dir_dates = [j[i] for j in self.dates]
+            dir_name = '_'.join(map(str, dir_dates))
+            # mtime, if known:
+            if dir_mtime == NO_MTIME:
+                dir_mtime = None
+            # If the directory contains no files:
+            if not self.found[i]:
+                yield dir_name, dir_mtime, None
+                continue
+            # Patterns of the files present:
+            files_mask = self.files[i]
+            if files_mask not in mask_patterns:
+                mask_patterns[files_mask] = [
+                    j for j in self.patterns
+                    if files_mask & self.pattern_bits[j]
+                ]
+            file_patterns = mask_patterns[files_mask]
+            # Link flags for the files present:
+            links_key = (files_mask, self.links[i])
+            if links_key not in mask_links:
+                mask_links[links_key] = [
+                    1 if links_key[1] & self.pattern_bits[j] else 0
+                    for j in file_patterns
+                ]
+            # Store the information, with dates:
+            file_count = len(file_patterns)
+            dir_info = dict(zip(self.date_keys, dir_dates))
+            dir_info['files'] = list(file_patterns)
+            dir_info['sizes'] = self.sizes[
+                size_index:size_index + file_count
+            ].tolist()
+            dir_info['links'] = list(mask_links[links_key])
+            dir_info['mtimes'] = self.file_mtimes[
+                size_index:size_index + file_count
+            ].tolist()
+            size_index += file_count
+            yield dir_name, dir_mtime, dir_info
+
+    def get_cache(self):
+        """
+        Return the information in the crawl cache format, a dict of
+        [mtime, information] values, keyed by directory name
+        """
+        dirs_cache = {i: [j, k] for i, j, k in self.items()}
+        return {i: dirs_cache[i] for i in sorted(dirs_cache)}
+
+def from_cache(date_keys, file_match, dirs_cache):
+    """
+    Create records from information in the crawl cache format, a dict of
+    [mtime, information] values keyed by directory name
+    """
+    dir_records = DirRecords(date_keys, file_match)
+    for dir_name in sorted(dirs_cache):
+        dir_records.append(dir_name, *dirs_cache[dir_name])
+    return dir_records
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+"""
+Geographic footprints of LiCSAR frames, and a grid index of frames for
+point and bounding box queries
+"""
+
+# ---
+
+# std lib imports:
+import math
+import os
+import struct
+
+# ---
+
+# Format version of the spatial index:
+SPATIAL_VERSION = 1
+
+# Size of spatial index grid cells, in degrees:
+CELL_SIZE = 1
+
+# Suffix of the metadata file which is read for frame bounds:
+BOUNDS_FILE_MATCH = 'geo.hgt.tif'
+
+# Name of the metadata file which is read for frame centers:
+CENTER_FILE_NAME = 'metadata.txt'
+
+# TIFF tags which are used to get GeoTIFF bounds:
+TIFF_IMAGE_WIDTH = 256
+TIFF_IMAGE_LENGTH = 257
+TIFF_MODEL_PIXEL_SCALE = 33550
+TIFF_MODEL_TIEPOINT = 33922
+
+# struct formats and sizes for TIFF field types which may be used by the
+# required tags:
+TIFF_TYPES = {
+    1: ('B', 1),
+    3: ('H', 2),
+    4: ('I', 4),
+    11: ('f', 4),
+    12: ('d', 8),
+    16: ('Q', 8)
+}
+
+# ---
+
+def read_metadata_txt(metadata_txt_path):
+    """
+    Read key=value information from a frame metadata.txt file
+    """
+    # Init dict for information:
+    metadata_txt = {}
+    # Read the file:
+    with open(metadata_txt_path, 'r') as metadata_txt_file:
+        for metadata_line in metadata_txt_file:
+            # Skip lines without values:
+            if '=' not in metadata_line:
+                continue
+            # Store the value:
+            key, value = metadata_line.split('=', 1)
+            metadata_txt[key.strip()] = value.strip()
+    # Return the information:
+    return metadata_txt
+
+def read_tiff_tags(tiff_path, tags):
+    """
+    Read the values of the requested tags from the first image file
+    directory of a TIFF or BigTIFF file. Returns a dict of tuples of values
+    for each tag which is found
+    """
+    # Init dict for tag values:
+    tag_values = {}
+    with open(tiff_path, 'rb') as tiff_file:
+        # Read the header and check the byte order:
+        header = tiff_file.read(16)
+        if header[:2] == b'II':
+            byte_order = '<'
+        elif header[:2] == b'MM':
+            byte_order = '>'
+        else:
+            err_msg = 'not a TIFF file: {0}'.format(tiff_path)
+            raise ValueError(err_msg)
+        # Check the version for TIFF or BigTIFF, and get the offset to the
+        # first image file directory and the layout of entries:
+        version = struct.unpack(byte_order + 'H', header[2:4])[0]
+        if version == 42:
+            ifd_offset = struct.unpack(byte_order + 'I', header[4:8])[0]
+            count_format, entry_format, value_size = 'H', 'HHI', 4
+        elif version == 43:
+            ifd_offset = struct.unpack(byte_order + 'Q', header[8:16])[0]
+            count_format, entry_format, value_size = 'Q', 'HHQ', 8
+        else:
+            err_msg = 'not a TIFF file: {0}'.format(tiff_path)
+            raise ValueError(err_msg)
+        offset_format = 'I' if value_size == 4 else 'Q'
+        entry_size = struct.calcsize('=' + entry_format) + value_size
+        # Read the image file directory entries:
+        tiff_file.seek(ifd_offset)
+        count_size = struct.calcsize('=' + count_format)
+        entry_count = struct.unpack(byte_order + count_format,
+                                    tiff_file.read(count_size))[0]
+        entries = tiff_file.read(entry_count * entry_size)
+        # Loop through entries:
+        for i in range(0, len(entries), entry_size):
+            entry = entries[i:i + entry_size]
+            tag, field_type, value_count = struct.unpack(
+                byte_order + entry_format, entry[:entry_size - value_size]
+            )
+            # Skip tags which are not required, or have unsupported types:
+            if tag not in tags or field_type not in TIFF_TYPES:
+                continue
+            # Values are stored in the entry if they fit, else at an
+            # offset:
+            type_format, type_size = TIFF_TYPES[field_type]
+            values_size = value_count * type_size
+            if values_size <= value_size:
+                values_data = entry[entry_size - value_size:]
+            else:
+                values_offset = struct.unpack(
+                    byte_order + offset_format, entry[entry_size - value_size:]
+                )[0]
+                tiff_file.seek(values_offset)
+                values_data = tiff_file.read(values_size)
+            # Store the values:
+            tag_values[tag] = struct.unpack(
+                byte_order + type_format * value_count,
+                values_data[:values_size]
+            )
+    # Return the tag values:
+    return tag_values
+
+def read_geotiff_bounds(tiff_path):
+    """
+    Get the bounds of a north up GeoTIFF file. Returns a list of west,
+    south, east and north coordinates
+    """
+    # Read the required tags:
+    tag_values = read_tiff_tags(tiff_path, [
+        TIFF_IMAGE_WIDTH, TIFF_IMAGE_LENGTH, TIFF_MODEL_PIXEL_SCALE,
+        TIFF_MODEL_TIEPOINT
+    ])
+    width = tag_values[TIFF_IMAGE_WIDTH][0]
+    length = tag_values[TIFF_IMAGE_LENGTH][0]
+    scale_x, scale_y = tag_values[TIFF_MODEL_PIXEL_SCALE][:2]
+    tie_i, tie_j, _, tie_x, tie_y = tag_values[TIFF_MODEL_TIEPOINT][:5]
+    # Coordinates of the top left corner:
+    west = tie_x - tie_i * scale_x
+    north = tie_y + tie_j * scale_y
+    # Return the bounds:
+    return [west, north - length * scale_y, west + width * scale_x, north]
+
+def normalise_lon(lon):
+    """
+    Normalise a longitude to the range -180 to 180
+    """
+    if -180 <= lon <= 180:
+        return lon
+    return ((lon + 180) % 360) - 180
+
+def get_frame_geo(metadata_path, metadata_files):
+    """
+    Get the geographic information for a frame from its metadata files.
+    The center is read from metadata.txt, and the bounds from the geo.hgt.tif
+    GeoTIFF header. Returns a dict which may contain a center, as longitude
+    and latitude, and a bbox, as west, south, east and north coordinates,
+    rounded to 3 decimal places. A bbox which crosses the antimeridian has
+    a west coordinate greater than the east coordinate
+    """
+    # Init geographic information:
+    frame_geo = {}
+    # Loop through metadata files:
+    for file_name in metadata_files:
+        file_path = os.sep.join([metadata_path, file_name])
+        # Try to read the information, and skip files which can not be
+        # parsed:
+        try:
+            if file_name == CENTER_FILE_NAME:
+                metadata_txt = read_metadata_txt(file_path)
+                frame_geo['center'] = [
+                    round(normalise_lon(float(metadata_txt['center_lon'])), 3),
+                    round(float(metadata_txt['center_lat']), 3)
+                ]
+            elif file_name.endswith(BOUNDS_FILE_MATCH):
+                west, south, east, north = read_geotiff_bounds(file_path)
+                # Full width bounds are not normalised:
+                if east - west < 360:
+                    west = normalise_lon(west)
+                    east = normalise_lon(east)
+                frame_geo['bbox'] = [round(west, 3), round(south, 3),
+                                     round(east, 3), round(north, 3)]
+        except (OSError, KeyError, ValueError, IndexError, struct.error):
+            continue
+    # Return the information:
+    return frame_geo
+
+def get_lon_ranges(west, east):
+    """
+    Split a longitude range which may cross the antimeridian in to one or
+    two ranges which do not
+    """
+    if west <= east:
+        return [(west, east)]
+    return [(west, 180), (-180, east)]
+
+def get_cells(bbox, cell_size):
+    """
+    Get the names of the grid cells which overlap a bounding box
+    """
+    # Init list of cells:
+    cells = []
+    west, south, east, north = bbox
+    # Range of latitude cell indexes:
+    lat_start = int(math.floor(south / cell_size))
+    lat_end = int(math.floor(north / cell_size))
+    # Loop through longitude ranges:
+    for lon_west, lon_east in get_lon_ranges(west, east):
+        for i in range(int(math.floor(lon_west / cell_size)),
+                       int(math.floor(lon_east / cell_size)) + 1):
+            for j in range(lat_start, lat_end + 1):
+                cells.append('{0},{1}'.format(i, j))
+    # Return the cells:
+    return cells
+
+def get_frame_bbox(frame_geo):
+    """
+    Get the bounding box for a frame from its geographic information. If
+    no bbox is available, the bbox of the center is used. Returns None if
+    no information is available
+    """
+    if 'bbox' in frame_geo:
+        return frame_geo['bbox']
+    if 'center' in frame_geo:
+        return frame_geo['center'] * 2
+    return None
+
+def build_index(frames_geo, cell_size=CELL_SIZE):
+    """
+    Build the spatial index from a dict of geographic information for each
+    frame. The index lists the frames and their bounding boxes, and the
+    indexes of the frames which overlap each grid cell
+    """
+    # Init index:
+    index = {
+        'version': SPATIAL_VERSION,
+        'cell_size': cell_size,
+        'frames': [],
+        'bboxes': [],
+        'cells': {}
+    }
+    # Loop through frames:
+    for frame_id in sorted(frames_geo):
+        # Get the bbox, and skip frames without any information:
+        frame_bbox = get_frame_bbox(frames_geo[frame_id])
+        if frame_bbox is None:
+            continue
+        # Store the frame:
+        frame_index = len(index['frames'])
+        index['frames'].append(frame_id)
+        index['bboxes'].append(frame_bbox)
+        # Add the frame to the cells it overlaps:
+        for cell in get_cells(frame_bbox, cell_size):
+            index['cells'].setdefault(cell, []).append(frame_index)
+    # Return the index:
+    return index
+
+def bboxes_overlap(bbox_a, bbox_b):
+    """
+    Check if two bounding boxes overlap
+    """
+    # Check latitudes:
+    if bbox_a[1] > bbox_b[3] or bbox_a[3] < bbox_b[1]:
+        return False
+    # Check longitudes:
+    for west_a, east_a in get_lon_ranges(bbox_a[0], bbox_a[2]):
+        for west_b, east_b in get_lon_ranges(bbox_b[0], bbox_b[2]):
+            if west_a <= east_b and east_a >= west_b:
+                return True
+    return False
+
+def query_bbox(index, west, south, east, north):
+    """
+    Query the spatial index for frames which overlap a bounding box. Returns
+    a sorted list of frame ids
+    """
+    # Query bbox:
+    bbox = [normalise_lon(west), south, normalise_lon(east), north]
+    # Init set of frame indexes:
+    frame_indexes = set()
+    # Loop through cells which overlap the bbox:
+    for cell in get_cells(bbox, index['cell_size']):
+        for frame_index in index['cells'].get(cell, []):
+            # Check the frame bbox overlaps the query:
+            if frame_index not in frame_indexes and bboxes_overlap(
+                bbox, index['bboxes'][frame_index]
+            ):
+                frame_indexes.add(frame_index)
+    # Return the frame ids:
+    return [index['frames'][i] for i in sorted(frame_indexes)]
+
+def query_point(index, lon, lat):
+    """
+    Query the spatial index for frames which contain a point. Returns a
+    sorted list of frame ids
+    """
+    return query_bbox(index, lon, lat, lon, lat)
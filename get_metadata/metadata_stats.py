@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""
+Timing and counting statistics for the LiCSAR metadata crawl
+"""
+
+# ---
+
+# std lib imports:
+import contextlib
+import json
+import os
+import time
+
+# ---
+
+# Number of frames listed in the slowest frames report:
+TOP_COUNT = 20
+
+# ---
+
+def get_cpu_time(include_children=False):
+    """
+    Return the CPU time used by this process, optionally including waited
+    for child processes
+    """
+    process_times = os.times()
+    cpu_time = process_times.user + process_times.system
+    if include_children:
+        cpu_time += process_times.children_user + process_times.children_system
+    return cpu_time
+
+class CrawlStats(object):
+    """
+    Statistics for a crawl. Records wall and CPU time for each phase of the
+    crawl, the cost of each task run by the scanning pool, counts of
+    directories, files and stat calls for each frame, and utilisation of
+    the scanning workers
+    """
+
+    def __init__(self, top_count=TOP_COUNT):
+        # Number of frames in the slowest frames report:
+        self.top_count = top_count
+        # Time at which stats were started:
+        self.start_time = time.time()
+        # Wall and CPU time for each phase, in the order first recorded:
+        self.phases = {}
+        # Information for each frame:
+        self.frames = {}
+        # Worker information:
+        self.workers = {
+            'type': None,
+            'count': 0,
+            'tasks': 0,
+            'busy_time': 0.0,
+            'start': None,
+            'end': None
+        }
+
+    @contextlib.contextmanager
+    def phase(self, phase_name):
+        """
+        Context manager which adds the wall and CPU time of the enclosed
+        code to a phase. A phase may be timed several times, and the times
+        are summed
+        """
+        # Start times:
+        wall_start = time.perf_counter()
+        cpu_start = get_cpu_time(True)
+        try:
+            yield
+        finally:
+            # Add the times to the phase:
+            phase = self.phases.setdefault(
+                phase_name, {'wall': 0.0, 'cpu': 0.0, 'count': 0}
+            )
+            phase['wall'] += time.perf_counter() - wall_start
+            phase['cpu'] += get_cpu_time(True) - cpu_start
+            phase['count'] += 1
+
+    def start_workers(self, worker_type, worker_count):
+        """
+        Record the type and number of scanning workers, and the time at
+        which they were started
+        """
+        self.workers['type'] = worker_type
+        self.workers['count'] = worker_count
+        self.workers['start'] = time.perf_counter()
+
+    def end_workers(self):
+        """
+        Record the time at which the scanning workers were finished
+        """
+        self.workers['end'] = time.perf_counter()
+
+    def start_frame(self, frame_id):
+        """
+        Record the time at which work on a frame was started
+        """
+        self.frames[frame_id] = {
+            'id': frame_id,
+            'start': time.perf_counter(),
+            'wall': None,
+            'scan_time': 0.0,
+            'cpu': 0.0,
+            'tasks': 0,
+            'dirs': 0,
+            'scanned_dirs': 0,
+            'files': 0,
+            'stats': 0
+        }
+
+    def add_task(self, task_out):
+        """
+        Add the timings and counts returned by a task to the information
+        for its frame and the workers
+        """
+        # Task timings and counts:
+        task_stats = task_out['stats']
+        # Update frame information:
+        frame = self.frames[task_out['id']]
+        frame['scan_time'] += task_stats['duration']
+        frame['cpu'] += task_stats['cpu']
+        frame['tasks'] += 1
+        for count_key in ['dirs', 'scanned_dirs', 'files', 'stats']:
+            frame[count_key] += task_stats.get(count_key, 0)
+        # Update worker information:
+        self.workers['tasks'] += 1
+        self.workers['busy_time'] += task_stats['duration']
+
+    def end_frame(self, frame_id):
+        """
+        Record the time at which a frame was completed
+        """
+        frame = self.frames[frame_id]
+        frame['wall'] = time.perf_counter() - frame['start']
+
+    def get_stats(self):
+        """
+        Return all statistics as a dict
+        """
+        # Phases:
+        phases = {}
+        for phase_name, phase in self.phases.items():
+            phases[phase_name] = {
+                'wall': round(phase['wall'], 6),
+                'cpu': round(phase['cpu'], 6),
+                'count': phase['count']
+            }
+        # Frames, sorted by scan time:
+        frames = []
+        for frame in sorted(self.frames.values(),
+                            key=lambda i: (-i['scan_time'], i['id'])):
+            frame_stats = {i: frame[i] for i in frame if i != 'start'}
+            for time_key in ['wall', 'scan_time', 'cpu']:
+                if frame_stats[time_key] is not None:
+                    frame_stats[time_key] = round(frame_stats[time_key], 6)
+            frames.append(frame_stats)
+        # Totals:
+        totals = {'frames': len(frames)}
+        for count_key in ['tasks', 'dirs', 'scanned_dirs', 'files', 'stats']:
+            totals[count_key] = sum(i[count_key] for i in frames)
+        # Worker utilisation, as the fraction of available worker time
+        # which was spent running tasks:
+        workers = {
+            'type': self.workers['type'],
+            'count': self.workers['count'],
+            'tasks': self.workers['tasks'],
+            'busy_time': round(self.workers['busy_time'], 6)
+        }
+        if self.workers['start'] is not None and (
+            self.workers['end'] is not None
+        ):
+            workers_time = self.workers['end'] - self.workers['start']
+            workers['wall'] = round(workers_time, 6)
+            if workers_time > 0 and self.workers['count'] > 0:
+                workers['utilisation'] = round(
+                    self.workers['busy_time'] /
+                    (workers_time * self.workers['count']), 4
+                )
+        # Throughput:
+        crawl_time = workers.get('wall')
+        if crawl_time:
+            totals['dirs_per_second'] = round(totals['dirs'] / crawl_time, 1)
+            totals['files_per_second'] = round(
+                totals['files'] / crawl_time, 1
+            )
+        # Return the statistics:
+        return {
+            'start_time': time.strftime(
+                '%Y-%m-%dT%H:%M:%S', time.localtime(self.start_time)
+            ),
+            'phases': phases,
+            'workers': workers,
+            'totals': totals,
+            'slowest_frames': [i['id'] for i in frames[:self.top_count]],
+            'frames': frames
+        }
+
+    def save(self, stats_path):
+        """
+        Save the statistics as JSON
+        """
+        # Make output directory if required:
+        stats_dir = os.path.dirname(stats_path)
+        if stats_dir and not os.path.exists(stats_dir):
+            os.makedirs(stats_dir, exist_ok=True)
+        # Write the statistics:
+        with open(stats_path, 'w') as stats_file:
+            json.dump(self.get_stats(), stats_file, indent=1)
+
+    def format_report(self):
+        """
+        Return a short text report of phase times, worker utilisation and
+        the slowest frames
+        """
+        # Get the statistics:
+        stats = self.get_stats()
+        # Init report lines:
+        report = []
+        # Phase times:
+        for phase_name, phase in stats['phases'].items():
+            report.append('{0} : {1:.02f} s wall, {2:.02f} s cpu'.format(
+                phase_name, phase['wall'], phase['cpu']
+            ))
+        # Worker utilisation:
+        if 'utilisation' in stats['workers']:
+            report.append('worker utilisation : {0:.01f}% of {1} {2}'.format(
+                stats['workers']['utilisation'] * 100,
+                stats['workers']['count'], stats['workers']['type']
+            ))
+        # Slowest frames:
+        frames = stats['frames'][:min(self.top_count, 5)]
+        if frames:
+            report.append('slowest frames :')
+        for frame in frames:
+            report.append(
+                '  {0} : {1:.02f} s scan, {2} dirs, {3} files'.format(
+                    frame['id'], frame['scan_time'], frame['dirs'],
+                    frame['files']
+                )
+            )
+        # Return the report:
+        return '\n'.join(report)
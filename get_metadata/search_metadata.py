@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Search LiCSAR metadata for files, and write the results as a list of files
+or as a download script
+"""
+
+# ---
+
+# std lib imports:
+import argparse
+import gzip
+import io
+import json
+import os
+import sys
+# third party imports:
+import numpy as np
+# local imports:
+import metadata_format
+import metadata_manifest
+import metadata_products
+import metadata_spatial
+
+# ---
+
+# Remote base urls for licsar products, as used by the search site:
+REMOTE_BASE_URL = (
+    'https://gws-access.jasmin.ac.uk/public/nceo_geohazards/LiCSAR_products'
+)
+REMOTE_LINKS_BASE_URL = (
+    'https://data.ceda.ac.uk/neodc/comet/data/licsar_products'
+)
+
+# Path to metadata, relative to this script:
+METADATA_PATH = '../metadata'
+
+# Path to download script template, relative to this script:
+SCRIPT_TEMPLATE = '../LiCSAR_data_search_scripts/get_licsar_files.py'
+
+# Default epoch and interferogram file patterns, as selected by default on
+# the search site, from the product schema:
+PRODUCTS = metadata_products.load_products()
+EPOCH_FILES = metadata_products.get_patterns(PRODUCTS, 'epoch_files', True)
+IFG_FILES = metadata_products.get_patterns(PRODUCTS, 'ifg_files', True)
+
+# Output formats:
+OUTPUT_FORMATS = ['script', 'manifest', 'urls', 'json']
+
+# ---
+
+def count_bits(values, bit_count):
+    """
+    Count the bits which are set in each value of an integer array,
+    considering the lowest bit_count bits
+    """
+    # Init counts:
+    counts = np.zeros(values.shape, dtype=np.int64)
+    # Add each bit:
+    for i in range(bit_count):
+        counts += (values >> i) & 1
+    # Return the counts:
+    return counts
+
+def search_entries(encoded, date_keys, start_date, end_date, include_files):
+    """
+    Search compact epoch or interferogram information. Entries are selected
+    if all of their dates are within the start and end dates. Returns a
+    generator of (entry index, file pattern, size, link, mtime) for each
+    matching file, ordered by pattern and then by entry. The mtime is None
+    if mtimes were not recorded
+    """
+    # File bitmasks:
+    files_masks = np.asarray(encoded['files'], dtype=np.int64)
+    # Nothing to do if no entries:
+    if files_masks.size == 0:
+        return
+    links_masks = np.asarray(encoded['links'], dtype=np.int64)
+    sizes = np.asarray(encoded['sizes'], dtype=np.int64)
+    # File mtimes are stored as differences from the previous mtime:
+    mtimes = None
+    if 'mtimes' in encoded:
+        mtimes = np.cumsum(np.asarray(encoded['mtimes'], dtype=np.int64))
+    patterns = encoded['patterns']
+    # Index of the first size value for each entry:
+    file_counts = count_bits(files_masks, len(patterns))
+    size_offsets = np.cumsum(file_counts) - file_counts
+    # Date mask:
+    date_mask = np.ones(files_masks.shape, dtype=bool)
+    for date_key in date_keys:
+        dates = np.asarray(encoded['{0}s'.format(date_key)], dtype=np.int64)
+        if start_date is not None:
+            date_mask &= dates >= start_date
+        if end_date is not None:
+            date_mask &= dates <= end_date
+    # Loop through requested file patterns which are present:
+    for pattern_index, file_pattern in enumerate(patterns):
+        if file_pattern not in include_files:
+            continue
+        # Bit value for this pattern:
+        pattern_bit = 1 << pattern_index
+        # Entries which match:
+        entry_indexes = np.flatnonzero(
+            date_mask & ((files_masks & pattern_bit) != 0)
+        )
+        if entry_indexes.size == 0:
+            continue
+        # Index of the size value for each file is the entry offset plus the
+        # number of files for lower patterns:
+        size_indexes = size_offsets[entry_indexes] + count_bits(
+            files_masks[entry_indexes] & (pattern_bit - 1), pattern_index
+        )
+        file_sizes = sizes[size_indexes]
+        file_links = (links_masks[entry_indexes] & pattern_bit) != 0
+        if mtimes is None:
+            file_mtimes = [None] * entry_indexes.size
+        else:
+            file_mtimes = mtimes[size_indexes].tolist()
+        # Return the files:
+        for entry_index, file_size, file_link, file_mtime in zip(
+            entry_indexes.tolist(), file_sizes.tolist(), file_links.tolist(),
+            file_mtimes
+        ):
+            yield entry_index, file_pattern, file_size, file_link, file_mtime
+
+def get_file_url(remote_path, file_link):
+    """
+    Return the url for a file, from the remote path relative to the products
+    directory, and the link information
+    """
+    if file_link:
+        return '/'.join([REMOTE_LINKS_BASE_URL, remote_path])
+    return '/'.join([REMOTE_BASE_URL, remote_path])
+
+def search_frame(frame_data, start_date=None, end_date=None,
+                 include_metadata=True, metadata_files=None,
+                 epoch_files=EPOCH_FILES, ifg_files=IFG_FILES):
+    """
+    Search compact frame metadata for files. Returns a generator of dicts
+    for each file, containing the name, path, url, size and mtime of the
+    file, in the format used by the download scripts. The mtime is None if
+    it was not recorded. If metadata_files is not None, only metadata
+    files ending with one of the listed patterns are included
+    """
+    # Frame id and remote path:
+    frame_id = frame_data['id']
+    remote_path = frame_data['path']
+    # Metadata files:
+    if include_metadata:
+        metadata = frame_data['metadata']
+        metadata_mtimes = metadata.get(
+            'mtimes', [None] * len(metadata.get('files', []))
+        )
+        for file_name, file_size, file_link, file_mtime in zip(
+            metadata.get('files', []), metadata.get('sizes', []),
+            metadata.get('links', []), metadata_mtimes
+        ):
+            if metadata_files is not None and not any(
+                file_name.endswith(i) for i in metadata_files
+            ):
+                continue
+            yield {
+                'name': file_name,
+                'path': '{0}/metadata'.format(frame_id),
+                'url': get_file_url('{0}/metadata/{1}'.format(
+                    remote_path, file_name
+                ), file_link),
+                'size': file_size,
+                'mtime': file_mtime
+            }
+    # Epoch files:
+    epochs = frame_data['epochs']
+    for epoch_file in search_entries(
+        epochs, ['date'], start_date, end_date, epoch_files
+    ):
+        epoch_index, file_pattern, file_size, file_link, file_mtime = (
+            epoch_file
+        )
+        epoch_dir = str(epochs['dates'][epoch_index])
+        file_name = '{0}.{1}'.format(epoch_dir, file_pattern)
+        yield {
+            'name': file_name,
+            'path': '{0}/epochs/{1}'.format(frame_id, epoch_dir),
+            'url': get_file_url('{0}/epochs/{1}/{2}'.format(
+                remote_path, epoch_dir, file_name
+            ), file_link),
+            'size': file_size,
+            'mtime': file_mtime
+        }
+    # Interferogram files. Linked interferograms are not stored in an
+    # interferograms directory:
+    ifgs = frame_data['ifgs']
+    for ifg_file in search_entries(
+        ifgs, ['start', 'end'], start_date, end_date, ifg_files
+    ):
+        ifg_index, file_pattern, file_size, file_link, file_mtime = ifg_file
+        ifg_dir = '{0}_{1}'.format(
+            ifgs['starts'][ifg_index], ifgs['ends'][ifg_index]
+        )
+        file_name = '{0}.{1}'.format(ifg_dir, file_pattern)
+        if file_link:
+            ifg_path = '{0}/{1}/{2}'.format(remote_path, ifg_dir, file_name)
+        else:
+            ifg_path = '{0}/interferograms/{1}/{2}'.format(
+                remote_path, ifg_dir, file_name
+            )
+        yield {
+            'name': file_name,
+            'path': '{0}/interferograms/{1}'.format(frame_id, ifg_dir),
+            'url': get_file_url(ifg_path, file_link),
+            'size': file_size,
+            'mtime': file_mtime
+        }
+
+def summary_has_results(frame_summary, summary, start_date, end_date,
+                        include_metadata, epoch_files, ifg_files):
+    """
+    Check the frames summary for whether a search could return any files for
+    a frame
+    """
+    # Check metadata:
+    if include_metadata and any(frame_summary['metadata_sizes']):
+        return True
+    # Check dates:
+    if frame_summary['first'] is None:
+        return False
+    if start_date is not None and frame_summary['last'] < start_date:
+        return False
+    if end_date is not None and frame_summary['first'] > end_date:
+        return False
+    # Check epoch and interferogram files:
+    for files_key, sizes_key, include_files in [
+        ('epoch_files', 'epoch_sizes', epoch_files),
+        ('ifg_files', 'ifg_sizes', ifg_files)
+    ]:
+        for file_pattern, file_size in zip(summary[files_key],
+                                           frame_summary[sizes_key]):
+            if file_pattern in include_files and file_size > 0:
+                return True
+    # No results:
+    return False
+
+def get_frame_ids(metadata_path, frame_ids=None, tracks=None, point=None,
+                  bbox=None):
+    """
+    Get the list of frame ids to search, from frames.json in the metadata
+    path. If frame_ids is given, only those frames are returned, and if
+    tracks is given, only frames from those tracks are returned. If a point
+    (longitude, latitude) and / or bbox (west, south, east, north) is given,
+    only frames which overlap them in the spatial index are returned
+    """
+    # Load all frame ids:
+    all_frame_ids = metadata_format.load_json(
+        os.sep.join([metadata_path, 'frames.json'])
+    )
+    # Filter frame ids using the spatial index:
+    if point or bbox:
+        spatial_index = metadata_format.load_json(
+            os.sep.join([metadata_path, 'frames_spatial.json'])
+        )
+        if point:
+            point_frame_ids = set(
+                metadata_spatial.query_point(spatial_index, *point)
+            )
+            all_frame_ids = [i for i in all_frame_ids if i in point_frame_ids]
+        if bbox:
+            bbox_frame_ids = set(
+                metadata_spatial.query_bbox(spatial_index, *bbox)
+            )
+            all_frame_ids = [i for i in all_frame_ids if i in bbox_frame_ids]
+    # Filter frame ids:
+    if frame_ids:
+        frame_ids = set(frame_ids)
+        all_frame_ids = [i for i in all_frame_ids if i in frame_ids]
+    if tracks:
+        tracks = set(int(i) for i in tracks)
+        all_frame_ids = [i for i in all_frame_ids if int(i[:3]) in tracks]
+    # Return the frame ids:
+    return all_frame_ids
+
+def search_files(metadata_path, frame_ids, start_date=None, end_date=None,
+                 include_metadata=True, metadata_files=None,
+                 epoch_files=EPOCH_FILES, ifg_files=IFG_FILES):
+    """
+    Search the metadata for files from the listed frames. Frames which can
+    not have any results according to the frames summary are not loaded.
+    Returns a generator of dicts for each file, as for search_frame
+    """
+    # Load the frames summary if available:
+    summary = None
+    try:
+        summary = metadata_format.load_json(
+            os.sep.join([metadata_path, 'frames_summary.json'])
+        )
+    except (OSError, ValueError):
+        pass
+    # Loop through frames:
+    for frame_id in frame_ids:
+        # Check the summary for this frame:
+        if summary and frame_id in summary['frames'] and not (
+            summary_has_results(
+                summary['frames'][frame_id], summary, start_date, end_date,
+                include_metadata, epoch_files, ifg_files
+            )
+        ):
+            continue
+        # Load the frame metadata:
+        frame_data = metadata_format.read_frame_compact(
+            metadata_path, frame_id, start_date, end_date
+        )
+        # Search the frame:
+        for file_info in search_frame(
+            frame_data, start_date, end_date, include_metadata,
+            metadata_files, epoch_files, ifg_files
+        ):
+            yield file_info
+
+def write_results(files, out_file, output_format='script',
+                  script_template=SCRIPT_TEMPLATE):
+    """
+    Write search results to an open file as they are found. A download
+    script has the manifest of files embedded at the end of the template,
+    compressed. Returns the number of files and the total size
+    """
+    # Base urls, for the manifest:
+    base_urls = [REMOTE_BASE_URL, REMOTE_LINKS_BASE_URL]
+    # Download script, with the embedded manifest at the files placeholder:
+    if output_format == 'script':
+        with open(script_template, 'r') as template_file:
+            template = template_file.read()
+        template_head, template_tail = template.split('{{ FILES }}\n', 1)
+        out_file.write(template_head)
+        file_count, total_size = metadata_manifest.embed_manifest(
+            files, out_file, base_urls
+        )
+        out_file.write(template_tail)
+        return file_count, total_size
+    # Manifest file:
+    if output_format == 'manifest':
+        return metadata_manifest.write_manifest(files, out_file, base_urls)
+    # Init count and size:
+    file_count = 0
+    total_size = 0
+    # Loop through files:
+    for file_info in files:
+        # Write the file information:
+        if output_format == 'urls':
+            out_file.write('{0}\n'.format(file_info['url']))
+        else:
+            out_file.write('{0}\n'.format(json.dumps(file_info)))
+        # Update count and size:
+        file_count += 1
+        total_size += file_info['size']
+    # Return the count and size:
+    return file_count, total_size
+
+def open_output(out_path):
+    """
+    Open an output file for writing text. Files with a .gz suffix are gzip
+    compressed
+    """
+    if out_path.endswith('.gz'):
+        # The mtime is fixed, so the content only changes if the results
+        # change:
+        return io.TextIOWrapper(gzip.GzipFile(out_path, 'wb', mtime=0))
+    return open(out_path, 'w')
+
+def parse_date(date_str):
+    """
+    Parse a date string in the format YYYYMMDD or YYYY-MM-DD
+    """
+    return int(date_str.replace('-', ''))
+
+def parse_args():
+    """
+    Parse command line arguments
+    """
+    # Directory containing this script, for default paths:
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    # Create the argument parser:
+    arg_parser = argparse.ArgumentParser(
+        description=('Search LiCSAR metadata for files, and write the '
+                     'results as a list of files or as a download script')
+    )
+    arg_parser.add_argument(
+        'frame_ids', nargs='*',
+        help='frame ids to search (default: all frames)'
+    )
+    arg_parser.add_argument(
+        '--metadata-path',
+        default=os.path.join(script_dir, METADATA_PATH),
+        help='path to metadata (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--track', action='append', type=int,
+        help='only search frames from this track (can be repeated)'
+    )
+    arg_parser.add_argument(
+        '--point', nargs=2, type=float, metavar=('LON', 'LAT'),
+        help='only search frames which contain this point'
+    )
+    arg_parser.add_argument(
+        '--bbox', nargs=4, type=float,
+        metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'),
+        help='only search frames which overlap this bounding box'
+    )
+    arg_parser.add_argument(
+        '--start-date', type=parse_date,
+        help='start date, YYYYMMDD or YYYY-MM-DD'
+    )
+    arg_parser.add_argument(
+        '--end-date', type=parse_date,
+        help='end date, YYYYMMDD or YYYY-MM-DD'
+    )
+    arg_parser.add_argument(
+        '--epoch-files', nargs='*', default=EPOCH_FILES,
+        help='epoch file patterns to include (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--ifg-files', nargs='*', default=IFG_FILES,
+        help='interferogram file patterns to include (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '--metadata-files', nargs='*', default=None,
+        help='metadata file patterns to include (default: all)'
+    )
+    arg_parser.add_argument(
+        '--no-metadata', action='store_true',
+        help='do not include metadata files'
+    )
+    arg_parser.add_argument(
+        '-f', '--format', default='script', choices=OUTPUT_FORMATS,
+        help=('output format, a python download script, the manifest of '
+              'files for a download script, urls, or JSON lines '
+              '(default: %(default)s)')
+    )
+    arg_parser.add_argument(
+        '--script-template',
+        default=os.path.join(script_dir, SCRIPT_TEMPLATE),
+        help='path to download script template (default: %(default)s)'
+    )
+    arg_parser.add_argument(
+        '-o', '--output', default='-',
+        help=('output file, gzip compressed if the name ends with .gz '
+              '(default: stdout)')
+    )
+    # Return the parsed arguments:
+    return arg_parser.parse_args()
+
+def main():
+    """
+    Main program function
+    """
+    # Get command line arguments:
+    args = parse_args()
+    # Get the frame ids to search:
+    frame_ids = get_frame_ids(args.metadata_path, args.frame_ids, args.track,
+                              args.point, args.bbox)
+    # Search for files:
+    files = search_files(
+        args.metadata_path, frame_ids, args.start_date, args.end_date,
+        not args.no_metadata, args.metadata_files, args.epoch_files,
+        args.ifg_files
+    )
+    # Write the results:
+    if args.output == '-':
+        file_count, total_size = write_results(
+            files, sys.stdout, args.format, args.script_template
+        )
+    else:
+        with open_output(args.output) as out_file:
+            file_count, total_size = write_results(
+                files, out_file, args.format, args.script_template
+            )
+    # Display a message:
+    err_msg = '{0} files found in {1} frames, {2} bytes\n'
+    sys.stderr.write(err_msg.format(file_count, len(frame_ids), total_size))
+
+if __name__ == '__main__':
+    # Try to catch KeyboardInterrupt:
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.stdout.write('\n')
+        sys.exit()
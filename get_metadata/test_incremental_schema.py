@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Check that incremental crawls find the files of product types which were
+added to the product schema after the crawl cache was written. Run with:
+
+  python3 -m unittest test_incremental_schema
+"""
+
+# ---
+
+# std lib imports:
+import contextlib
+import io
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+# local imports:
+import get_metadata
+import make_fake_products
+import metadata_products
+
+# ---
+
+# Epoch file pattern which is missing from the schema for the first crawl:
+NEW_PATTERN = 'ztd.jpg'
+
+# ---
+
+def use_epoch_patterns(epoch_patterns):
+    """
+    Return a context manager which makes the crawler use a list of epoch file
+    patterns, as if it were loaded from the product schema
+    """
+    products = dict(get_metadata.PRODUCTS)
+    products['epoch_files'] = [i for i in products['epoch_files']
+                               if i['pattern'] in epoch_patterns]
+    return mock.patch.multiple(
+        get_metadata,
+        EPOCH_FILE_MATCH=list(epoch_patterns),
+        EPOCH_FILE_SET=frozenset(epoch_patterns),
+        CACHE_SCHEMA=metadata_products.get_fingerprint(
+            products, ['epoch_files', 'ifg_files']
+        )
+    )
+
+def crawl(tree_path, cache_path, incremental):
+    """
+    Crawl a tree in this process, returning the metadata for each frame
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        frames = get_metadata.get_frames(tree_path)
+        return {i['id']: i for i in get_metadata.scan_frames(
+            tree_path, frames, cache_path, incremental, pool_size=1,
+            thread_count=2, display_progress_info=False
+        )}
+
+def count_pattern(frames_metadata, file_pattern):
+    """
+    Count the epoch files which match a file pattern in all frames
+    """
+    return sum(
+        epoch['files'].count(file_pattern)
+        for frame_metadata in frames_metadata.values()
+        for epoch in frame_metadata['epochs'].values()
+    )
+
+class IncrementalSchemaTest(unittest.TestCase):
+    """
+    Incremental crawls after the product schema changes
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_path = tempfile.mkdtemp(prefix='test_incremental_schema_')
+        cls.tree_path = '{0}/tree'.format(cls.work_path)
+        make_fake_products.make_tree(make_fake_products.get_options(
+            cls.tree_path, tracks=1, frames=2, epochs=20
+        ))
+        cls.full = crawl(cls.tree_path, None, False)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_path, ignore_errors=True)
+
+    def test_pattern_added(self):
+        """
+        Files of a pattern added to the schema are found by an incremental
+        crawl, as by a full crawl
+        """
+        self.assertGreater(count_pattern(self.full, NEW_PATTERN), 0)
+        cache_path = '{0}/cache_added'.format(self.work_path)
+        old_patterns = [i for i in get_metadata.EPOCH_FILE_MATCH
+                        if i != NEW_PATTERN]
+        with use_epoch_patterns(old_patterns):
+            old_crawl = crawl(self.tree_path, cache_path, False)
+        self.assertEqual(count_pattern(old_crawl, NEW_PATTERN), 0)
+        incremental = crawl(self.tree_path, cache_path, True)
+        self.assertEqual(incremental, self.full)
+
+    def test_schema_unchanged(self):
+        """
+        An incremental crawl with an unchanged schema reuses the cache, and
+        gives the same result as a full crawl
+        """
+        cache_path = '{0}/cache_unchanged'.format(self.work_path)
+        crawl(self.tree_path, cache_path, False)
+        with mock.patch.object(get_metadata, 'get_epoch') as get_epoch:
+            incremental = crawl(self.tree_path, cache_path, True)
+        get_epoch.assert_not_called()
+        self.assertEqual(incremental, self.full)
+
+if __name__ == '__main__':
+    unittest.main()
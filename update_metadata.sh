@@ -4,6 +4,10 @@
 WORK_DIR=$(readlink -f $(dirname ${0}))
 # metadata output directory:
 METADATA_DIR="${WORK_DIR}/metadata"
+# manifest of changed and removed metadata files, written by get_metadata:
+MANIFEST="${WORK_DIR}/metadata_state/manifest.txt"
+# manifest of files currently being sent:
+MANIFEST_SENDING="${MANIFEST}.sending"
 # ssh user and host for transfer:
 REMOTE_USER='cometnerc'
 REMOTE_HOST='cometnerc.ssh.wpengine.net'
@@ -16,11 +20,39 @@ SSH_KEY="${WORK_DIR}/ssh_key/rr-cometnerc"
 cd ${WORK_DIR} || exit
 # start message:
 echo "START: $(date)"
-# rsync data to web host:
-rsync \
-  -aS \
-  -e "ssh -o IdentityFile=${SSH_KEY}" \
-  ${METADATA_DIR}/ \
-  ${REMOTE_USER}@${REMOTE_HOST}:${REMOTE_PATH}/
+# if full transfer requested:
+if [ "${1}" == "--full" ] ; then
+  # rsync all data to web host:
+  rsync \
+    -aS \
+    -e "ssh -o IdentityFile=${SSH_KEY}" \
+    ${METADATA_DIR}/ \
+    ${REMOTE_USER}@${REMOTE_HOST}:${REMOTE_PATH}/ && \
+  rm -f ${MANIFEST} ${MANIFEST_SENDING}
+else
+  # add any new changes to the manifest of files to send. any files left
+  # over from a failed transfer will still be listed:
+  if [ -e "${MANIFEST}" ] ; then
+    cat ${MANIFEST} ${MANIFEST_SENDING} 2> /dev/null | \
+      sort -u > ${MANIFEST_SENDING}.tmp && \
+    mv ${MANIFEST_SENDING}.tmp ${MANIFEST_SENDING} && \
+    rm -f ${MANIFEST}
+  fi
+  # if there is anything to send:
+  if [ -s "${MANIFEST_SENDING}" ] ; then
+    # rsync changed files to web host, removing any files which no longer
+    # exist:
+    rsync \
+      -aS \
+      --files-from=${MANIFEST_SENDING} \
+      --delete-missing-args \
+      -e "ssh -o IdentityFile=${SSH_KEY}" \
+      ${METADATA_DIR}/ \
+      ${REMOTE_USER}@${REMOTE_HOST}:${REMOTE_PATH}/ && \
+    rm -f ${MANIFEST_SENDING}
+  else
+    echo "no changed files to send"
+  fi
+fi
 # end message:
 echo "END: $(date)"